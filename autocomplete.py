@@ -0,0 +1,410 @@
+"""
+Autocomplétion multilingue tolérante aux fautes pour la barre de recherche CFA
+Vocabulaire trié par langue (trie implicite parcouru par dichotomie),
+distance d'édition bornée, suggestions classées par popularité
+"""
+
+import heapq
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import load_only, object_session
+
+from src.models.base import db, run_after_commit
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_LANGUAGES = ('fr', 'en', 'ko', 'zh')
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+MAX_QUERY_LENGTH = 64
+# (longueur minimale du mot, fautes tolérées)
+EDIT_DISTANCE_STEPS = ((7, 2), (3, 1))
+# Les premiers caractères doivent être exacts : borne le parcours du trie
+FUZZY_PREFIX_LENGTH = 1
+# Popularité : une mise en favori vaut 10 vues
+LIKE_WEIGHT = 10
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+# Les requêtes d'un ou deux caractères couvrent de grandes plages : résultats mémorisés
+MEMO_MAX_QUERY_LENGTH = 2
+# Requêtes mémorisées (LRU) : borne la mémoire face aux préfixes CJK, très nombreux
+MEMO_MAX_ENTRIES = 2048
+_LAST_CHAR = '\U0010ffff'
+
+def _normalize(text: str) -> str:
+    """Minuscules sans accents ; NFC recompose le hangul décomposé par NFKD"""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(unicodedata.normalize('NFC', stripped).split())
+
+def _max_edits(word: str) -> int:
+    for min_length, edits in EDIT_DISTANCE_STEPS:
+        if len(word) >= min_length:
+            return edits
+    return 0
+
+class _LanguageVocabulary:
+    """Mots triés + postings (−popularité, type, id) triés par popularité décroissante"""
+
+    def __init__(self):
+        self.words: List[str] = []
+        self.postings: Dict[str, List[Tuple[int, str, int]]] = {}
+        self.entry_words: Dict[Tuple[str, int], Set[str]] = {}
+        self.display: Dict[Tuple[str, int], str] = {}
+
+    def add(self, key: Tuple[str, int], text: str, popularity: int, bulk: bool = False) -> None:
+        self.remove(key)
+        words = set(_normalize(text).split())
+        if not words:
+            return
+        self.entry_words[key] = words
+        self.display[key] = text
+        posting_item = (-popularity, key[0], key[1])
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = []
+                if not bulk:
+                    insort(self.words, word)
+            if bulk:
+                posting.append(posting_item)
+            else:
+                insort(posting, posting_item)
+
+    def finish_bulk(self) -> None:
+        self.words = sorted(self.postings)
+        for posting in self.postings.values():
+            posting.sort()
+
+    def remove(self, key: Tuple[str, int]) -> None:
+        words = self.entry_words.pop(key, None)
+        self.display.pop(key, None)
+        if words is None:
+            return
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            posting[:] = [item for item in posting if (item[1], item[2]) != key]
+            if not posting:
+                del self.postings[word]
+                position = bisect_left(self.words, word)
+                if position < len(self.words) and self.words[position] == word:
+                    del self.words[position]
+
+    def _prefix_range(self, prefix: str, low: int = 0, high: int = None) -> Tuple[int, int]:
+        high = len(self.words) if high is None else high
+        start = bisect_left(self.words, prefix, low, high)
+        return start, bisect_left(self.words, prefix + _LAST_CHAR, start, high)
+
+    def fuzzy_ranges(self, query: str, max_edits: int, prefix: bool) -> List[Tuple[int, int, int]]:
+        """
+        Plages [début, fin) de mots à distance <= max_edits de la requête, avec leur distance.
+        prefix=True : la requête peut n'être que le début du mot.
+        Distance d'alignement optimal (Damerau-Levenshtein restreinte) : inverser deux lettres
+        voisines compte pour une seule faute.
+        Parcours en profondeur du trie implicite formé par les mots triés,
+        une ligne de la matrice par nœud, élagué dès que la ligne dépasse max_edits.
+        """
+        words = self.words
+        ranges = []
+        if prefix:
+            start, end = self._prefix_range(query)
+        else:
+            start = bisect_left(words, query)
+            end = start + 1 if start < len(words) and words[start] == query else start
+        if start < end:
+            ranges.append((0, start, end))
+        if max_edits == 0:
+            return ranges
+
+        # Les FUZZY_PREFIX_LENGTH premiers caractères sont exacts : on part de leur sous-arbre
+        depth = min(FUZZY_PREFIX_LENGTH, len(query))
+        low, high = self._prefix_range(query[:depth])
+        size = len(query)
+        out_of_band = max_edits + 1
+        # Le chemin parcouru est query[:depth] : sa distance à query[:j] vaut |depth - j|
+        row = [min(abs(depth - index), out_of_band) for index in range(size + 1)]
+        empty_row = [out_of_band] * (size + 1)
+        # Ligne du nœud parent : nécessaire aux transpositions
+        parent_row = [min(abs(depth - 1 - index), out_of_band) for index in range(size + 1)] if depth else empty_row
+
+        stack = [(low, high, depth, row, parent_row)]
+        while stack:
+            low, high, depth, row, parent_row = stack.pop()
+            distance = row[-1]
+            if distance <= max_edits:
+                if prefix:
+                    # Tout le sous-arbre correspond ; les préfixes exacts (distance 0) sont déjà en tête
+                    if distance:
+                        ranges.append((distance, low, high))
+                    continue
+                if distance and low < high and len(words[low]) == depth:
+                    ranges.append((distance, low, low + 1))
+
+            position = low
+            while position < high and len(words[position]) == depth:
+                position += 1
+            # Bande de Ukkonen : hors de la diagonale ± max_edits, la distance dépasse la borne
+            band = range(max(1, depth + 1 - max_edits), min(size, depth + 1 + max_edits) + 1)
+            while position < high:
+                word = words[position]
+                char = word[depth]
+                previous_char = word[depth - 1] if depth else None
+                child_high = bisect_left(words, word[:depth + 1] + _LAST_CHAR, position, high)
+                child_row = empty_row[:]
+                child_row[0] = best = depth + 1
+                for index in band:
+                    value = min(child_row[index - 1] + 1, row[index] + 1,
+                                row[index - 1] + (query[index - 1] != char))
+                    if (index > 1 and query[index - 1] == previous_char and query[index - 2] == char
+                            and parent_row[index - 2] + 1 < value):
+                        value = parent_row[index - 2] + 1
+                    child_row[index] = value
+                    if value < best:
+                        best = value
+                if best <= max_edits:
+                    stack.append((position, child_high, depth + 1, child_row, row))
+                position = child_high
+        return ranges
+
+    def matching_entries(self, word: str, prefix: bool) -> Dict[Tuple[str, int], int]:
+        """Entrées contenant un mot proche de `word`, avec la meilleure distance"""
+        entries = {}
+        for distance, start, end in self.fuzzy_ranges(word, _max_edits(word), prefix):
+            for matched_word in self.words[start:end]:
+                for _, kind, entry_id in self.postings[matched_word]:
+                    key = (kind, entry_id)
+                    if entries.get(key, distance + 1) > distance:
+                        entries[key] = distance
+        return entries
+
+    def suggest(self, query: str, limit: int) -> List[Tuple[str, int]]:
+        """Clés des meilleures entrées : moins de fautes d'abord, puis plus populaires"""
+        words = query.split()
+        if not words:
+            return []
+
+        # Les mots complets filtrent, le dernier (en cours de saisie) est un préfixe
+        allowed = None
+        for word in words[:-1]:
+            matches = set(self.matching_entries(word, prefix=False))
+            allowed = matches if allowed is None else allowed & matches
+            if not allowed:
+                return []
+
+        last = words[-1]
+        ranges = sorted(self.fuzzy_ranges(last, _max_edits(last), prefix=True))
+        results, seen = [], set()
+        for distance in sorted({distance for distance, _, _ in ranges}):
+            postings = [self.postings[word]
+                        for tier_distance, start, end in ranges if tier_distance == distance
+                        for word in self.words[start:end]]
+            # Fusion k-voies des postings déjà triés : on s'arrête aux `limit` premiers
+            heap = [(posting[0], index, 0) for index, posting in enumerate(postings)]
+            heapq.heapify(heap)
+            while heap:
+                (_, kind, entry_id), index, position = heap[0]
+                if position + 1 < len(postings[index]):
+                    heapq.heapreplace(heap, (postings[index][position + 1], index, position + 1))
+                else:
+                    heapq.heappop(heap)
+                key = (kind, entry_id)
+                if key in seen or (allowed is not None and key not in allowed):
+                    continue
+                seen.add(key)
+                results.append(key)
+                if len(results) >= limit:
+                    return results
+        return results
+
+class AutocompleteIndex:
+    """Index d'autocomplétion des noms de produits et titres de recettes, par langue"""
+
+    def __init__(self):
+        self.languages = {language: _LanguageVocabulary() for language in AUTOCOMPLETE_LANGUAGES}
+        self.is_ready = False
+        self.is_refreshing = False
+        self._product_sales: Dict[int, int] = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    @staticmethod
+    def _recipe_texts(recipe) -> Dict[str, str]:
+        # Même repli sur le titre français que get_localized_content
+        return {
+            language: (getattr(recipe, f'title_{language}') if language != 'fr' else None) or recipe.title
+            for language in AUTOCOMPLETE_LANGUAGES
+        }
+
+    @staticmethod
+    def _recipe_popularity(recipe) -> int:
+        return (recipe.views_count or 0) + LIKE_WEIGHT * (recipe.likes_count or 0)
+
+    def _recipe_entry(self, recipe) -> Optional[Tuple[Dict[str, str], int]]:
+        """(textes par langue, popularité) ; None pour retirer la recette (non publiée)"""
+        if not recipe.is_published:
+            return None
+        return self._recipe_texts(recipe), self._recipe_popularity(recipe)
+
+    @staticmethod
+    def _apply_entry(languages, key: Tuple[str, int], texts: Optional[Dict[str, str]],
+                     popularity: int = 0, bulk: bool = False) -> None:
+        if texts is None:
+            for vocabulary in languages.values():
+                vocabulary.remove(key)
+            return
+        for language, text in texts.items():
+            languages[language].add(key, text, popularity, bulk)
+
+    def _apply_recipe(self, languages, recipe, bulk: bool = False) -> None:
+        texts, popularity = self._recipe_entry(recipe) or (None, 0)
+        self._apply_entry(languages, ('recipe', recipe.id), texts, popularity, bulk)
+
+    def _product_texts(self, product) -> Optional[Dict[str, str]]:
+        # Un nom unique, indexé dans toutes les langues
+        return dict.fromkeys(AUTOCOMPLETE_LANGUAGES, product.name) if product.is_active else None
+
+    def _apply_product(self, languages, product, bulk: bool = False) -> None:
+        # Les ventes ne bougent qu'à la reconstruction périodique
+        self._apply_entry(languages, ('product', product.id), self._product_texts(product),
+                          self._product_sales.get(product.id, 0), bulk)
+
+    def _apply_committed(self, key: Tuple[str, int], texts: Optional[Dict[str, str]], popularity: int) -> None:
+        with self._lock:
+            self._apply_entry(self.languages, key, texts, popularity)
+            self._memo.clear()
+
+    def on_recipe_write(self, connection, recipe, operation: str) -> None:
+        """Listener d'écriture des recettes : valeurs lues pendant le flush, index modifié au commit seulement"""
+        if not self.is_ready:
+            return
+        # Rien n'est lu sur l'objet dans le callback : il est expiré après le commit
+        key = ('recipe', recipe.id)
+        texts, popularity = (None if operation == 'delete' else self._recipe_entry(recipe)) or (None, 0)
+        run_after_commit(object_session(recipe), lambda: self._apply_committed(key, texts, popularity))
+
+    def on_product_write(self, product, operation: str) -> None:
+        """Listener d'écriture des produits : même principe que on_recipe_write"""
+        if not self.is_ready:
+            return
+        key = ('product', product.id)
+        texts = None if operation == 'delete' else self._product_texts(product)
+        popularity = self._product_sales.get(product.id, 0)
+        run_after_commit(object_session(product), lambda: self._apply_committed(key, texts, popularity))
+
+    def suggest(self, query: str, language: str = 'fr', limit: int = DEFAULT_LIMIT) -> Optional[List[Dict]]:
+        """[{'text', 'type', 'id'}] ; None si l'index n'est pas encore construit"""
+        if not self.is_ready:
+            return None
+        if language not in self.languages:
+            language = 'fr'
+        limit = max(1, min(limit, MAX_LIMIT))
+        normalized = _normalize(query[:MAX_QUERY_LENGTH])
+        if not normalized:
+            return []
+
+        memo_key = (language, normalized, limit) if len(normalized) <= MEMO_MAX_QUERY_LENGTH else None
+        with self._lock:
+            # Lu sous le verrou : une écriture commitée peut vider le memo entre-temps
+            suggestions = self._memo.get(memo_key) if memo_key else None
+            if suggestions is not None:
+                self._memo.move_to_end(memo_key)
+                return suggestions
+
+            vocabulary = self.languages[language]
+            suggestions = [
+                {'text': vocabulary.display[key], 'type': key[0], 'id': key[1]}
+                for key in vocabulary.suggest(normalized, limit)
+            ]
+            if memo_key:
+                self._memo[memo_key] = suggestions
+                while len(self._memo) > MEMO_MAX_ENTRIES:
+                    self._memo.popitem(last=False)
+        return suggestions
+
+    def rebuild(self) -> int:
+        """Reconstruit l'index (popularités comprises) en un passage"""
+        from recipe import Recipe
+        from src.models.order import OrderItem
+        from src.models.product import Product
+
+        languages = {language: _LanguageVocabulary() for language in AUTOCOMPLETE_LANGUAGES}
+        recipes = Recipe.query.options(
+            load_only(Recipe.id, Recipe.title, Recipe.views_count, Recipe.likes_count, Recipe.is_published),
+            *Recipe.language_load_options(*AUTOCOMPLETE_LANGUAGES)
+        ).filter(Recipe.is_published == True)
+        count = 0
+        for recipe in recipes.yield_per(500):
+            self._apply_recipe(languages, recipe, bulk=True)
+            count += 1
+
+        self._product_sales = {
+            product_id: int(quantity or 0)
+            for product_id, quantity in db.session.query(OrderItem.product_id, db.func.sum(OrderItem.quantity))
+                                                  .group_by(OrderItem.product_id)
+        }
+        products = Product.query.options(load_only(Product.id, Product.name, Product.is_active))\
+                                .filter(Product.is_active == True)
+        for product in products.yield_per(500):
+            self._apply_product(languages, product, bulk=True)
+            count += 1
+
+        for vocabulary in languages.values():
+            vocabulary.finish_bulk()
+        with self._lock:
+            self.languages = languages
+            self._memo = OrderedDict()
+            self.is_ready = True
+        logger.info("Index d'autocomplétion reconstruit pour %s entrées", count)
+        return count
+
+    def ensure_ready(self) -> None:
+        """Construit l'index s'il ne l'est pas encore ; une seule construction sous requêtes concurrentes"""
+        if self.is_ready:
+            return
+        with self._build_lock:
+            if not self.is_ready:
+                self.rebuild()
+
+    def start_refresh(self, app, interval_seconds: int = DEFAULT_REFRESH_INTERVAL_SECONDS):
+        """Reconstruction périodique : popularités et écritures des autres processus"""
+        if not self.is_refreshing:
+            self.is_refreshing = True
+            threading.Thread(target=self._refresh_loop, args=(app, interval_seconds), daemon=True).start()
+
+    def stop_refresh(self):
+        self.is_refreshing = False
+
+    def _refresh_loop(self, app, interval_seconds: int):
+        with app.app_context():
+            while self.is_refreshing:
+                # Première construction au démarrage (ou à la première requête, voir ensure_ready)
+                time.sleep(interval_seconds)
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    logger.error("Erreur reconstruction de l'autocomplétion: %s", e)
+                finally:
+                    db.session.remove()
+
+# Instance globale de l'autocomplétion
+autocomplete_index = AutocompleteIndex()
+
+def _register_listeners():
+    from recipe import register_recipe_listener
+    from src.models.product import Product
+
+    register_recipe_listener(autocomplete_index.on_recipe_write)
+    event.listen(Product, 'after_insert', lambda mapper, connection, target: autocomplete_index.on_product_write(target, 'insert'))
+    event.listen(Product, 'after_update', lambda mapper, connection, target: autocomplete_index.on_product_write(target, 'update'))
+    event.listen(Product, 'after_delete', lambda mapper, connection, target: autocomplete_index.on_product_write(target, 'delete'))
+
+_register_listeners()
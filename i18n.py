@@ -3,341 +3,181 @@ Système d'internationalisation pour CFA
 Support: Français, Anglais, Coréen, Mandarin
 """
 
-from typing import Dict, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
+import gzip
+import hashlib
 import json
 import os
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # Optionnel : les bundles sont alors servis en gzip uniquement
+    brotli = None
+
+DEFAULT_LANGUAGE = 'fr'
+# Peu de valeurs d'Accept-Language distinctes en pratique : la négociation devient un accès au cache
+ACCEPT_LANGUAGE_CACHE_SIZE = 512
+MAX_ACCEPT_LANGUAGE_LENGTH = 512
+BUNDLE_HASH_LENGTH = 12
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+def _load_catalog(language: str) -> Mapping[str, str]:
+    """Lit locales/<langue>.json en dictionnaire figé, clés internées (partagées entre langues)"""
+    with open(os.path.join(LOCALES_DIR, f'{language}.json'), encoding='utf-8') as catalog_file:
+        catalog = json.load(catalog_file)
+    return MappingProxyType({sys.intern(key): value for key, value in catalog.items()})
+
+@lru_cache(maxsize=ACCEPT_LANGUAGE_CACHE_SIZE)
+def negotiate_language(accept_language: str, supported: Tuple[str, ...]) -> Optional[str]:
+    """
+    Meilleure langue supportée pour un en-tête Accept-Language (RFC 9110, q-values),
+    avec repli sur la langue principale (ko-KR -> ko, zh-Hant-TW -> zh) ; None si aucune
+    """
+    ranges = []
+    for position, item in enumerate(accept_language[:MAX_ACCEPT_LANGUAGE_LENGTH].split(',')):
+        tag, _, params = item.strip().partition(';')
+        tag = tag.strip().lower()
+        if not tag:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params:
+            name, _, value = params.partition('=')
+            if name.strip() != 'q':
+                continue
+            try:
+                quality = float(value)
+            except ValueError:
+                continue
+            if not 0 <= quality <= 1:
+                continue
+        ranges.append((-quality, position, tag))
+    
+    # q=0 signifie "pas cette langue", y compris pour le joker
+    refused = {tag for quality, _, tag in ranges if quality == 0}
+    for quality, _, tag in sorted(ranges):
+        if quality == 0:
+            break
+        if tag == '*':
+            candidate = next((language for language in supported if language not in refused), None)
+        else:
+            candidate = tag.split('-')[0]
+        if candidate in supported and candidate not in refused:
+            return candidate
+    return None
+
+class _CatalogStore(Mapping):
+    """Catalogues par langue, chargés au premier accès"""
+    
+    def __init__(self, languages):
+        self._languages = tuple(languages)
+        self._catalogs: Dict[str, Mapping[str, str]] = {}
+        self._lock = threading.Lock()
+    
+    def __getitem__(self, language: str) -> Mapping[str, str]:
+        catalog = self._catalogs.get(language)
+        if catalog is None:
+            if language not in self._languages:
+                raise KeyError(language)
+            with self._lock:
+                catalog = self._catalogs.get(language)
+                if catalog is None:
+                    catalog = self._catalogs[language] = _load_catalog(language)
+        return catalog
+    
+    def __contains__(self, language) -> bool:
+        return language in self._languages
+    
+    def __iter__(self):
+        return iter(self._languages)
+    
+    def __len__(self) -> int:
+        return len(self._languages)
+
+class TranslationBundle(NamedTuple):
+    """Catalogue d'une langue sérialisé pour le frontend, nommé par le hash de son contenu"""
+    language: str
+    content_hash: str
+    encodings: Dict[str, bytes]  # 'identity', 'gzip' et 'br' (si brotli est installé)
+    
+    @property
+    def filename(self) -> str:
+        return f'{self.language}.{self.content_hash}.json'
+
+# Langue de la requête (ou du bloc use_language) en cours : propre à chaque thread / greenlet
+_current_language: ContextVar[Optional[str]] = ContextVar('cfa_language', default=None)
 
 class I18nManager:
-    """Gestionnaire d'internationalisation"""
+    """
+    Gestionnaire d'internationalisation.
+    Immuable une fois créé : la langue courante vit dans un ContextVar, pas sur l'instance,
+    donc l'instance globale est partageable entre threads (workers gthread / gevent).
+    """
     
     def __init__(self):
-        self.current_language = 'fr'
-        self.supported_languages = ['fr', 'en', 'ko', 'zh']
-        self.translations = self._load_translations()
+        self.supported_languages = ('fr', 'en', 'ko', 'zh')
+        self.translations = _CatalogStore(self.supported_languages)
+        self._frozen = True
     
-    def _load_translations(self) -> Dict[str, Dict[str, str]]:
-        """Charge les traductions"""
-        return {
-            'fr': {
-                # Navigation
-                'home': 'Accueil',
-                'products': 'Produits',
-                'recipes': 'Recettes',
-                'about': 'À propos',
-                'contact': 'Contact',
-                'cart': 'Panier',
-                'account': 'Mon compte',
-                'login': 'Connexion',
-                'register': 'Inscription',
-                'logout': 'Déconnexion',
-                
-                # Produits
-                'add_to_cart': 'Ajouter au panier',
-                'buy_now': 'Acheter maintenant',
-                'out_of_stock': 'Rupture de stock',
-                'in_stock': 'En stock',
-                'price': 'Prix',
-                'origin': 'Origine',
-                'category': 'Catégorie',
-                'ecology_score': 'Score écologique',
-                'fair_trade': 'Commerce équitable',
-                'organic': 'Bio',
-                
-                # Recherche
-                'search_placeholder': 'Rechercher des produits, recettes...',
-                'search_recipes': 'Rechercher des recettes',
-                'no_results': 'Aucun résultat trouvé',
-                'filters': 'Filtres',
-                'sort_by': 'Trier par',
-                
-                # Panier et commande
-                'checkout': 'Commander',
-                'total': 'Total',
-                'shipping': 'Livraison',
-                'taxes': 'Taxes',
-                'order_summary': 'Résumé de commande',
-                'payment': 'Paiement',
-                
-                # Messages
-                'welcome_message': 'Bienvenue sur Caraïbes-France-Asie',
-                'tagline': 'Chaîne d\'approvisionnement de la ferme à la table, enracinée dans l\'écologie',
-                'support_local': 'Soutenez les producteurs locaux contre les grandes surfaces',
-                'quality_guarantee': 'Qualité garantie, traçabilité complète',
-                
-                # Contact Kevin Marville
-                'contact_kevin': 'Contacter Kevin Marville',
-                'linkedin_kevin': 'LinkedIn de Kevin',
-                'support_project': 'Soutenir le projet',
-                'buy_coffee': 'Offrir un café',
-                'donate': 'Faire un don',
-                
-                # Thème
-                'dark_mode': 'Mode sombre',
-                'light_mode': 'Mode clair',
-                'theme_toggle': 'Changer de thème',
-                
-                # Recettes
-                'recipe_search': 'Recherche de recettes',
-                'prep_time': 'Temps de préparation',
-                'cook_time': 'Temps de cuisson',
-                'total_time': 'Temps total',
-                'servings': 'Portions',
-                'ingredients': 'Ingrédients',
-                'instructions': 'Instructions',
-                'difficulty': 'Difficulté',
-                'cuisine_type': 'Type de cuisine',
-                
-                # Anti-monopole
-                'vs_supermarket': 'vs Grandes surfaces',
-                'local_support': 'Soutien local',
-                'direct_trade': 'Commerce direct',
-                'fair_pricing': 'Prix équitables',
-                'no_middleman': 'Sans intermédiaire',
-            },
-            
-            'en': {
-                # Navigation
-                'home': 'Home',
-                'products': 'Products',
-                'recipes': 'Recipes',
-                'about': 'About',
-                'contact': 'Contact',
-                'cart': 'Cart',
-                'account': 'My Account',
-                'login': 'Login',
-                'register': 'Sign Up',
-                'logout': 'Logout',
-                
-                # Products
-                'add_to_cart': 'Add to Cart',
-                'buy_now': 'Buy Now',
-                'out_of_stock': 'Out of Stock',
-                'in_stock': 'In Stock',
-                'price': 'Price',
-                'origin': 'Origin',
-                'category': 'Category',
-                'ecology_score': 'Ecology Score',
-                'fair_trade': 'Fair Trade',
-                'organic': 'Organic',
-                
-                # Search
-                'search_placeholder': 'Search products, recipes...',
-                'search_recipes': 'Search recipes',
-                'no_results': 'No results found',
-                'filters': 'Filters',
-                'sort_by': 'Sort by',
-                
-                # Cart and order
-                'checkout': 'Checkout',
-                'total': 'Total',
-                'shipping': 'Shipping',
-                'taxes': 'Taxes',
-                'order_summary': 'Order Summary',
-                'payment': 'Payment',
-                
-                # Messages
-                'welcome_message': 'Welcome to Caribbean-France-Asia',
-                'tagline': 'Farm to table supply chain, rooted in ecology',
-                'support_local': 'Support local producers against big retailers',
-                'quality_guarantee': 'Quality guaranteed, full traceability',
-                
-                # Contact Kevin Marville
-                'contact_kevin': 'Contact Kevin Marville',
-                'linkedin_kevin': 'Kevin\'s LinkedIn',
-                'support_project': 'Support the project',
-                'buy_coffee': 'Buy me a coffee',
-                'donate': 'Donate',
-                
-                # Theme
-                'dark_mode': 'Dark mode',
-                'light_mode': 'Light mode',
-                'theme_toggle': 'Toggle theme',
-                
-                # Recipes
-                'recipe_search': 'Recipe search',
-                'prep_time': 'Prep time',
-                'cook_time': 'Cook time',
-                'total_time': 'Total time',
-                'servings': 'Servings',
-                'ingredients': 'Ingredients',
-                'instructions': 'Instructions',
-                'difficulty': 'Difficulty',
-                'cuisine_type': 'Cuisine type',
-                
-                # Anti-monopoly
-                'vs_supermarket': 'vs Supermarkets',
-                'local_support': 'Local support',
-                'direct_trade': 'Direct trade',
-                'fair_pricing': 'Fair pricing',
-                'no_middleman': 'No middleman',
-            },
-            
-            'ko': {
-                # Navigation
-                'home': '홈',
-                'products': '제품',
-                'recipes': '레시피',
-                'about': '소개',
-                'contact': '연락처',
-                'cart': '장바구니',
-                'account': '내 계정',
-                'login': '로그인',
-                'register': '회원가입',
-                'logout': '로그아웃',
-                
-                # Products
-                'add_to_cart': '장바구니에 추가',
-                'buy_now': '지금 구매',
-                'out_of_stock': '품절',
-                'in_stock': '재고 있음',
-                'price': '가격',
-                'origin': '원산지',
-                'category': '카테고리',
-                'ecology_score': '생태 점수',
-                'fair_trade': '공정무역',
-                'organic': '유기농',
-                
-                # Search
-                'search_placeholder': '제품, 레시피 검색...',
-                'search_recipes': '레시피 검색',
-                'no_results': '검색 결과가 없습니다',
-                'filters': '필터',
-                'sort_by': '정렬',
-                
-                # Cart and order
-                'checkout': '주문하기',
-                'total': '총계',
-                'shipping': '배송',
-                'taxes': '세금',
-                'order_summary': '주문 요약',
-                'payment': '결제',
-                
-                # Messages
-                'welcome_message': '카리브-프랑스-아시아에 오신 것을 환영합니다',
-                'tagline': '농장에서 식탁까지, 생태학에 뿌리를 둔 공급망',
-                'support_local': '대형 마트에 맞서 지역 생산자를 지원하세요',
-                'quality_guarantee': '품질 보장, 완전한 추적성',
-                
-                # Contact Kevin Marville
-                'contact_kevin': 'Kevin Marville 연락하기',
-                'linkedin_kevin': 'Kevin의 LinkedIn',
-                'support_project': '프로젝트 지원',
-                'buy_coffee': '커피 사주기',
-                'donate': '기부하기',
-                
-                # Theme
-                'dark_mode': '다크 모드',
-                'light_mode': '라이트 모드',
-                'theme_toggle': '테마 변경',
-                
-                # Recipes
-                'recipe_search': '레시피 검색',
-                'prep_time': '준비 시간',
-                'cook_time': '조리 시간',
-                'total_time': '총 시간',
-                'servings': '인분',
-                'ingredients': '재료',
-                'instructions': '조리법',
-                'difficulty': '난이도',
-                'cuisine_type': '요리 종류',
-                
-                # Anti-monopoly
-                'vs_supermarket': 'vs 대형마트',
-                'local_support': '지역 지원',
-                'direct_trade': '직접 거래',
-                'fair_pricing': '공정한 가격',
-                'no_middleman': '중간업체 없음',
-            },
-            
-            'zh': {
-                # Navigation
-                'home': '首页',
-                'products': '产品',
-                'recipes': '食谱',
-                'about': '关于',
-                'contact': '联系',
-                'cart': '购物车',
-                'account': '我的账户',
-                'login': '登录',
-                'register': '注册',
-                'logout': '退出',
-                
-                # Products
-                'add_to_cart': '加入购物车',
-                'buy_now': '立即购买',
-                'out_of_stock': '缺货',
-                'in_stock': '有库存',
-                'price': '价格',
-                'origin': '产地',
-                'category': '类别',
-                'ecology_score': '生态评分',
-                'fair_trade': '公平贸易',
-                'organic': '有机',
-                
-                # Search
-                'search_placeholder': '搜索产品、食谱...',
-                'search_recipes': '搜索食谱',
-                'no_results': '未找到结果',
-                'filters': '筛选',
-                'sort_by': '排序',
-                
-                # Cart and order
-                'checkout': '结账',
-                'total': '总计',
-                'shipping': '运费',
-                'taxes': '税费',
-                'order_summary': '订单摘要',
-                'payment': '付款',
-                
-                # Messages
-                'welcome_message': '欢迎来到加勒比-法国-亚洲',
-                'tagline': '从农场到餐桌的供应链，植根于生态学',
-                'support_local': '支持本地生产者对抗大型超市',
-                'quality_guarantee': '质量保证，完全可追溯',
-                
-                # Contact Kevin Marville
-                'contact_kevin': '联系 Kevin Marville',
-                'linkedin_kevin': 'Kevin 的 LinkedIn',
-                'support_project': '支持项目',
-                'buy_coffee': '请我喝咖啡',
-                'donate': '捐赠',
-                
-                # Theme
-                'dark_mode': '深色模式',
-                'light_mode': '浅色模式',
-                'theme_toggle': '切换主题',
-                
-                # Recipes
-                'recipe_search': '食谱搜索',
-                'prep_time': '准备时间',
-                'cook_time': '烹饪时间',
-                'total_time': '总时间',
-                'servings': '份数',
-                'ingredients': '配料',
-                'instructions': '制作方法',
-                'difficulty': '难度',
-                'cuisine_type': '菜系',
-                
-                # Anti-monopoly
-                'vs_supermarket': 'vs 超市',
-                'local_support': '本地支持',
-                'direct_trade': '直接贸易',
-                'fair_pricing': '公平定价',
-                'no_middleman': '无中间商',
-            }
-        }
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("I18nManager est immuable ; utiliser set_language() ou use_language()")
+        super().__setattr__(name, value)
+    
+    def init_app(self, app):
+        """Lie la langue à chaque requête Flask (paramètre lang, puis Accept-Language)"""
+        from flask import request
+        
+        self.preload()
+        
+        @app.before_request
+        def _bind_request_language():
+            _current_language.set(self.detect_language_from_request(request))
+        
+        @app.teardown_request
+        def _release_request_language(exc=None):
+            # Le thread sera réutilisé par une autre requête
+            _current_language.set(None)
+    
+    def preload(self):
+        """
+        Charge tous les catalogues d'emblée (appelé par init_app, une fois par worker) :
+        aucune requête ne paie la lecture d'un fichier de langue
+        """
+        for language in self.supported_languages:
+            self.translations[language]
+    
+    @property
+    def current_language(self) -> str:
+        """Langue de la requête en cours (français hors requête)"""
+        return _current_language.get() or DEFAULT_LANGUAGE
     
     def set_language(self, language: str):
-        """Définit la langue actuelle"""
+        """Définit la langue pour la requête (le contexte) en cours uniquement"""
         if language in self.supported_languages:
-            self.current_language = language
+            _current_language.set(language)
+    
+    @contextmanager
+    def use_language(self, language: str):
+        """Change la langue le temps d'un bloc (scripts, tâches de fond)"""
+        token = _current_language.set(language if language in self.supported_languages else None)
+        try:
+            yield self
+        finally:
+            _current_language.reset(token)
     
     def get_text(self, key: str, language: Optional[str] = None) -> str:
         """Récupère un texte traduit"""
         lang = language or self.current_language
         
         if lang not in self.translations:
-            lang = 'fr'  # Fallback vers le français
+            lang = DEFAULT_LANGUAGE  # Fallback vers le français
         
         return self.translations[lang].get(key, key)
     
@@ -371,17 +211,29 @@ class I18nManager:
         
         # Vérifier les headers Accept-Language
         if hasattr(request, 'headers') and 'Accept-Language' in request.headers:
-            accept_lang = request.headers.get('Accept-Language', '')
-            for lang in self.supported_languages:
-                if lang in accept_lang:
-                    return lang
+            lang = negotiate_language(request.headers.get('Accept-Language', ''), self.supported_languages)
+            if lang:
+                return lang
         
-        return 'fr'  # Défaut français
+        return DEFAULT_LANGUAGE  # Défaut français
     
-    def get_all_translations(self, language: Optional[str] = None) -> Dict[str, str]:
-        """Retourne toutes les traductions pour une langue"""
+    def get_all_translations(self, language: Optional[str] = None) -> Mapping[str, str]:
+        """Retourne toutes les traductions pour une langue (lecture seule)"""
         lang = language or self.current_language
         return self.translations.get(lang, self.translations['fr'])
+    
+    def build_bundles(self) -> Dict[str, TranslationBundle]:
+        """Un bundle JSON par langue, précompressé ; le hash change avec le contenu"""
+        bundles = {}
+        for language in self.supported_languages:
+            body = json.dumps(dict(self.translations[language]), ensure_ascii=False,
+                              separators=(',', ':'), sort_keys=True).encode('utf-8')
+            encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                encodings['br'] = brotli.compress(body, quality=11)
+            content_hash = hashlib.sha256(body).hexdigest()[:BUNDLE_HASH_LENGTH]
+            bundles[language] = TranslationBundle(language, content_hash, encodings)
+        return bundles
 
 # Instance globale
 i18n = I18nManager()
@@ -7,13 +7,209 @@ import time
 import threading
 import functools
 import hashlib
+import os
 import pickle
-from typing import Any, Callable, Dict, Optional, Tuple
+import random
+import sqlite3
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 import psutil
 import gc
 from dataclasses import dataclass
+from flask import current_app, has_app_context
+
+# Nombre de clés tirées au hasard à chaque éviction
+EVICTION_SAMPLE_SIZE = 5
+# Budget mémoire par défaut et surcoût fixe d'une entrée (objet, slot du dict, slot de la table)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 200
+# Segments indépendants (un verrou chacun) du cache partagé entre threads
+DEFAULT_CACHE_SHARDS = 16
+# Cache L2 partagé entre workers : activé si SHARED_CACHE_PATH est défini
+SHARED_CACHE_PATH_ENV = 'SHARED_CACHE_PATH'
+DEFAULT_SHARED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+SHARED_CACHE_BUSY_TIMEOUT_SECONDS = 2.0
+# Quand le budget est dépassé, on redescend à cette fraction pour amortir les purges
+SHARED_CACHE_PRUNE_RATIO = 0.9
+
+def _serialize(value: Any) -> Optional[bytes]:
+    """Sérialisation binaire de la valeur ; None si elle n'est pas sérialisable"""
+    try:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+def _estimate_size(key: str, value: Any, payload: Optional[bytes]) -> int:
+    """Taille approximative d'une entrée, mesurée une fois à l'insertion"""
+    value_size = len(payload) if payload is not None else sys.getsizeof(value)
+    return value_size + len(key) + ENTRY_OVERHEAD_BYTES
+
+_SHARED_CACHE_SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS shared_cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_shared_cache_expires_at ON shared_cache (expires_at);
+CREATE TABLE IF NOT EXISTS shared_cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_bytes INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO shared_cache_stats VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS shared_cache_insert AFTER INSERT ON shared_cache BEGIN
+    UPDATE shared_cache_stats SET total_bytes = total_bytes + new.size, entry_count = entry_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS shared_cache_update AFTER UPDATE OF size ON shared_cache BEGIN
+    UPDATE shared_cache_stats SET total_bytes = total_bytes + new.size - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS shared_cache_delete AFTER DELETE ON shared_cache BEGIN
+    UPDATE shared_cache_stats SET total_bytes = total_bytes - old.size, entry_count = entry_count - 1;
+END;
+"""
+
+class SQLiteSharedCache:
+    """
+    Cache L2 partagé par les workers d'un même hôte (équivalent local d'un Redis) :
+    fichier SQLite en mode WAL, lectures concurrentes, valeurs sérialisées par pickle.
+    TTL par entrée et budget en octets (total tenu par triggers, purge des plus proches
+    de l'expiration). Le fichier ne doit être accessible qu'à l'utilisateur de l'application.
+    Une erreur SQLite se traduit par un défaut de cache : le L1 continue de servir.
+    """
+    
+    def __init__(self, path: str, max_bytes: int = DEFAULT_SHARED_CACHE_MAX_BYTES, namespace: str = ''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.error_count = 0
+        self._local = threading.local()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Une connexion par thread et par processus (jamais héritée à travers un fork)"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SHARED_CACHE_BUSY_TIMEOUT_SECONDS,
+                                         isolation_level=None)
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.executescript(_SHARED_CACHE_SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+    
+    def _error(self, operation: str, error: Exception) -> None:
+        self.error_count += 1
+        print(f"Erreur cache partagé ({operation}): {error}")
+    
+    def get(self, key: str) -> Optional[Tuple[Any, bytes, float]]:
+        """(valeur, octets sérialisés, secondes avant expiration) ou None"""
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                'SELECT value, expires_at FROM shared_cache WHERE key = ?', (self.namespace + key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._error('lecture', e)
+            return None
+        if row is None or row[1] <= now:
+            return None
+        
+        payload = row[0]
+        try:
+            value = pickle.loads(payload)
+        except Exception:
+            # Classe renommée depuis l'écriture, par exemple : l'entrée est inutilisable
+            self.delete(key)
+            return None
+        return value, payload, row[1] - now
+    
+    def set(self, key: str, payload: bytes, ttl_seconds: float) -> None:
+        """Écrit une valeur déjà sérialisée, puis purge si le budget est dépassé"""
+        key = self.namespace + key
+        size = len(payload) + len(key)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT INTO shared_cache (key, value, size, expires_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+                    'expires_at = excluded.expires_at',
+                    (key, payload, size, now + ttl_seconds)
+                )
+                if self._stats(connection)[0] > self.max_bytes:
+                    self._prune(connection, now, key)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            self._error('écriture', e)
+    
+    @staticmethod
+    def _stats(connection: sqlite3.Connection) -> Tuple[int, int]:
+        """(octets, entrées), tenus à jour par les triggers"""
+        return connection.execute('SELECT total_bytes, entry_count FROM shared_cache_stats').fetchone()
+    
+    def _prune(self, connection: sqlite3.Connection, now: float, keep: str) -> None:
+        """Retire les entrées expirées, puis les plus proches de l'expiration"""
+        connection.execute('DELETE FROM shared_cache WHERE expires_at <= ?', (now,))
+        target = self.max_bytes * SHARED_CACHE_PRUNE_RATIO
+        total_bytes, entry_count = self._stats(connection)
+        while total_bytes > target and entry_count > 1:
+            # Lot dimensionné sur la taille moyenne pour ne pas purger au-delà du nécessaire
+            batch = max(1, int((total_bytes - target) * entry_count // total_bytes) + 1)
+            connection.execute(
+                'DELETE FROM shared_cache WHERE key IN ('
+                'SELECT key FROM shared_cache WHERE key != ? ORDER BY expires_at LIMIT ?)',
+                (keep, batch)
+            )
+            total_bytes, entry_count = self._stats(connection)
+    
+    def delete(self, key: str) -> None:
+        try:
+            self._connection().execute('DELETE FROM shared_cache WHERE key = ?', (self.namespace + key,))
+        except sqlite3.Error as e:
+            self._error('suppression', e)
+    
+    def clear(self) -> None:
+        """Vide les entrées de ce namespace (pour tous les workers)"""
+        try:
+            self._connection().execute(
+                'DELETE FROM shared_cache WHERE substr(key, 1, ?) = ?', (len(self.namespace), self.namespace)
+            )
+        except sqlite3.Error as e:
+            self._error('vidage', e)
+    
+    def purge_expired(self) -> int:
+        try:
+            return self._connection().execute(
+                'DELETE FROM shared_cache WHERE expires_at <= ?', (time.time(),)
+            ).rowcount
+        except sqlite3.Error as e:
+            self._error('purge', e)
+            return 0
+    
+    def get_stats(self) -> Dict:
+        """Statistiques du fichier partagé (tous namespaces confondus)"""
+        try:
+            total_bytes, entry_count = self._stats(self._connection())
+        except sqlite3.Error as e:
+            self._error('statistiques', e)
+            total_bytes = entry_count = None
+        return {
+            'path': self.path,
+            'size': entry_count,
+            'memory_usage': total_bytes,
+            'max_bytes': self.max_bytes,
+            'error_count': self.error_count
+        }
 
 @dataclass
 class PerformanceMetrics:
@@ -25,88 +221,194 @@ class PerformanceMetrics:
     active_connections: int
     timestamp: datetime
 
+class _CacheEntry:
+    """Entrée du cache ; position = indice de la clé dans la table d'échantillonnage"""
+    __slots__ = ('value', 'size', 'created_at', 'last_access', 'access_count', 'position')
+
+    def __init__(self, value: Any, size: int, now: float, position: int):
+        self.value = value
+        self.size = size
+        self.created_at = now
+        self.last_access = now
+        self.access_count = 1
+        self.position = position
+
 class IntelligentCache:
-    """Cache intelligent avec éviction adaptative"""
-    
-    def __init__(self, max_size: int = 1000, ttl_seconds: int = 3600):
+    """
+    Cache intelligent avec éviction adaptative.
+    L'éviction tire sample_size clés au hasard et retire la moins utile
+    (fréquence pondérée par la récence) : coût constant, sans tri du cache.
+    Borné en nombre d'entrées (max_size) et en octets (max_bytes, None = sans limite) ;
+    chaque entrée est mesurée à l'insertion et le total est tenu à jour.
+    Avec l2, les écritures sont recopiées dans le cache partagé et un défaut local
+    y est cherché avant de conclure au miss.
+    """
+    
+    def __init__(self, max_size: int = 1000, ttl_seconds: int = 3600,
+                 sample_size: int = EVICTION_SAMPLE_SIZE, max_bytes: Optional[int] = None,
+                 l2: Optional[SQLiteSharedCache] = None):
         self.max_size = max_size
         self.ttl_seconds = ttl_seconds
-        self.cache = OrderedDict()
-        self.access_counts = defaultdict(int)
-        self.last_access = {}
+        self.sample_size = sample_size
+        self.max_bytes = max_bytes
+        self.l2 = l2
+        self.cache: Dict[str, _CacheEntry] = {}
+        self._keys: List[str] = []  # Tirage aléatoire en O(1)
+        self.total_bytes = 0
         self.hit_count = 0
         self.miss_count = 0
+        self.l2_hit_count = 0
+        self.eviction_count = 0
         self._lock = threading.RLock()
     
     def get(self, key: str) -> Optional[Any]:
         """Récupère une valeur du cache"""
+        now = time.monotonic()
         with self._lock:
-            if key in self.cache:
-                value, timestamp = self.cache[key]
-                
+            entry = self.cache.get(key)
+            if entry is not None:
                 # Vérifier l'expiration
-                if datetime.now() - timestamp > timedelta(seconds=self.ttl_seconds):
-                    del self.cache[key]
-                    del self.access_counts[key]
-                    del self.last_access[key]
-                    self.miss_count += 1
-                    return None
-                
-                # Mettre à jour les statistiques d'accès
-                self.access_counts[key] += 1
-                self.last_access[key] = datetime.now()
-                
-                # Déplacer vers la fin (LRU)
-                self.cache.move_to_end(key)
-                
-                self.hit_count += 1
-                return value
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(key)
+                else:
+                    # Mettre à jour les statistiques d'accès
+                    entry.access_count += 1
+                    entry.last_access = now
+                    
+                    self.hit_count += 1
+                    return entry.value
             
-            self.miss_count += 1
-            return None
+            if self.l2 is None:
+                self.miss_count += 1
+                return None
+        
+        # Défaut local : le cache partagé est lu hors verrou (entrée/sortie)
+        found = self.l2.get(key)
+        with self._lock:
+            if found is None:
+                self.miss_count += 1
+                return None
+            value, payload, expires_in = found
+            self.hit_count += 1
+            self.l2_hit_count += 1
+            # L'entrée locale expire en même temps que celle du L2
+            created_at = now - max(0.0, self.ttl_seconds - expires_in)
+            self._store(key, value, _estimate_size(key, value, payload), now, created_at)
+        return value
     
     def set(self, key: str, value: Any) -> None:
-        """Stocke une valeur dans le cache"""
+        """Stocke une valeur dans le cache (et dans le L2 s'il y en a un)"""
+        payload = _serialize(value)  # Hors verrou
+        size = _estimate_size(key, value, payload)
+        now = time.monotonic()
         with self._lock:
-            # Éviction si nécessaire
-            if len(self.cache) >= self.max_size:
-                self._evict_items()
-            
-            self.cache[key] = (value, datetime.now())
-            self.access_counts[key] = 1
-            self.last_access[key] = datetime.now()
-    
-    def _evict_items(self) -> None:
-        """Éviction intelligente basée sur la fréquence et la récence"""
-        items_to_remove = max(1, len(self.cache) // 4)  # Supprimer 25%
-        
-        # Calculer un score pour chaque élément
-        scores = {}
-        now = datetime.now()
+            self._store(key, value, size, now, now)
+        if self.l2 is not None and payload is not None:
+            self.l2.set(key, payload, self.ttl_seconds)
+    
+    def _store(self, key: str, value: Any, size: int, now: float, created_at: float) -> None:
+        """Insère ou remplace une entrée locale (verrou détenu)"""
+        # Une valeur plus grosse que tout le budget viderait le cache pour rien
+        if self.max_bytes is not None and size > self.max_bytes:
+            if key in self.cache:
+                self._remove(key)
+            return
         
-        for key in self.cache:
-            frequency = self.access_counts[key]
-            recency = (now - self.last_access[key]).total_seconds()
-            
-            # Score combiné (plus élevé = plus important à garder)
-            scores[key] = frequency / (1 + recency / 3600)  # Normaliser par heure
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.total_bytes += size - entry.size
+            entry.value = value
+            entry.size = size
+            entry.created_at = created_at
+            entry.last_access = now
+            entry.access_count = 1
+            self._evict_over_budget(now, keep=key)
+            return
         
-        # Supprimer les éléments avec les scores les plus bas
-        items_to_remove_list = sorted(scores.items(), key=lambda x: x[1])[:items_to_remove]
+        # Éviction si nécessaire
+        while self.cache and len(self.cache) >= self.max_size:
+            self._evict_one(now)
+        self.total_bytes += size
+        self._evict_over_budget(now)
         
-        for key, _ in items_to_remove_list:
-            del self.cache[key]
-            del self.access_counts[key]
-            del self.last_access[key]
+        entry = self.cache[key] = _CacheEntry(value, size, now, len(self._keys))
+        entry.created_at = created_at
+        self._keys.append(key)
+    
+    def delete(self, key: str) -> bool:
+        """Retire une clé du cache (et du L2 : les autres workers la garderont jusqu'à leur TTL)"""
+        if self.l2 is not None:
+            self.l2.delete(key)
+        with self._lock:
+            if key not in self.cache:
+                return False
+            self._remove(key)
+            return True
+    
+    def shrink(self, target_size: int) -> int:
+        """Évince jusqu'à ne garder que target_size éléments"""
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while len(self.cache) > max(0, target_size):
+                self._evict_one(now)
+                removed += 1
+        return removed
+    
+    def _evict_over_budget(self, now: float, keep: Optional[str] = None) -> None:
+        """Évince tant que le total dépasse max_bytes (keep : clé en cours d'écriture)"""
+        if self.max_bytes is None:
+            return
+        while self.total_bytes > self.max_bytes and len(self.cache) > (keep is not None):
+            self._evict_one(now, keep)
+    
+    def _remove(self, key: str) -> None:
+        """Retire une clé en O(1) : la dernière clé prend sa place dans la table"""
+        entry = self.cache.pop(key)
+        self.total_bytes -= entry.size
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._keys[entry.position] = last_key
+            self.cache[last_key].position = entry.position
+    
+    def _score(self, entry: _CacheEntry, now: float) -> float:
+        """Score combiné (plus élevé = plus important à garder)"""
+        if now - entry.created_at > self.ttl_seconds:
+            return -1.0  # Expiré : à retirer en priorité
+        recency = now - entry.last_access
+        return entry.access_count / (1 + recency / 3600)  # Normaliser par heure
+    
+    def _evict_one(self, now: float, keep: Optional[str] = None) -> None:
+        """Éviction échantillonnée : le plus faible score parmi sample_size clés tirées au hasard"""
+        keys = self._keys
+        victim = None
+        victim_score = 0.0
+        for _ in range(min(self.sample_size, len(keys))):
+            key = keys[random.randrange(len(keys))]
+            if key == keep:
+                continue
+            score = self._score(self.cache[key], now)
+            if victim is None or score < victim_score:
+                victim, victim_score = key, score
+        if victim is None:
+            # Échantillon réduit à la clé protégée : prendre sa voisine dans la table
+            victim = keys[(self.cache[keep].position + 1) % len(keys)]
+        self._remove(victim)
+        self.eviction_count += 1
     
     def clear(self) -> None:
-        """Vide le cache"""
+        """Vide le cache local (le L2, partagé, n'est pas touché)"""
         with self._lock:
             self.cache.clear()
-            self.access_counts.clear()
-            self.last_access.clear()
+            self._keys.clear()
+            self.total_bytes = 0
             self.hit_count = 0
             self.miss_count = 0
+            self.l2_hit_count = 0
+            self.eviction_count = 0
+    
+    def __len__(self) -> int:
+        return len(self.cache)
     
     @property
     def hit_rate(self) -> float:
@@ -115,22 +417,128 @@ class IntelligentCache:
         return self.hit_count / total if total > 0 else 0.0
     
     def get_stats(self) -> Dict:
-        """Statistiques du cache"""
+        """Statistiques du cache (O(1) : la taille est tenue à jour à chaque écriture)"""
         return {
             'size': len(self.cache),
             'max_size': self.max_size,
             'hit_count': self.hit_count,
             'miss_count': self.miss_count,
+            'eviction_count': self.eviction_count,
             'hit_rate': self.hit_rate,
-            'memory_usage': self._estimate_memory_usage()
+            'memory_usage': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'l2_hit_count': self.l2_hit_count,
+            'l2': self.l2.get_stats() if self.l2 is not None else None
         }
+
+class ShardedIntelligentCache:
+    """
+    IntelligentCache découpé en segments, chacun avec son verrou, son éviction et ses compteurs.
+    Une clé est toujours servie par le même segment : les threads (workers gthread)
+    ne se bloquent que s'ils touchent le même segment. Même interface qu'IntelligentCache.
+    max_size et max_bytes sont répartis entre les segments : une valeur plus grosse que
+    la part d'un segment (environ max_bytes / shards) n'est jamais mise en cache.
+    """
+    
+    def __init__(self, max_size: int = 1000, ttl_seconds: int = 3600,
+                 sample_size: int = EVICTION_SAMPLE_SIZE, max_bytes: Optional[int] = None,
+                 l2: Optional[SQLiteSharedCache] = None, shards: int = DEFAULT_CACHE_SHARDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.l2 = l2
+        # Au moins une entrée par segment ; capacités réparties pour que leur somme soit exacte
+        shards = max(1, min(shards, max_size))
+        self._shards = tuple(
+            IntelligentCache(
+                max_size // shards + (index < max_size % shards),
+                ttl_seconds,
+                sample_size,
+                max_bytes // shards + (index < max_bytes % shards) if max_bytes is not None else None,
+                l2
+            )
+            for index in range(shards)
+        )
+        self._shard_count = shards
     
-    def _estimate_memory_usage(self) -> int:
-        """Estime l'usage mémoire du cache"""
-        try:
-            return len(pickle.dumps(self.cache))
-        except:
+    def get(self, key: str) -> Optional[Any]:
+        """Récupère une valeur du cache"""
+        return self._shards[hash(key) % self._shard_count].get(key)
+    
+    def set(self, key: str, value: Any) -> None:
+        """Stocke une valeur dans le cache"""
+        self._shards[hash(key) % self._shard_count].set(key, value)
+    
+    def delete(self, key: str) -> bool:
+        """Retire une clé du cache"""
+        return self._shards[hash(key) % self._shard_count].delete(key)
+    
+    def shrink(self, target_size: int) -> int:
+        """Évince jusqu'à ne garder que target_size éléments, au prorata de chaque segment"""
+        target_size = max(0, target_size)
+        sizes = [len(shard) for shard in self._shards]
+        size = sum(sizes)
+        if size <= target_size:
             return 0
+        # Parts arrondies par défaut, puis le reste aux segments aux plus forts restes :
+        # la somme des parts vaut exactement target_size
+        quotas = [shard_size * target_size // size for shard_size in sizes]
+        by_remainder = sorted(range(len(sizes)),
+                              key=lambda index: sizes[index] * target_size % size, reverse=True)
+        for index in by_remainder[:target_size - sum(quotas)]:
+            quotas[index] += 1
+        return sum(shard.shrink(quota) for shard, quota in zip(self._shards, quotas))
+    
+    def clear(self) -> None:
+        """Vide le cache local (le L2, partagé, n'est pas touché)"""
+        for shard in self._shards:
+            shard.clear()
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+    
+    @property
+    def hit_count(self) -> int:
+        return sum(shard.hit_count for shard in self._shards)
+    
+    @property
+    def miss_count(self) -> int:
+        return sum(shard.miss_count for shard in self._shards)
+    
+    @property
+    def l2_hit_count(self) -> int:
+        return sum(shard.l2_hit_count for shard in self._shards)
+    
+    @property
+    def eviction_count(self) -> int:
+        return sum(shard.eviction_count for shard in self._shards)
+    
+    @property
+    def total_bytes(self) -> int:
+        return sum(shard.total_bytes for shard in self._shards)
+    
+    @property
+    def hit_rate(self) -> float:
+        """Taux de succès du cache"""
+        hit_count = self.hit_count
+        total = hit_count + self.miss_count
+        return hit_count / total if total > 0 else 0.0
+    
+    def get_stats(self) -> Dict:
+        """Statistiques agrégées des segments (lues sans verrou : instantané approximatif)"""
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hit_count': self.hit_count,
+            'miss_count': self.miss_count,
+            'eviction_count': self.eviction_count,
+            'hit_rate': self.hit_rate,
+            'memory_usage': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'l2_hit_count': self.l2_hit_count,
+            'l2': self.l2.get_stats() if self.l2 is not None else None,
+            'shards': len(self._shards)
+        }
 
 class ResourceMonitor:
     """Moniteur de ressources système"""
@@ -288,8 +696,10 @@ class AdaptiveRateLimiter:
 class QueryOptimizer:
     """Optimiseur de requêtes base de données"""
     
-    def __init__(self):
-        self.query_cache = IntelligentCache(max_size=500, ttl_seconds=1800)
+    def __init__(self, shared_cache_path: Optional[str] = None):
+        l2 = SQLiteSharedCache(shared_cache_path, namespace='query:') if shared_cache_path else None
+        self.query_cache = ShardedIntelligentCache(max_size=500, ttl_seconds=1800,
+                                                   max_bytes=DEFAULT_MAX_BYTES // 2, l2=l2)
         self.slow_queries = []
         self.query_stats = defaultdict(list)
     
@@ -346,11 +756,13 @@ class QueryOptimizer:
 class PerformanceOptimizer:
     """Optimiseur de performance principal"""
     
-    def __init__(self):
-        self.cache = IntelligentCache()
+    def __init__(self, shared_cache_path: Optional[str] = None):
+        # shared_cache_path : fichier SQLite commun aux workers de l'hôte (L2), None = L1 seul
+        l2 = SQLiteSharedCache(shared_cache_path, namespace='cache:') if shared_cache_path else None
+        self.cache = ShardedIntelligentCache(max_bytes=DEFAULT_MAX_BYTES, l2=l2)
         self.monitor = ResourceMonitor()
         self.rate_limiter = AdaptiveRateLimiter()
-        self.query_optimizer = QueryOptimizer()
+        self.query_optimizer = QueryOptimizer(shared_cache_path)
         self.optimization_active = False
     
     def start_optimization(self):
@@ -393,16 +805,9 @@ class PerformanceOptimizer:
     
     def _optimize_cache(self):
         """Optimise l'utilisation du cache"""
-        # Réduire la taille du cache
-        current_size = len(self.cache.cache)
-        new_size = max(100, current_size // 2)
-        
-        # Éviction forcée
-        items_to_remove = current_size - new_size
-        if items_to_remove > 0:
-            for _ in range(items_to_remove):
-                if self.cache.cache:
-                    self.cache.cache.popitem(last=False)  # FIFO
+        # Réduire la taille du cache (éviction forcée, même politique que le cache)
+        current_size = len(self.cache)
+        self.cache.shrink(max(100, current_size // 2))
     
     def _cleanup_memory(self):
         """Nettoie la mémoire"""
@@ -442,10 +847,110 @@ class PerformanceOptimizer:
 
 # Décorateurs pour l'optimisation
 
-def cached(ttl: int = 3600):
-    """Décorateur pour mettre en cache les résultats de fonction"""
+class _CachedNone:
+    """Résultat None mis en cache (get() renvoie déjà None pour un défaut)"""
+    __slots__ = ()
+    
+    def __reduce__(self):
+        return '_CACHED_NONE'
+
+_CACHED_NONE = _CachedNone()
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'owner')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.owner = None  # Thread qui calcule
+
+class SingleFlight:
+    """Regroupe les appels concurrents sur une même clé : un seul calcul, les autres attendent son résultat"""
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+    
+    def _begin(self, key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+    
+    def _run(self, key: str, flight: _Flight, compute: Callable[[], Any]) -> None:
+        flight.owner = threading.get_ident()
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+    
+    def do(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        Calcule, ou attend le calcul déjà en cours pour cette clé ; l'erreur est propagée à tous.
+        RuntimeError si le calcul redemande sa propre clé : il s'attendrait lui-même indéfiniment.
+        """
+        flight, is_leader = self._begin(key)
+        if is_leader:
+            self._run(key, flight, compute)
+        elif flight.owner == threading.get_ident():
+            raise RuntimeError(f"Appel récursif sur la clé {key} pendant son propre calcul")
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    
+    def do_in_background(self, key: str, compute: Callable[[], Any]) -> bool:
+        """Lance le calcul dans un thread, sauf s'il y en a déjà un pour cette clé"""
+        flight, is_leader = self._begin(key)
+        if is_leader:
+            threading.Thread(target=self._run, args=(key, flight, compute), daemon=True).start()
+        return is_leader
+
+def cached(ttl: int = 3600, stale_ttl: int = 0, cache_none: bool = True):
+    """
+    Décorateur pour mettre en cache les résultats de fonction.
+    Un seul calcul par clé à la fois, les appels concurrents attendent son résultat ;
+    None est mis en cache comme les autres résultats (sauf cache_none=False).
+    Pendant stale_ttl secondes après l'expiration, l'ancien résultat reste servi
+    pendant qu'un unique recalcul tourne en arrière-plan.
+    La fonction ne doit pas se rappeler avec les mêmes arguments (RuntimeError, voir SingleFlight.do).
+    """
     def decorator(func: Callable) -> Callable:
-        cache = IntelligentCache(ttl_seconds=ttl)
+        cache = ShardedIntelligentCache(ttl_seconds=ttl + stale_ttl)
+        flights = SingleFlight()
+        
+        def compute(key: str, args: Tuple, kwargs: Dict) -> Any:
+            result = func(*args, **kwargs)
+            if result is not None or cache_none:
+                fresh_until = time.monotonic() + ttl
+                cache.set(key, (_CACHED_NONE if result is None else result, fresh_until))
+            return result
+        
+        def load(key: str, args: Tuple, kwargs: Dict) -> Any:
+            # Un vol qui vient de se terminer a pu remplir le cache entre notre défaut et notre tour
+            entry = cache.get(key)
+            if entry is not None and time.monotonic() <= entry[1]:
+                return None if entry[0] is _CACHED_NONE else entry[0]
+            return compute(key, args, kwargs)
+        
+        def refresh(app, key: str, args: Tuple, kwargs: Dict) -> None:
+            # Contexte d'application propre au thread : la session de la requête n'est pas partagée
+            try:
+                if app is None:
+                    compute(key, args, kwargs)
+                else:
+                    with app.app_context():
+                        compute(key, args, kwargs)
+            except Exception as e:
+                print(f"Erreur rafraîchissement {func.__name__}: {e}")
         
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -455,17 +960,17 @@ def cached(ttl: int = 3600):
             ).hexdigest()
             
             # Vérifier le cache
-            result = cache.get(key)
-            if result is not None:
-                return result
-            
-            # Exécuter la fonction
-            result = func(*args, **kwargs)
-            
-            # Mettre en cache
-            cache.set(key, result)
+            entry = cache.get(key)
+            if entry is not None:
+                result, fresh_until = entry
+                if time.monotonic() > fresh_until:
+                    # Périmé mais encore dans la fenêtre stale_ttl
+                    app = current_app._get_current_object() if has_app_context() else None
+                    flights.do_in_background(key, functools.partial(refresh, app, key, args, kwargs))
+                return None if result is _CACHED_NONE else result
             
-            return result
+            # Exécuter la fonction (une seule fois pour tous les appels concurrents)
+            return flights.do(key, functools.partial(load, key, args, kwargs))
         
         wrapper.cache = cache
         return wrapper
@@ -510,5 +1015,5 @@ def performance_monitored(func: Callable) -> Callable:
     return wrapper
 
 # Instance globale de l'optimiseur
-performance_optimizer = PerformanceOptimizer()
+performance_optimizer = PerformanceOptimizer(os.environ.get(SHARED_CACHE_PATH_ENV))
 
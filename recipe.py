@@ -2,8 +2,29 @@
 Modèle Recipe pour les recettes liées aux produits CFA
 """
 
+import base64
+import json
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
 from src.models.base import BaseModel, db
-from sqlalchemy import JSON
+from sqlalchemy import JSON, event, tuple_
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm.attributes import set_committed_value
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_COUNT_CAP = 1000
+
+# Index secondaires tenus à jour à chaque écriture de recette
+_recipe_write_listeners = []
+
+def register_recipe_listener(listener):
+    """Enregistre un callback(connection, recipe, operation) appelé après chaque écriture"""
+    if listener not in _recipe_write_listeners:
+        _recipe_write_listeners.append(listener)
 
 class Recipe(BaseModel):
     """Recettes associées aux produits"""
@@ -17,25 +38,26 @@ class Recipe(BaseModel):
     cook_time = db.Column(db.Integer)  # en minutes
     servings = db.Column(db.Integer, default=4)
     
-    # Contenu multilingue
-    title_en = db.Column(db.String(255))
-    title_ko = db.Column(db.String(255))
-    title_zh = db.Column(db.String(255))
-    description_en = db.Column(db.Text)
-    description_ko = db.Column(db.Text)
-    description_zh = db.Column(db.Text)
+    # Contenu multilingue : chargé à la demande, une langue (groupe) à la fois,
+    # voir language_load_options
+    title_en = db.deferred(db.Column(db.String(255)), group='i18n_en')
+    title_ko = db.deferred(db.Column(db.String(255)), group='i18n_ko')
+    title_zh = db.deferred(db.Column(db.String(255)), group='i18n_zh')
+    description_en = db.deferred(db.Column(db.Text), group='i18n_en')
+    description_ko = db.deferred(db.Column(db.Text), group='i18n_ko')
+    description_zh = db.deferred(db.Column(db.Text), group='i18n_zh')
     
     # Ingrédients et instructions (JSON pour flexibilité)
     ingredients = db.Column(JSON)  # Liste d'ingrédients avec quantités
     instructions = db.Column(JSON)  # Étapes de préparation
     
     # Ingrédients et instructions multilingues
-    ingredients_en = db.Column(JSON)
-    ingredients_ko = db.Column(JSON)
-    ingredients_zh = db.Column(JSON)
-    instructions_en = db.Column(JSON)
-    instructions_ko = db.Column(JSON)
-    instructions_zh = db.Column(JSON)
+    ingredients_en = db.deferred(db.Column(JSON), group='i18n_en')
+    ingredients_ko = db.deferred(db.Column(JSON), group='i18n_ko')
+    ingredients_zh = db.deferred(db.Column(JSON), group='i18n_zh')
+    instructions_en = db.deferred(db.Column(JSON), group='i18n_en')
+    instructions_ko = db.deferred(db.Column(JSON), group='i18n_ko')
+    instructions_zh = db.deferred(db.Column(JSON), group='i18n_zh')
     
     # Métadonnées
     cuisine_type = db.Column(db.String(100))  # française, coréenne, chinoise, indienne, caribéenne
@@ -62,6 +84,31 @@ class Recipe(BaseModel):
     author_name = db.Column(db.String(100), default='Kevin Marville')
     author_bio = db.Column(db.Text)
     
+    # Sert l'ordre de tri de la recherche paginée (seek sur la clé complète)
+    __table_args__ = (
+        db.Index('ix_recipes_listing', 'is_published', 'is_featured', 'views_count', 'created_at', 'id'),
+    )
+    
+    # Colonnes nécessaires aux cartes de listing (hors champs localisés)
+    CARD_COLUMNS = (
+        'id', 'title', 'description', 'difficulty', 'prep_time', 'cook_time',
+        'cuisine_type', 'dietary_tags', 'image_url', 'views_count', 'likes_count',
+        'is_featured', 'created_at'
+    )
+    
+    @classmethod
+    def card_load_options(cls, language='fr'):
+        """Options de chargement limitées aux colonnes des cartes pour une langue"""
+        columns = [getattr(cls, name) for name in cls.CARD_COLUMNS]
+        if language in ('en', 'ko', 'zh'):
+            columns += [getattr(cls, f'title_{language}'), getattr(cls, f'description_{language}')]
+        return [load_only(*columns)]
+    
+    @classmethod
+    def language_load_options(cls, *languages):
+        """Charge d'emblée les colonnes traduites des langues demandées, les autres restent différées"""
+        return [db.undefer_group(f'i18n_{language}') for language in languages if language in ('en', 'ko', 'zh')]
+    
     def get_localized_content(self, language='fr'):
         """Retourne le contenu dans la langue demandée"""
         if language == 'en':
@@ -101,12 +148,45 @@ class Recipe(BaseModel):
         return prep + cook
     
     def increment_views(self):
-        """Incrémente le compteur de vues"""
-        self.views_count += 1
-        db.session.commit()
+        """Incrémente le compteur de vues (écriture différée, voir recipe_counters)"""
+        self._increment_counter('views_count')
+
+    def increment_likes(self):
+        """Incrémente le compteur de likes (écriture différée, voir recipe_counters)"""
+        self._increment_counter('likes_count')
+
+    def _increment_counter(self, column):
+        value = (getattr(self, column) or 0) + 1
+        recipe_counter_buffer.increment(self.id, column)
+        # Valeur à jour pour la réponse, sans marquer l'objet comme modifié :
+        # un commit ultérieur écraserait sinon les incréments des autres processus
+        set_committed_value(self, column, value)
     
-    def to_dict(self, language='fr', include_products=False):
-        """Convertit la recette en dictionnaire"""
+    def to_card_dict(self, language='fr'):
+        """Version allégée pour les listes (colonnes de card_load_options uniquement)"""
+        if language in ('en', 'ko', 'zh'):
+            title = getattr(self, f'title_{language}') or self.title
+            description = getattr(self, f'description_{language}') or self.description
+        else:
+            title, description = self.title, self.description
+        
+        return {
+            'id': self.id,
+            'title': title,
+            'description': description,
+            'difficulty': self.difficulty,
+            'total_time': self.total_time,
+            'cuisine_type': self.cuisine_type,
+            'dietary_tags': self.dietary_tags or [],
+            'image_url': self.image_url,
+            'views_count': self.views_count,
+            'likes_count': self.likes_count,
+            'is_featured': self.is_featured,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def to_dict(self, language='fr', include_products=False, products_by_id=None):
+        """Convertit la recette en dictionnaire (products_by_id : produits déjà sérialisés, voir to_dict_list)"""
         localized = self.get_localized_content(language)
         
         data = {
@@ -135,16 +215,64 @@ class Recipe(BaseModel):
         }
         
         if include_products and self.featured_products:
-            from src.models.product import Product
-            products = Product.query.filter(Product.id.in_(self.featured_products)).all()
-            data['featured_products'] = [p.to_dict() for p in products]
+            if products_by_id is None:
+                products_by_id = Recipe._load_featured_products([self])
+            data['featured_products'] = [
+                products_by_id[product_id] for product_id in self.featured_products
+                if product_id in products_by_id
+            ]
         
         return data
     
+    @staticmethod
+    def _load_featured_products(recipes):
+        """Produits mis en avant de plusieurs recettes, sérialisés, en une seule requête"""
+        from src.models.product import Product
+
+        product_ids = {product_id for recipe in recipes for product_id in (recipe.featured_products or [])}
+        return {
+            product_id: product.to_dict(rating=rating)
+            for product_id, (product, rating) in Product.load_with_ratings(product_ids).items()
+        }
+    
+    @staticmethod
+    def _load_language(recipes, language):
+        """Charge en une requête les colonnes de la langue restées différées (recettes chargées sans language_load_options)"""
+        options = Recipe.language_load_options(language)
+        if not options:
+            return
+        missing = [recipe.id for recipe in recipes if f'title_{language}' in db.inspect(recipe).unloaded]
+        if missing:
+            # Les instances déjà en session sont complétées, pas rechargées
+            Recipe.query.options(load_only(Recipe.id), *options).filter(Recipe.id.in_(missing)).all()
+    
+    @staticmethod
+    def to_dict_list(recipes, language='fr', include_products=False):
+        """Sérialise une liste de recettes ; langue et produits de toutes les recettes sont chargés ensemble"""
+        Recipe._load_language(recipes, language)
+        products_by_id = Recipe._load_featured_products(recipes) if include_products else None
+        return [recipe.to_dict(language, include_products, products_by_id) for recipe in recipes]
+    
     def __repr__(self):
         return f'<Recipe {self.title}>'
 
 
+@event.listens_for(Recipe, 'after_insert')
+def _recipe_inserted(mapper, connection, target):
+    for listener in _recipe_write_listeners:
+        listener(connection, target, 'insert')
+
+@event.listens_for(Recipe, 'after_update')
+def _recipe_updated(mapper, connection, target):
+    for listener in _recipe_write_listeners:
+        listener(connection, target, 'update')
+
+@event.listens_for(Recipe, 'after_delete')
+def _recipe_deleted(mapper, connection, target):
+    for listener in _recipe_write_listeners:
+        listener(connection, target, 'delete')
+
+
 class RecipeSearch:
     """Moteur de recherche de recettes"""
     
@@ -153,6 +281,81 @@ class RecipeSearch:
         """
         Recherche de recettes avec query "recipe + {title of the article for food}"
         """
+        recipes_query = RecipeSearch._build_search_query(query, language, filters)
+        
+        # Trier par pertinence (featured first, puis par vues)
+        recipes_query = recipes_query.order_by(
+            Recipe.is_featured.desc(),
+            Recipe.views_count.desc(),
+            Recipe.created_at.desc()
+        )
+        
+        return recipes_query.options(*Recipe.language_load_options(language)).all()
+    
+    @staticmethod
+    def search_recipes_page(query: str, language='fr', filters=None, cursor=None,
+                            page_size=SEARCH_PAGE_SIZE, count_cap=SEARCH_COUNT_CAP):
+        """
+        Recherche paginée par clé (seek) sur (is_featured, views_count, created_at, id) :
+        une page profonde coûte autant que la première.
+        Le total n'est calculé qu'en première page et plafonné à count_cap.
+        """
+        page_size = max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
+        base_query = RecipeSearch._build_search_query(query, language, filters)
+        sort_key = tuple_(Recipe.is_featured, Recipe.views_count, Recipe.created_at, Recipe.id)
+        
+        page_query = base_query.options(*Recipe.card_load_options(language))
+        if cursor:
+            page_query = page_query.filter(sort_key < tuple_(*RecipeSearch._decode_cursor(cursor)))
+        
+        recipes = page_query.order_by(
+            Recipe.is_featured.desc(),
+            Recipe.views_count.desc(),
+            Recipe.created_at.desc(),
+            Recipe.id.desc()
+        ).limit(page_size + 1).all()
+        
+        has_more = len(recipes) > page_size
+        recipes = recipes[:page_size]
+        
+        result = {
+            'recipes': [recipe.to_card_dict(language) for recipe in recipes],
+            'next_cursor': RecipeSearch._encode_cursor(recipes[-1]) if has_more else None,
+            'total': None,
+            'total_is_capped': False
+        }
+        
+        if cursor is None:
+            # Compter au plus count_cap + 1 lignes suffit pour afficher "1000+"
+            capped = base_query.with_entities(Recipe.id).limit(count_cap + 1).subquery()
+            total = db.session.query(db.func.count()).select_from(capped).scalar()
+            result['total'] = min(total, count_cap)
+            result['total_is_capped'] = total > count_cap
+        
+        return result
+    
+    @staticmethod
+    def _encode_cursor(recipe) -> str:
+        key = [
+            bool(recipe.is_featured),
+            recipe.views_count or 0,
+            recipe.created_at.isoformat() if recipe.created_at else None,
+            recipe.id
+        ]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+    
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            is_featured, views_count, created_at, recipe_id = json.loads(base64.urlsafe_b64decode(cursor))
+            return (bool(is_featured), int(views_count),
+                    datetime.fromisoformat(created_at), int(recipe_id))
+        except (ValueError, TypeError):
+            raise ValueError("Curseur de pagination invalide")
+    
+    @staticmethod
+    def _build_search_query(query: str, language='fr', filters=None):
+        """Requête filtrée (non triée) commune aux recherches complète et paginée"""
         # Nettoyer la query
         if query.lower().startswith('recipe '):
             search_term = query[7:].strip()  # Enlever "recipe "
@@ -163,6 +366,7 @@ class RecipeSearch:
         recipes_query = Recipe.query.filter(Recipe.is_published == True)
         
         # Recherche multilingue
+        cjk_recipe_ids = recipe_cjk_index.lookup(search_term, language)
         if language == 'en':
             recipes_query = recipes_query.filter(
                 db.or_(
@@ -171,6 +375,9 @@ class RecipeSearch:
                     Recipe.title.contains(search_term)
                 )
             )
+        elif cjk_recipe_ids is not None:
+            # Index n-grammes en mémoire : pas de LIKE '%...%' sur le texte CJK
+            recipes_query = recipes_query.filter(Recipe.id.in_(cjk_recipe_ids))
         elif language == 'ko':
             recipes_query = recipes_query.filter(
                 db.or_(
@@ -196,7 +403,15 @@ class RecipeSearch:
             )
         
         # Appliquer les filtres
-        if filters:
+        bitmap_recipe_ids = recipe_bitmap_index.match(filters)
+        if bitmap_recipe_ids is not None:
+            # Cuisine, difficulté et régimes résolus par intersection de bitmaps en mémoire
+            recipes_query = recipes_query.filter(Recipe.id.in_(bitmap_recipe_ids))
+            if filters.get('max_time'):
+                recipes_query = recipes_query.filter(
+                    (Recipe.prep_time + Recipe.cook_time) <= filters['max_time']
+                )
+        elif filters:
             if filters.get('cuisine_type'):
                 recipes_query = recipes_query.filter(Recipe.cuisine_type == filters['cuisine_type'])
             
@@ -216,39 +431,88 @@ class RecipeSearch:
                         Recipe.dietary_tags.contains([tag])
                     )
         
-        # Trier par pertinence (featured first, puis par vues)
-        recipes_query = recipes_query.order_by(
-            Recipe.is_featured.desc(),
-            Recipe.views_count.desc(),
-            Recipe.created_at.desc()
-        )
-        
-        return recipes_query.all()
+        return recipes_query
     
     @staticmethod
-    def get_recipes_for_product(product_name: str, language='fr'):
+    def get_recipes_for_product(product_name: str = None, language='fr', product_id: int = None):
         """
-        Trouve des recettes pour un produit spécifique
+        Trouve des recettes pour un produit spécifique.
+        Avec product_id : recettes qui mettent le produit en avant (index recipe_products) ;
+        sinon recherche texte sur le nom du produit.
         """
+        if product_id is not None:
+            return Recipe.query.options(*Recipe.language_load_options(language))\
+                               .join(recipe_products, recipe_products.c.recipe_id == Recipe.id)\
+                               .filter(recipe_products.c.product_id == product_id,
+                                       Recipe.is_published == True)\
+                               .order_by(Recipe.is_featured.desc(),
+                                         Recipe.views_count.desc(),
+                                         Recipe.created_at.desc()).all()
+        
         search_query = f"recipe {product_name}"
         return RecipeSearch.search_recipes(search_query, language)
     
     @staticmethod
     def get_featured_recipes(language='fr', limit=6):
         """Récupère les recettes mises en avant"""
-        recipes = Recipe.query.filter(
+        recipes = Recipe.query.options(*Recipe.language_load_options(language)).filter(
             Recipe.is_published == True,
             Recipe.is_featured == True
         ).order_by(Recipe.views_count.desc()).limit(limit).all()
         
         return [recipe.to_dict(language) for recipe in recipes]
     
+    @staticmethod
+    def search_recipes_ranked(query: str, language='fr', limit=20, offset=0):
+        """
+        Recherche plein texte classée par pertinence (BM25), avec extrait surligné.
+        Retombe sur la recherche LIKE si la base n'a pas d'index plein texte (ou s'il est encore vide).
+        """
+        hits = recipe_fulltext_index.search(query, language, limit=limit, offset=offset)
+        if hits is None:
+            recipes = RecipeSearch.search_recipes(query, language)[offset:offset + limit]
+            return [{'recipe': recipe.to_dict(language), 'score': None, 'snippet': None}
+                    for recipe in recipes]
+        
+        recipes = {recipe.id: recipe for recipe in
+                   Recipe.query.options(*Recipe.language_load_options(language))
+                               .filter(Recipe.id.in_([hit['recipe_id'] for hit in hits]))}
+        return [
+            {'recipe': recipes[hit['recipe_id']].to_dict(language),
+             'score': hit['score'],
+             'snippet': hit['snippet']}
+            for hit in hits if hit['recipe_id'] in recipes
+        ]
+    
     @staticmethod
     def get_popular_recipes(language='fr', limit=10):
         """Récupère les recettes populaires"""
-        recipes = Recipe.query.filter(
+        recipes = Recipe.query.options(*Recipe.language_load_options(language)).filter(
             Recipe.is_published == True
         ).order_by(Recipe.views_count.desc()).limit(limit).all()
         
         return [recipe.to_dict(language) for recipe in recipes]
 
+
+# Synchronisation des index de recherche
+from recipe_fts import recipe_fulltext_index
+from recipe_cjk import recipe_cjk_index
+from recipe_bitmaps import recipe_bitmap_index
+from recipe_products import recipe_product_index, recipe_products
+register_recipe_listener(recipe_fulltext_index.on_recipe_write)
+register_recipe_listener(recipe_cjk_index.on_recipe_write)
+register_recipe_listener(recipe_bitmap_index.on_recipe_write)
+register_recipe_listener(recipe_product_index.on_recipe_write)
+
+# Compteurs de vues et de likes en écriture différée
+from recipe_counters import recipe_counter_buffer
+
+
+# Maintenance des index dérivés (remplis automatiquement au démarrage s'ils sont vides)
+recipes_cli = AppGroup('recipes', help='Maintenance des index de recherche des recettes.')
+
+@recipes_cli.command('rebuild-indexes')
+def rebuild_indexes_command():
+    """Reconstruit les index dérivés depuis la table recipes."""
+    click.echo(f"Index plein texte : {recipe_fulltext_index.rebuild()} recettes")
+    click.echo(f"Index produit -> recettes : {recipe_product_index.rebuild()} recettes")
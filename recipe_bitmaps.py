@@ -0,0 +1,123 @@
+"""
+Index bitmap en mémoire des filtres de recherche de recettes pour CFA
+Un bitmap par valeur (régime, cuisine, difficulté, tranche de temps) : bit n = recette n
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from recipe_refresh import RefreshedRecipeIndex
+
+# Bornes cumulées de temps total : un bitmap par borne, "prête en N minutes ou moins"
+TIME_BUCKETS = (15, 30, 45, 60, 90, 120, 180)
+# Au-delà, une liste IN coûte plus que les filtres SQL d'origine
+MAX_CANDIDATES = 5000
+
+def _bit_ids(bitmap: int) -> List[int]:
+    """Positions des bits à 1, dans l'ordre croissant"""
+    bits = bin(bitmap)[:1:-1]
+    ids = []
+    position = bits.find('1')
+    while position != -1:
+        ids.append(position)
+        position = bits.find('1', position + 1)
+    return ids
+
+class RecipeBitmapIndex(RefreshedRecipeIndex):
+    """Bitmaps (entiers Python) des recettes publiées, par valeur de filtre"""
+
+    label = 'bitmap'
+
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        super().__init__()
+        self.max_candidates = max_candidates
+        self.bitmaps: Dict[Tuple[str, object], int] = {}
+        self.documents: Dict[int, Tuple] = {}
+
+    @staticmethod
+    def _recipe_keys(recipe) -> Tuple:
+        keys = [('cuisine_type', recipe.cuisine_type), ('difficulty', recipe.difficulty)]
+        keys.extend(('dietary_tag', tag) for tag in set(recipe.dietary_tags or []))
+        # Même sémantique que le filtre SQL : un temps manquant ne satisfait aucun max_time
+        if recipe.prep_time is not None and recipe.cook_time is not None:
+            total_time = recipe.prep_time + recipe.cook_time
+            keys.extend(('max_time', bound) for bound in TIME_BUCKETS if total_time <= bound)
+        return tuple(key for key in keys if key[1] is not None)
+
+    def _recipe_query(self):
+        from recipe import Recipe
+        return Recipe.query
+
+    def _empty_state(self):
+        return {}, {}
+
+    def _current_state(self):
+        return self.bitmaps, self.documents
+
+    def _install(self, state) -> None:
+        self.bitmaps, self.documents = state
+
+    def _capture(self, recipe) -> Optional[Tuple]:
+        """Clés à indexer ; None pour retirer la recette (non publiée)"""
+        return self._recipe_keys(recipe) if recipe.is_published else None
+
+    def _apply_change(self, state, recipe_id: int, keys: Optional[Tuple]) -> None:
+        bitmaps, documents = state
+        self._remove(bitmaps, documents, recipe_id)
+        if keys is None:
+            return
+        bit = 1 << recipe_id
+        documents[recipe_id] = keys
+        for key in keys:
+            bitmaps[key] = bitmaps.get(key, 0) | bit
+
+    @staticmethod
+    def _remove(bitmaps, documents, recipe_id: int) -> None:
+        keys = documents.pop(recipe_id, None)
+        if keys is None:
+            return
+        mask = ~(1 << recipe_id)
+        for key in keys:
+            bitmap = bitmaps[key] & mask
+            if bitmap:
+                bitmaps[key] = bitmap
+            else:
+                del bitmaps[key]
+
+    def match(self, filters) -> Optional[List[int]]:
+        """
+        Ids des recettes publiées satisfaisant cuisine, difficulté, régimes et temps max ;
+        None si l'index ne peut pas répondre (pas prêt, aucun filtre indexé, trop de résultats).
+        Le temps max est arrondi à la borne supérieure : le filtre SQL exact reste nécessaire.
+        """
+        if not self.is_ready or not filters:
+            return None
+
+        keys = []
+        if filters.get('cuisine_type'):
+            keys.append(('cuisine_type', filters['cuisine_type']))
+        if filters.get('difficulty'):
+            keys.append(('difficulty', filters['difficulty']))
+        keys.extend(('dietary_tag', tag) for tag in filters.get('dietary_tags') or [])
+        if filters.get('max_time'):
+            bound = next((bound for bound in TIME_BUCKETS if bound >= filters['max_time']), None)
+            if bound is not None:
+                keys.append(('max_time', bound))
+        if not keys:
+            return None
+
+        with self._lock:
+            bitmaps = [self.bitmaps.get(key, 0) for key in keys]
+        # Intersection en commençant par le bitmap le plus creux
+        bitmaps.sort(key=lambda bitmap: bitmap.bit_length())
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            if not result:
+                break
+            result &= bitmap
+
+        if bin(result).count('1') > self.max_candidates:
+            return None
+        return _bit_ids(result)
+
+# Instance globale de l'index bitmap
+recipe_bitmap_index = RecipeBitmapIndex()
@@ -0,0 +1,168 @@
+"""
+Index n-grammes en mémoire pour la recherche de recettes en coréen et en chinois
+Les tokenizers par mots ne segmentent pas le CJK : on indexe caractères et bigrammes
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from recipe_refresh import RefreshedRecipeIndex
+
+CJK_LANGUAGES = ('ko', 'zh')
+# Au-delà, une liste IN coûte plus que la recherche LIKE d'origine
+MAX_CANDIDATES = 5000
+
+def _normalize(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        return ' '.join(_normalize(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_normalize(item) for item in value)
+    return ' '.join(str(value).casefold().split())
+
+def _segment_grams(segment: str):
+    """Caractères seuls + bigrammes d'un segment sans espace"""
+    grams = set(segment)
+    grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+def _text_grams(text: str):
+    grams = set()
+    for segment in text.split():
+        grams |= _segment_grams(segment)
+    return grams
+
+def _intersect(left: array, right: array) -> array:
+    """Intersection de deux listes triées : on parcourt la plus courte, recherche dichotomique dans l'autre"""
+    if len(left) > len(right):
+        left, right = right, left
+    result = array('I')
+    position = 0
+    for value in left:
+        position = bisect_left(right, value, position)
+        if position == len(right):
+            break
+        if right[position] == value:
+            result.append(value)
+    return result
+
+class _LanguageIndex:
+    """Postings triés (array d'entiers non signés) + texte normalisé par recette"""
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.documents: Dict[int, str] = {}
+
+    def add(self, recipe_id: int, text: str) -> None:
+        self.remove(recipe_id)
+        self.documents[recipe_id] = text
+        for gram in _text_grams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            position = bisect_left(posting, recipe_id)
+            if position == len(posting) or posting[position] != recipe_id:
+                posting.insert(position, recipe_id)
+
+    def remove(self, recipe_id: int) -> None:
+        text = self.documents.pop(recipe_id, None)
+        if text is None:
+            return
+        for gram in _text_grams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                continue
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+            if not posting:
+                del self.postings[gram]
+
+    def lookup(self, query: str) -> List[int]:
+        segments = query.split()
+        grams = set()
+        for segment in segments:
+            # Un segment d'un caractère n'a que son unigramme ; sinon les bigrammes suffisent
+            grams |= {segment} if len(segment) == 1 else {
+                segment[i:i + 2] for i in range(len(segment) - 1)
+            }
+
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+
+        postings.sort(key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = _intersect(candidates, posting)
+            if not candidates:
+                return []
+
+        # Les bigrammes peuvent être présents sans être contigus : vérification finale
+        return [recipe_id for recipe_id in candidates
+                if all(segment in self.documents[recipe_id] for segment in segments)]
+
+class CJKNgramIndex(RefreshedRecipeIndex):
+    """Index n-grammes des champs ko/zh des recettes publiées"""
+
+    label = 'CJK'
+
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        super().__init__()
+        self.max_candidates = max_candidates
+        self.languages = self._empty_state()
+
+    @staticmethod
+    def _recipe_text(recipe, language: str) -> str:
+        # Mêmes colonnes que la recherche LIKE, plus les ingrédients
+        return _normalize([
+            getattr(recipe, f'title_{language}'),
+            getattr(recipe, f'description_{language}'),
+            recipe.title,
+            getattr(recipe, f'ingredients_{language}'),
+        ])
+
+    def _recipe_query(self):
+        from recipe import Recipe
+        return Recipe.query.options(*Recipe.language_load_options(*CJK_LANGUAGES))
+
+    def _empty_state(self) -> Dict[str, _LanguageIndex]:
+        return {language: _LanguageIndex() for language in CJK_LANGUAGES}
+
+    def _current_state(self) -> Dict[str, _LanguageIndex]:
+        return self.languages
+
+    def _install(self, languages: Dict[str, _LanguageIndex]) -> None:
+        self.languages = languages
+
+    def _capture(self, recipe) -> Optional[Dict[str, str]]:
+        """Texte à indexer par langue ; None pour retirer la recette de l'index"""
+        if not recipe.is_published:
+            return None
+        return {language: self._recipe_text(recipe, language) for language in CJK_LANGUAGES}
+
+    def _apply_change(self, languages, recipe_id: int, texts: Optional[Dict[str, str]]) -> None:
+        for language, index in languages.items():
+            if texts is None:
+                index.remove(recipe_id)
+            else:
+                index.add(recipe_id, texts[language])
+
+    def lookup(self, query: str, language: str) -> Optional[List[int]]:
+        """Ids des recettes contenant la requête ; None si l'index ne peut pas répondre (trop de résultats)"""
+        normalized = _normalize(query)
+        if not self.is_ready or language not in self.languages or not normalized:
+            return None
+        with self._lock:
+            recipe_ids = self.languages[language].lookup(normalized)
+        if len(recipe_ids) > self.max_candidates:
+            return None
+        return recipe_ids
+
+# Instance globale de l'index CJK
+recipe_cjk_index = CJKNgramIndex()
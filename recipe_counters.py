@@ -0,0 +1,122 @@
+"""
+Compteurs de vues et de likes des recettes en écriture différée pour CFA
+Les incréments sont cumulés en mémoire puis appliqués par lots
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from sqlalchemy import bindparam, update
+
+from src.models.base import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5
+COUNTER_COLUMNS = ('views_count', 'likes_count')
+
+class RecipeCounterBuffer:
+    """Tampon par processus des incréments de compteurs, vidé périodiquement"""
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self.is_running = False
+        self.flush_listeners: List[Callable[[Dict[int, Dict[str, int]]], None]] = []
+        self._pending: Dict[int, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+        self._lock = threading.Lock()
+        self._app = None
+
+    def increment(self, recipe_id: int, column: str = 'views_count', amount: int = 1) -> None:
+        """Cumule un incrément ; écrit immédiatement si le flush périodique n'est pas démarré"""
+        if column not in COUNTER_COLUMNS:
+            raise ValueError(f"Compteur inconnu: {column}")
+        with self._lock:
+            self._pending[recipe_id][column] += amount
+        if not self.is_running:
+            self.flush()
+
+    def pending_delta(self, recipe_id: int, column: str = 'views_count') -> int:
+        """Incréments pas encore écrits pour une recette"""
+        with self._lock:
+            entry = self._pending.get(recipe_id)
+            return entry[column] if entry else 0
+
+    def flush(self) -> int:
+        """Applique les incréments cumulés : un UPDATE relatif par recette, en un seul executemany"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+        if not pending:
+            return 0
+
+        from recipe import Recipe
+        table = Recipe.__table__
+        statement = update(table).where(table.c.id == bindparam('recipe_id')).values(
+            views_count=db.func.coalesce(table.c.views_count, 0) + bindparam('views_delta'),
+            likes_count=db.func.coalesce(table.c.likes_count, 0) + bindparam('likes_delta'),
+            # Un compteur qui bouge n'est pas une modification de contenu
+            updated_at=table.c.updated_at
+        )
+        rows = [
+            {'recipe_id': recipe_id, 'views_delta': deltas['views_count'], 'likes_delta': deltas['likes_count']}
+            for recipe_id, deltas in pending.items()
+        ]
+
+        try:
+            # Connexion et transaction propres : la session de l'appelant n'est jamais validée
+            with db.engine.begin() as connection:
+                connection.execute(statement, rows)
+        except Exception:
+            # Rien n'est perdu : les incréments reviennent dans le tampon
+            with self._lock:
+                for recipe_id, deltas in pending.items():
+                    for column, amount in deltas.items():
+                        self._pending[recipe_id][column] += amount
+            raise
+
+        for listener in self.flush_listeners:
+            try:
+                listener(pending)
+            except Exception as e:
+                logger.error('Erreur listener compteurs: %s', e)
+        return len(rows)
+
+    def start(self, app, flush_interval: float = None):
+        """Démarre le flush périodique et le vidage à l'arrêt du processus"""
+        if self.is_running:
+            return
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._app = app
+        self.is_running = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.drain)
+
+    def stop(self):
+        self.is_running = False
+
+    def drain(self):
+        """Arrête le flush périodique et écrit ce qui reste"""
+        self.is_running = False
+        if self._app is None:
+            return
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Compteurs non écrits à l\'arrêt: %s', e)
+
+    def _flush_loop(self):
+        with self._app.app_context():
+            while self.is_running:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error('Erreur flush compteurs: %s', e)
+
+# Instance globale du tampon de compteurs
+recipe_counter_buffer = RecipeCounterBuffer()
@@ -0,0 +1,147 @@
+"""
+Flux de recettes mis en avant / populaires pré-calculés par langue pour CFA
+Les blocs de la page d'accueil sont servis depuis la mémoire, avec ETag
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, NamedTuple, Tuple
+
+from flask import Response, request
+from sqlalchemy.orm import object_session
+
+from recipe import RecipeSearch, register_recipe_listener
+from recipe_counters import recipe_counter_buffer
+from src.models.base import db, run_after_commit
+
+logger = logging.getLogger(__name__)
+
+FEED_LANGUAGES = ('fr', 'en', 'ko', 'zh')
+FEEDS = {
+    'featured': (RecipeSearch.get_featured_recipes, 6),
+    'popular': (RecipeSearch.get_popular_recipes, 10),
+}
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+DEFAULT_VIEWS_THRESHOLD = 500
+FEED_MAX_AGE_SECONDS = 60
+
+class FeedEntry(NamedTuple):
+    body: bytes
+    etag: str
+    built_at: float
+
+class RecipeFeedCache:
+    """
+    Blobs JSON prêts à l'envoi, un par (flux, langue).
+    Invalidés à chaque écriture de recette ou après views_threshold vues,
+    et reconstruits périodiquement pour suivre les autres processus.
+    """
+
+    def __init__(self, views_threshold: int = DEFAULT_VIEWS_THRESHOLD):
+        self.views_threshold = views_threshold
+        self.is_running = False
+        self._entries: Dict[Tuple[str, str], FeedEntry] = {}
+        self._views_since_build = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Une seule construction à la fois ; l'invalidation n'attend pas la fin d'une construction
+        self._build_lock = threading.Lock()
+
+    def get(self, feed: str, language: str = 'fr') -> FeedEntry:
+        """Blob du flux ; construit à la première demande après invalidation"""
+        if feed not in FEEDS:
+            raise ValueError(f"Flux inconnu: {feed}")
+        if language not in FEED_LANGUAGES:
+            language = 'fr'
+
+        entry = self._entries.get((feed, language))
+        if entry is not None:
+            return entry
+        with self._build_lock:
+            # Une seule construction par flux manquant, même sous requêtes concurrentes
+            entry = self._entries.get((feed, language))
+            if entry is not None:
+                return entry
+            generation = self._generation
+            entry = self._build(feed, language)
+        with self._lock:
+            # Invalidé pendant la construction : le blob est servi une fois mais pas conservé
+            if generation == self._generation:
+                self._entries[(feed, language)] = entry
+        return entry
+
+    @staticmethod
+    def _build(feed: str, language: str) -> FeedEntry:
+        loader, limit = FEEDS[feed]
+        body = json.dumps(loader(language, limit), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return FeedEntry(body, hashlib.sha1(body).hexdigest(), time.time())
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._views_since_build = 0
+            self._generation += 1
+
+    def refresh(self) -> int:
+        """Reconstruit tous les flux et remplace le cache d'un bloc"""
+        generation = self._generation
+        entries = {
+            (feed, language): self._build(feed, language)
+            for feed in FEEDS for language in FEED_LANGUAGES
+        }
+        with self._lock:
+            # Une écriture pendant la reconstruction rend ces blobs déjà périmés
+            if generation != self._generation:
+                return 0
+            self._entries = entries
+            self._views_since_build = 0
+        return len(entries)
+
+    def on_recipe_write(self, connection, recipe, operation: str) -> None:
+        """Listener d'écriture : contenu, mise en avant ou publication ont pu changer (effectif au commit)"""
+        run_after_commit(object_session(recipe), self.invalidate)
+
+    def on_counters_flushed(self, pending: Dict[int, Dict[str, int]]) -> None:
+        """Listener du tampon de compteurs : le classement par vues n'est plus à jour au-delà du seuil"""
+        with self._lock:
+            self._views_since_build += sum(deltas['views_count'] for deltas in pending.values())
+            is_stale = self._views_since_build >= self.views_threshold
+        if is_stale:
+            self.invalidate()
+
+    def response(self, feed: str, language: str = 'fr') -> Response:
+        """Réponse HTTP conditionnelle (304 si l'ETag du client est à jour)"""
+        entry = self.get(feed, language)
+        response = Response(entry.body, mimetype='application/json')
+        response.set_etag(entry.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = FEED_MAX_AGE_SECONDS
+        return response.make_conditional(request)
+
+    def start(self, app, interval_seconds: int = DEFAULT_REFRESH_INTERVAL_SECONDS):
+        """Démarre la reconstruction périodique des flux"""
+        if not self.is_running:
+            self.is_running = True
+            threading.Thread(target=self._refresh_loop, args=(app, interval_seconds), daemon=True).start()
+
+    def stop(self):
+        self.is_running = False
+
+    def _refresh_loop(self, app, interval_seconds: int):
+        with app.app_context():
+            while self.is_running:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error('Erreur rafraîchissement flux recettes: %s', e)
+                finally:
+                    db.session.remove()
+                time.sleep(interval_seconds)
+
+# Instance globale des flux
+recipe_feed_cache = RecipeFeedCache()
+register_recipe_listener(recipe_feed_cache.on_recipe_write)
+recipe_counter_buffer.flush_listeners.append(recipe_feed_cache.on_counters_flushed)
@@ -0,0 +1,258 @@
+"""
+Index plein texte des recettes pour CFA
+SQLite : table virtuelle FTS5 (classement BM25)
+PostgreSQL : documents tsvector indexés en GIN (classement ts_rank_cd)
+"""
+
+import html
+import logging
+import re
+
+from sqlalchemy import text
+
+from src.models.base import db
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_LANGUAGES = ('fr', 'en', 'ko', 'zh')
+SNIPPET_TOKENS = 12
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+# Marqueurs émis par le SGBD (zone d'usage privé Unicode) : le texte est échappé
+# avant qu'ils ne deviennent des balises, le snippet est donc du HTML sûr
+_SNIPPET_START_SENTINEL = '\ue000'
+_SNIPPET_END_SENTINEL = '\ue001'
+
+# Poids des colonnes : titre > description > ingrédients > instructions
+SQLITE_BM25_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+POSTGRES_TEXT_CONFIGS = {'fr': 'french', 'en': 'english', 'ko': 'simple', 'zh': 'simple'}
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def _flatten(value) -> str:
+    """Aplatit les champs JSON (listes, dictionnaires) en texte indexable"""
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        return ' '.join(_flatten(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_flatten(item) for item in value)
+    return str(value)
+
+def _render_snippet(snippet) -> str:
+    """Échappe le texte stocké puis remplace les marqueurs par les balises de surlignage"""
+    if snippet is None:
+        return ''
+    return html.escape(snippet)\
+        .replace(_SNIPPET_START_SENTINEL, SNIPPET_START)\
+        .replace(_SNIPPET_END_SENTINEL, SNIPPET_END)
+
+def _clean_query(query: str) -> str:
+    query = query.strip()
+    if query.lower().startswith('recipe '):
+        query = query[7:].strip()
+    return query
+
+class RecipeFullTextIndex:
+    """Index plein texte multilingue synchronisé sur les écritures de Recipe"""
+
+    def __init__(self):
+        self._schema_ready = set()
+        self._populated = set()
+
+    @staticmethod
+    def _dialect(connection) -> str:
+        return connection.dialect.name
+
+    def is_supported(self, connection) -> bool:
+        return self._dialect(connection) in ('sqlite', 'postgresql')
+
+    def ensure_schema(self, connection) -> bool:
+        """Crée la table d'index si nécessaire ; False si le SGBD n'est pas géré"""
+        if not self.is_supported(connection):
+            return False
+
+        url = str(connection.engine.url)
+        if url in self._schema_ready:
+            return True
+
+        if self._dialect(connection) == 'sqlite':
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5("
+                "recipe_id UNINDEXED, language UNINDEXED, "
+                "title, description, ingredients, instructions, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        else:
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS recipe_search_documents ("
+                "recipe_id INTEGER NOT NULL, language VARCHAR(2) NOT NULL, "
+                "title TEXT, description TEXT, document TSVECTOR NOT NULL, "
+                "PRIMARY KEY (recipe_id, language))"
+            ))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_recipe_search_documents_document "
+                "ON recipe_search_documents USING GIN (document)"
+            ))
+
+        self._schema_ready.add(url)
+        return True
+
+    def _table(self, connection) -> str:
+        return 'recipes_fts' if self._dialect(connection) == 'sqlite' else 'recipe_search_documents'
+
+    def _is_populated(self, connection) -> bool:
+        """Vrai si l'index contient des documents, ou s'il n'y a aucune recette à indexer"""
+        url = str(connection.engine.url)
+        if url not in self._populated:
+            if connection.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {self._table(connection)}) "
+                f"OR NOT EXISTS (SELECT 1 FROM recipes)"
+            )).scalar():
+                self._populated.add(url)
+        return url in self._populated
+
+    def ensure_built(self) -> int:
+        """
+        Crée l'index s'il manque et le remplit depuis les recettes existantes s'il est vide
+        (appelé au démarrage : l'index est créé après coup sur les bases déjà en service)
+        """
+        connection = db.session.connection()
+        if not self.ensure_schema(connection):
+            return 0
+        db.session.commit()
+        if self._is_populated(db.session.connection()):
+            return 0
+        return self.rebuild()
+
+    def on_recipe_write(self, connection, recipe, operation: str) -> None:
+        """Listener d'écriture : réindexe ou retire la recette"""
+        if not self.ensure_schema(connection):
+            return
+        self._remove(connection, recipe.id)
+        if operation != 'delete':
+            self._index(connection, recipe)
+
+    def _remove(self, connection, recipe_id: int) -> None:
+        if self._dialect(connection) == 'sqlite':
+            # recipe_id n'est pas indexé dans FTS5 : on supprime par plage de rowid
+            first_rowid = recipe_id * len(SUPPORTED_LANGUAGES)
+            connection.execute(text("DELETE FROM recipes_fts WHERE rowid BETWEEN :first AND :last"),
+                               {'first': first_rowid, 'last': first_rowid + len(SUPPORTED_LANGUAGES) - 1})
+        else:
+            connection.execute(text("DELETE FROM recipe_search_documents WHERE recipe_id = :recipe_id"),
+                               {'recipe_id': recipe_id})
+
+    def _documents(self, recipe):
+        # Le contenu localisé (avec repli sur le français) est celui que voit l'utilisateur
+        for slot, language in enumerate(SUPPORTED_LANGUAGES):
+            localized = recipe.get_localized_content(language)
+            yield {
+                'rowid': recipe.id * len(SUPPORTED_LANGUAGES) + slot,
+                'recipe_id': recipe.id,
+                'language': language,
+                'title': localized['title'] or '',
+                'description': localized['description'] or '',
+                'ingredients': _flatten(localized['ingredients']),
+                'instructions': _flatten(localized['instructions']),
+                'config': POSTGRES_TEXT_CONFIGS[language],
+            }
+
+    def _index(self, connection, recipe) -> None:
+        documents = list(self._documents(recipe))
+        if self._dialect(connection) == 'sqlite':
+            connection.execute(text(
+                "INSERT INTO recipes_fts (rowid, recipe_id, language, title, description, ingredients, instructions) "
+                "VALUES (:rowid, :recipe_id, :language, :title, :description, :ingredients, :instructions)"
+            ), documents)
+        else:
+            connection.execute(text(
+                "INSERT INTO recipe_search_documents (recipe_id, language, title, description, document) "
+                "VALUES (:recipe_id, :language, :title, :description, "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :title), 'A') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :description), 'B') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :ingredients), 'C') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :instructions), 'D'))"
+            ), documents)
+
+    def rebuild(self) -> int:
+        """Réindexe toutes les recettes (après création de l'index sur une base existante)"""
+        from recipe import Recipe
+
+        connection = db.session.connection()
+        if not self.ensure_schema(connection):
+            return 0
+
+        connection.execute(text(f"DELETE FROM {self._table(connection)}"))
+        count = 0
+        for recipe in Recipe.query.options(*Recipe.language_load_options(*SUPPORTED_LANGUAGES)).yield_per(500):
+            self._index(connection, recipe)
+            count += 1
+        db.session.commit()
+        self._populated.add(str(connection.engine.url))
+        logger.info('Index plein texte reconstruit pour %s recettes', count)
+        return count
+
+    def search(self, query: str, language: str = 'fr', limit: int = 20, offset: int = 0):
+        """
+        Renvoie [{'recipe_id', 'score', 'snippet'}] triés par pertinence,
+        ou None si l'index n'est pas disponible sur ce SGBD ou pas encore rempli
+        """
+        connection = db.session.connection()
+        if not self.ensure_schema(connection) or not self._is_populated(connection):
+            return None
+
+        if language not in SUPPORTED_LANGUAGES:
+            language = 'fr'
+
+        search_term = _clean_query(query)
+        if self._dialect(connection) == 'sqlite':
+            return self._search_sqlite(connection, search_term, language, limit, offset)
+        return self._search_postgres(connection, search_term, language, limit, offset)
+
+    def _search_sqlite(self, connection, search_term, language, limit, offset):
+        tokens = _TOKEN_PATTERN.findall(search_term)
+        if not tokens:
+            return []
+
+        # Chaque mot est cité : la saisie utilisateur ne peut pas injecter de syntaxe FTS5
+        match = ' '.join('"{}"'.format(token.replace('"', '""')) for token in tokens)
+        weights = ', '.join(str(weight) for weight in SQLITE_BM25_WEIGHTS)
+        rows = connection.execute(text(
+            f"SELECT f.recipe_id, bm25(recipes_fts, 0.0, 0.0, {weights}) AS rank, "
+            f"snippet(recipes_fts, -1, :start, :end, '…', :tokens) AS snippet "
+            f"FROM recipes_fts AS f JOIN recipes AS r ON r.id = f.recipe_id "
+            f"WHERE recipes_fts MATCH :match AND f.language = :language AND r.is_published = 1 "
+            f"ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {
+            'match': match, 'language': language, 'limit': limit, 'offset': offset,
+            'start': _SNIPPET_START_SENTINEL, 'end': _SNIPPET_END_SENTINEL, 'tokens': SNIPPET_TOKENS,
+        })
+        # bm25() renvoie des valeurs négatives : plus petit = plus pertinent
+        return [{'recipe_id': int(recipe_id), 'score': -rank, 'snippet': _render_snippet(snippet)}
+                for recipe_id, rank, snippet in rows]
+
+    def _search_postgres(self, connection, search_term, language, limit, offset):
+        if not search_term:
+            return []
+
+        rows = connection.execute(text(
+            "SELECT d.recipe_id, ts_rank_cd(d.document, q) AS score, "
+            "ts_headline(CAST(:config AS regconfig), coalesce(nullif(d.description, ''), d.title), q, "
+            ":headline_options) AS snippet "
+            "FROM recipe_search_documents AS d "
+            "JOIN recipes AS r ON r.id = d.recipe_id, "
+            "websearch_to_tsquery(CAST(:config AS regconfig), :query) AS q "
+            "WHERE d.language = :language AND r.is_published AND d.document @@ q "
+            "ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        ), {
+            'config': POSTGRES_TEXT_CONFIGS[language], 'query': search_term,
+            'language': language, 'limit': limit, 'offset': offset,
+            'headline_options': (f'StartSel={_SNIPPET_START_SENTINEL}, StopSel={_SNIPPET_END_SENTINEL}, '
+                                 f'MaxWords={SNIPPET_TOKENS * 2}'),
+        })
+        return [{'recipe_id': int(recipe_id), 'score': float(score), 'snippet': _render_snippet(snippet)}
+                for recipe_id, score, snippet in rows]
+
+# Instance globale de l'index plein texte
+recipe_fulltext_index = RecipeFullTextIndex()
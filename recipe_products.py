@@ -0,0 +1,89 @@
+"""
+Index inverse produit -> recettes pour CFA
+Table d'association dérivée de Recipe.featured_products, tenue à jour à chaque écriture
+"""
+
+import logging
+
+from sqlalchemy import delete, exists, insert, inspect, select
+from sqlalchemy.orm import load_only
+
+from src.models.base import db
+
+logger = logging.getLogger(__name__)
+
+REBUILD_YIELD_PER = 500
+
+# Pas de clé étrangère sur product_id : featured_products peut citer un produit supprimé
+recipe_products = db.Table(
+    'recipe_products',
+    db.Column('product_id', db.Integer, primary_key=True),
+    db.Column('recipe_id', db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'),
+              primary_key=True, index=True)
+)
+
+def _product_ids(recipe):
+    product_ids = set()
+    for product_id in recipe.featured_products or []:
+        try:
+            product_ids.add(int(product_id))
+        except (TypeError, ValueError):
+            continue
+    return product_ids
+
+class RecipeProductIndex:
+    """Maintient recipe_products à partir de featured_products"""
+
+    def on_recipe_write(self, connection, recipe, operation: str) -> None:
+        """Listener d'écriture : réécrit les liens de la recette si featured_products a changé"""
+        if operation == 'update' and not inspect(recipe).attrs.featured_products.history.has_changes():
+            return
+        connection.execute(delete(recipe_products).where(recipe_products.c.recipe_id == recipe.id))
+        if operation != 'delete':
+            self._insert(connection, {recipe.id: _product_ids(recipe)})
+
+    @staticmethod
+    def _insert(connection, links) -> None:
+        rows = [
+            {'recipe_id': recipe_id, 'product_id': product_id}
+            for recipe_id, product_ids in links.items() for product_id in product_ids
+        ]
+        if rows:
+            connection.execute(insert(recipe_products), rows)
+
+    def ensure_built(self) -> int:
+        """
+        Remplit la table depuis les recettes existantes si elle est vide
+        (appelé au démarrage : la table est créée après coup sur les bases déjà en service)
+        """
+        from recipe import Recipe
+
+        populated = db.session.execute(
+            select(exists().select_from(recipe_products) | ~exists().select_from(Recipe.__table__))
+        ).scalar()
+        if populated:
+            return 0
+        return self.rebuild()
+
+    def rebuild(self) -> int:
+        """Recalcule toute la table (après sa création sur une base existante)"""
+        from recipe import Recipe
+
+        connection = db.session.connection()
+        connection.execute(delete(recipe_products))
+        links = {}
+        count = 0
+        query = Recipe.query.options(load_only(Recipe.id, Recipe.featured_products))
+        for recipe in query.yield_per(REBUILD_YIELD_PER):
+            links[recipe.id] = _product_ids(recipe)
+            count += 1
+            if len(links) >= REBUILD_YIELD_PER:
+                self._insert(connection, links)
+                links = {}
+        self._insert(connection, links)
+        db.session.commit()
+        logger.info('Index produit -> recettes reconstruit pour %s recettes', count)
+        return count
+
+# Instance globale de l'index produit -> recettes
+recipe_product_index = RecipeProductIndex()
@@ -0,0 +1,147 @@
+"""
+Index de recettes tenus en mémoire par chaque processus pour CFA
+Écritures locales appliquées au commit, rattrapage périodique des autres processus
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy.orm import object_session
+
+from src.models.base import db, run_after_commit
+
+logger = logging.getLogger(__name__)
+
+REBUILD_YIELD_PER = 500
+DEFAULT_REFRESH_INTERVAL_SECONDS = 30
+# updated_at est posé au flush, pas au commit : une transaction plus longue que la marge
+# ou une suppression faite par un autre processus n'est vue qu'à la reconstruction complète
+WATERMARK_OVERLAP = timedelta(minutes=2)
+FULL_REBUILD_INTERVAL_SECONDS = 600
+
+class RefreshedRecipeIndex:
+    """
+    Base des index en mémoire des recettes publiées.
+    Les sous-classes décrivent leur état et comment y appliquer une recette :
+    _recipe_query, _empty_state, _current_state, _install, _capture, _apply_change.
+    """
+
+    label = 'recettes'
+
+    def __init__(self, full_rebuild_interval_seconds: int = FULL_REBUILD_INTERVAL_SECONDS):
+        self.full_rebuild_interval_seconds = full_rebuild_interval_seconds
+        self.is_ready = False
+        self.watermark = None
+        self.rebuilt_at = None
+        self.is_refreshing = False
+        self._lock = threading.Lock()
+
+    def _recipe_query(self):
+        raise NotImplementedError
+
+    def _empty_state(self):
+        raise NotImplementedError
+
+    def _current_state(self):
+        raise NotImplementedError
+
+    def _install(self, state) -> None:
+        raise NotImplementedError
+
+    def _capture(self, recipe):
+        """Valeurs indexées de la recette ; None pour la retirer (non publiée)"""
+        raise NotImplementedError
+
+    def _apply_change(self, state, recipe_id: int, change) -> None:
+        """Remplace les entrées de la recette dans l'état (change None : la retire)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _later(watermark, recipe):
+        if recipe.updated_at and (watermark is None or recipe.updated_at > watermark):
+            return recipe.updated_at
+        return watermark
+
+    def on_recipe_write(self, connection, recipe, operation: str) -> None:
+        """Listener d'écriture : valeurs lues pendant le flush, index modifié au commit seulement"""
+        if not self.is_ready:
+            return
+        # Rien n'est lu sur l'objet dans le callback : il est expiré après le commit
+        recipe_id = recipe.id
+        change = None if operation == 'delete' else self._capture(recipe)
+        run_after_commit(object_session(recipe), lambda: self._apply_locked(recipe_id, change))
+
+    def _apply_locked(self, recipe_id: int, change) -> None:
+        with self._lock:
+            self._apply_change(self._current_state(), recipe_id, change)
+
+    def rebuild(self) -> int:
+        """Reconstruit l'index depuis la base en un passage"""
+        from recipe import Recipe
+
+        state = self._empty_state()
+        watermark = None
+        count = 0
+        for recipe in self._recipe_query().filter(Recipe.is_published == True).yield_per(REBUILD_YIELD_PER):
+            self._apply_change(state, recipe.id, self._capture(recipe))
+            watermark = self._later(watermark, recipe)
+            count += 1
+
+        with self._lock:
+            self._install(state)
+            self.watermark = watermark
+            self.rebuilt_at = time.monotonic()
+            self.is_ready = True
+        logger.info('Index %s reconstruit pour %s recettes', self.label, count)
+        return count
+
+    def _rebuild_due(self) -> bool:
+        return (not self.is_ready or self.rebuilt_at is None
+                or time.monotonic() - self.rebuilt_at >= self.full_rebuild_interval_seconds)
+
+    def refresh(self) -> int:
+        """
+        Rattrape les recettes modifiées par les autres processus depuis le dernier passage,
+        avec une marge de recouvrement ; reconstruction complète à intervalle régulier
+        """
+        from recipe import Recipe
+
+        if self._rebuild_due():
+            return self.rebuild()
+
+        query = self._recipe_query()
+        watermark = self.watermark
+        if watermark is not None:
+            query = query.filter(Recipe.updated_at >= watermark - WATERMARK_OVERLAP)
+
+        count = 0
+        with self._lock:
+            state = self._current_state()
+            for recipe in query.yield_per(REBUILD_YIELD_PER):
+                self._apply_change(state, recipe.id, self._capture(recipe))
+                watermark = self._later(watermark, recipe)
+                count += 1
+            self.watermark = watermark
+        return count
+
+    def start_refresh(self, app, interval_seconds: int = DEFAULT_REFRESH_INTERVAL_SECONDS):
+        """Démarre le rattrapage périodique (un index par processus)"""
+        if not self.is_refreshing:
+            self.is_refreshing = True
+            threading.Thread(target=self._refresh_loop, args=(app, interval_seconds), daemon=True).start()
+
+    def stop_refresh(self):
+        self.is_refreshing = False
+
+    def _refresh_loop(self, app, interval_seconds: int):
+        with app.app_context():
+            while self.is_refreshing:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error('Erreur rafraîchissement index %s: %s', self.label, e)
+                finally:
+                    db.session.remove()
+                time.sleep(interval_seconds)
@@ -6,21 +6,72 @@ from flask_cors import CORS
 from sqlalchemy.exc import SQLAlchemyError
 from .models import db
 from .routes.user import user_bp
+from .routes.recipe import recipe_bp
+from .routes.search import search_bp
+from .routes.i18n import i18n_bp
+from .models.reward_backfill import rewards_cli
+from i18n import i18n
+from recipe import recipes_cli
+from recipe_fts import recipe_fulltext_index
+from recipe_products import recipe_product_index
 
 from .models import (
     User, Product, Order, OrderItem, PriceHistory,
-    CompetitorPrice, Review, Log, Coupon
+    CompetitorPrice, Review, Log, Coupon, GamificationEvent
 )
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_ENV = 'development'
+DEFAULT_DATABASE_FILENAME = 'app.db'
+DEFAULT_HEALTH_VERSION = '1.0.0'
 ENV_PRODUCTION = 'production'
 DEFAULT_POOL_RECYCLE_SECONDS = 300
 DEFAULT_HSTS_MAX_AGE_SECONDS = 31536000
 DEFAULT_CORS_ORIGINS = ''
 ADMIN_EMAIL_ENV = 'DEFAULT_ADMIN_EMAIL'
 ADMIN_PASSWORD_ENV = 'DEFAULT_ADMIN_PASSWORD'
+BACKGROUND_SERVICES_ENV = 'BACKGROUND_SERVICES'
+LEADERBOARD_SNAPSHOT_ENV = 'LEADERBOARD_SNAPSHOT_PATH'
+
+def _start_background_services(app):
+    """Construit les états en mémoire de ce processus puis démarre leur mise à jour périodique"""
+    from src.models.expiry import expiry_sweeper
+    from src.models.leaderboard import leaderboard_service
+    from src.models.reward_events import GamificationWorkerPool
+    from autocomplete import autocomplete_index
+    from recipe_bitmaps import recipe_bitmap_index
+    from recipe_cjk import recipe_cjk_index
+    from recipe_counters import recipe_counter_buffer
+    from recipe_feeds import recipe_feed_cache
+
+    snapshot_path = os.environ.get(LEADERBOARD_SNAPSHOT_ENV)
+    startup_tasks = (
+        ('Leaderboard warm-up', lambda: leaderboard_service.warm_up(snapshot_path)),
+        ('CJK index build', recipe_cjk_index.rebuild),
+        ('Bitmap index build', recipe_bitmap_index.rebuild),
+        ('Autocomplete index build', autocomplete_index.rebuild),
+    )
+    with app.app_context():
+        for name, task in startup_tasks:
+            try:
+                task()
+            except SQLAlchemyError as e:
+                logger.error('%s failed: %s', name, e)
+            finally:
+                db.session.remove()
+    leaderboard_service.start_reconcile(app)
+    recipe_cjk_index.start_refresh(app)
+    recipe_bitmap_index.start_refresh(app)
+    autocomplete_index.start_refresh(app)
+    recipe_counter_buffer.start(app)
+    recipe_feed_cache.start(app)
+    expiry_sweeper.start(app)
+    # Les actions enregistrées par process_user_action sont récompensées ici, hors requête
+    worker_pool = app.extensions['gamification_worker_pool'] = GamificationWorkerPool(app)
+    worker_pool.start()
+    if snapshot_path:
+        leaderboard_service.start_snapshots(snapshot_path)
 
 def create_app():
     """Factory pour créer l'application Flask"""
@@ -68,11 +119,36 @@ def create_app():
     app.config['SESSION_COOKIE_SECURE'] = env == 'production'
 
     db.init_app(app)
+    i18n.init_app(app)
 
     app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(recipe_bp, url_prefix='/api')
+    app.register_blueprint(search_bp, url_prefix='/api')
+    app.register_blueprint(i18n_bp, url_prefix='/api')
+    app.cli.add_command(rewards_cli)
+    app.cli.add_command(recipes_cli)
 
     with app.app_context():
         db.create_all()
+        # create_all saute les tables existantes : leurs index ajoutés depuis sont créés ici
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(db.engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    # Table plus ancienne que ses colonnes indexées : migration manuelle requise
+                    logger.warning('Index %s not created on %s: %s', index.name, table.name, e)
+        # Index de recherche ajoutés après coup : remplis une fois depuis les recettes existantes
+        try:
+            recipe_fulltext_index.ensure_built()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error('Full-text index backfill failed: %s', e)
+        try:
+            recipe_product_index.ensure_built()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error('Product index backfill failed: %s', e)
 
         # Création d'un utilisateur admin par défaut si nécessaire (only when not in production)
         if env != ENV_PRODUCTION:
@@ -100,6 +176,10 @@ def create_app():
                     db.session.commit()
                     logger.info('Default admin user created for %s.', admin_email)
 
+    # Index, classements et tâches périodiques (désactivables pour les commandes ponctuelles)
+    if os.environ.get(BACKGROUND_SERVICES_ENV, 'true').lower() in ('1', 'true'):
+        _start_background_services(app)
+
     @app.after_request
     def set_security_headers(response):
         """Add baseline security headers to all responses."""
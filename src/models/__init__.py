@@ -8,3 +8,4 @@ from .price_history import PriceHistory, CompetitorPrice
 from .review import Review
 from .log import Log
 from .coupon import Coupon
+from .reward_events import GamificationEvent
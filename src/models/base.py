@@ -1,9 +1,39 @@
+import logging
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from enum import Enum
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
+_AFTER_COMMIT_KEY = 'after_commit_callbacks'
+
+def run_after_commit(session, callback) -> None:
+    """
+    Exécute callback() une fois la transaction en cours de la session validée ;
+    abandonné si elle est annulée. Pour les états en mémoire (index, classements)
+    qui ne doivent refléter que des données commitées. Le callback ne doit pas
+    émettre de SQL sur cette session.
+    """
+    session.info.setdefault(_AFTER_COMMIT_KEY, []).append(callback)
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(session):
+    for callback in session.info.pop(_AFTER_COMMIT_KEY, ()):
+        try:
+            callback()
+        except Exception:
+            logger.exception('Erreur callback après commit')
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_after_commit_callbacks(session, transaction):
+    # Rollback ou fermeture sans commit de la transaction racine : rien n'a été écrit
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT_KEY, None)
+
 class UserRole(Enum):
     BUYER = "buyer"
     SELLER = "seller"
@@ -27,6 +27,11 @@ class Coupon(BaseModel):
     # Statut
     is_active = db.Column(db.Boolean, default=True)
     
+    # Sert le sweeper d'expiration (coupons actifs par date de fin)
+    __table_args__ = (
+        db.Index('ix_coupons_expiry', 'is_active', 'valid_until'),
+    )
+    
     @property
     def is_valid(self):
         """Vérifie si le coupon est valide"""
@@ -71,10 +76,24 @@ class Coupon(BaseModel):
     
     def use_coupon(self):
         """Marque le coupon comme utilisé"""
-        if not self.is_valid:
-            raise ValueError("Coupon invalide")
+        now = datetime.utcnow()
         
-        self.used_count += 1
+        # Les conditions de is_valid sont vérifiées dans l'UPDATE lui-même :
+        # deux commandes simultanées ne peuvent pas dépasser la limite d'utilisation
+        used = Coupon.query.filter(
+            Coupon.id == self.id,
+            Coupon.is_active == True,
+            db.or_(Coupon.valid_from.is_(None), Coupon.valid_from <= now),
+            db.or_(Coupon.valid_until.is_(None), Coupon.valid_until >= now),
+            db.or_(
+                Coupon.usage_limit.is_(None),
+                Coupon.usage_limit == 0,
+                Coupon.used_count < Coupon.usage_limit
+            )
+        ).update({Coupon.used_count: Coupon.used_count + 1}, synchronize_session='fetch')
+        
+        if not used:
+            raise ValueError("Coupon invalide")
         
         # Log de l'utilisation
         from src.models.log import Log
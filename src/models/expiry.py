@@ -0,0 +1,191 @@
+"""
+Expiration en arrière-plan des réductions échangées et des coupons pour CFA
+Se réveille uniquement à la prochaine échéance connue
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from src.models.base import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCHES_PER_PASS = 20
+DEFAULT_HEAP_SIZE = 1000
+DEFAULT_MAX_SLEEP_SECONDS = 3600
+
+class ExpiryTarget:
+    """Table dont les lignes expirent sur une colonne de date indexée"""
+
+    def __init__(self, name: str, model_loader: Callable, column_name: str,
+                 live_column_name: str, live_value: bool, utc: bool):
+        self.name = name
+        self._model_loader = model_loader
+        self.column_name = column_name
+        self.live_column_name = live_column_name
+        self.live_value = live_value
+        self.utc = utc  # Coupon stocke des dates UTC, UserReward des dates locales
+
+    @property
+    def model(self):
+        return self._model_loader()
+
+    @property
+    def column(self):
+        return getattr(self.model, self.column_name)
+
+    @property
+    def live_filter(self):
+        return getattr(self.model, self.live_column_name) == self.live_value
+
+    def now(self) -> datetime:
+        return datetime.utcnow() if self.utc else datetime.now()
+
+    def to_epoch(self, value: datetime) -> float:
+        if self.utc:
+            return value.replace(tzinfo=timezone.utc).timestamp()
+        return value.timestamp()
+
+def _user_reward_model():
+    from src.models.rewards import UserReward
+    return UserReward
+
+def _coupon_model():
+    from src.models.coupon import Coupon
+    return Coupon
+
+DEFAULT_TARGETS = [
+    ExpiryTarget('reward', _user_reward_model, 'expires_at', 'is_expired', False, utc=False),
+    ExpiryTarget('coupon', _coupon_model, 'valid_until', 'is_active', True, utc=True),
+]
+
+class ExpirySweeper:
+    """
+    Expire les lignes échues par lots bornés.
+    Un tas-min garde les prochaines échéances pour ne dormir que jusqu'à la suivante.
+    """
+
+    def __init__(self, targets: List[ExpiryTarget] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_batches_per_pass: int = DEFAULT_MAX_BATCHES_PER_PASS,
+                 heap_size: int = DEFAULT_HEAP_SIZE,
+                 max_sleep_seconds: int = DEFAULT_MAX_SLEEP_SECONDS):
+        self.targets = {target.name: target for target in (targets or DEFAULT_TARGETS)}
+        self.batch_size = batch_size
+        self.max_batches_per_pass = max_batches_per_pass
+        self.heap_size = heap_size
+        self.max_sleep_seconds = max_sleep_seconds
+        self.is_running = False
+        self.last_report: Dict[str, int] = {}
+        self._heap = []
+        self._heap_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def schedule(self, target_name: str, row_id: int, expires_at: Optional[datetime]) -> None:
+        """Signale une nouvelle échéance (réveille le sweeper si elle est plus proche)"""
+        if expires_at is None or target_name not in self.targets:
+            return
+        deadline = self.targets[target_name].to_epoch(expires_at)
+        with self._heap_lock:
+            is_earliest = not self._heap or deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (deadline, target_name, row_id))
+        if is_earliest:
+            self._wake.set()
+
+    def refill(self) -> int:
+        """Charge les prochaines échéances via l'index sur la colonne d'expiration"""
+        loaded = []
+        for target in self.targets.values():
+            rows = db.session.query(target.model.id, target.column).filter(
+                target.live_filter,
+                target.column.isnot(None),
+                target.column > target.now()
+            ).order_by(target.column).limit(self.heap_size).all()
+            loaded.extend((target.to_epoch(expires_at), target.name, row_id) for row_id, expires_at in rows)
+
+        with self._heap_lock:
+            self._heap = heapq.nsmallest(self.heap_size, set(self._heap).union(loaded))
+            heapq.heapify(self._heap)
+        return len(loaded)
+
+    def sweep_once(self) -> Dict[str, int]:
+        """Expire les lignes échues, par lots bornés ; renvoie le nombre de lignes touchées"""
+        report = {}
+        for target in self.targets.values():
+            touched = 0
+            for _ in range(self.max_batches_per_pass):
+                ids = [row_id for (row_id,) in db.session.query(target.model.id).filter(
+                    target.live_filter,
+                    target.column <= target.now()
+                ).order_by(target.column).limit(self.batch_size)]
+                if not ids:
+                    break
+
+                touched += target.model.query.filter(
+                    target.model.id.in_(ids),
+                    target.live_filter
+                ).update({target.live_column_name: not target.live_value}, synchronize_session=False)
+                db.session.commit()
+
+                if len(ids) < self.batch_size:
+                    break
+            report[target.name] = touched
+
+        self.last_report = report
+        if any(report.values()):
+            logger.info('Expiration: %s', ', '.join(f'{name}={count}' for name, count in report.items()))
+        return report
+
+    def _pop_due(self) -> int:
+        now = time.time()
+        due = 0
+        with self._heap_lock:
+            while self._heap and self._heap[0][0] <= now:
+                heapq.heappop(self._heap)
+                due += 1
+        return due
+
+    def _seconds_until_next(self) -> float:
+        with self._heap_lock:
+            if not self._heap:
+                return self.max_sleep_seconds
+            return min(self.max_sleep_seconds, max(0.0, self._heap[0][0] - time.time()))
+
+    def start(self, app):
+        """Démarre le sweeper en arrière-plan"""
+        if not self.is_running:
+            self.is_running = True
+            threading.Thread(target=self._sweep_loop, args=(app,), daemon=True).start()
+
+    def stop(self):
+        """Arrête le sweeper"""
+        self.is_running = False
+        self._wake.set()
+
+    def _sweep_loop(self, app):
+        with app.app_context():
+            first_pass = True
+            while self.is_running:
+                try:
+                    due = self._pop_due()
+                    if due or first_pass:
+                        self.sweep_once()
+                        first_pass = False
+                    # Rattrape les échéances créées sans passer par schedule()
+                    self.refill()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error('Erreur sweeper expiration: %s', e)
+                finally:
+                    db.session.remove()
+
+                self._wake.wait(self._seconds_until_next())
+                self._wake.clear()
+
+# Instance globale du sweeper
+expiry_sweeper = ExpirySweeper()
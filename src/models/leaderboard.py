@@ -0,0 +1,444 @@
+"""
+Classements de points (global, par pays, hebdomadaire) pour CFA
+Maintenus en mémoire, mis à jour après le commit de chaque gain de points
+et réconciliés périodiquement avec la base (gains des autres processus)
+"""
+
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from src.models.base import db, run_after_commit
+
+logger = logging.getLogger(__name__)
+
+SKIPLIST_MAX_LEVEL = 32
+SKIPLIST_PROBABILITY = 0.25
+REBUILD_YIELD_PER = 1000
+DEFAULT_SNAPSHOT_INTERVAL_SECONDS = 300
+DEFAULT_SNAPSHOT_MAX_AGE_SECONDS = 3600
+DEFAULT_RECONCILE_INTERVAL_SECONDS = 600
+
+class _SkipNode:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.forward = [None] * level
+        self.span = [0] * level
+
+class RankedSkipList:
+    """
+    Skip list indexable : chaque lien connaît le nombre de nœuds qu'il saute,
+    ce qui donne insertion, suppression, rang et accès par rang en O(log n)
+    """
+
+    def __init__(self):
+        self.head = _SkipNode(None, SKIPLIST_MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < SKIPLIST_MAX_LEVEL and random.random() < SKIPLIST_PROBABILITY:
+            level += 1
+        return level
+
+    def insert(self, key) -> None:
+        """Insère une clé (les clés doivent être uniques et ordonnables)"""
+        update = [None] * SKIPLIST_MAX_LEVEL
+        rank = [0] * SKIPLIST_MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.level)):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.length
+            self.level = level
+
+        new_node = _SkipNode(key, level)
+        for i in range(level):
+            new_node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new_node
+            new_node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+
+        self.length += 1
+
+    def remove(self, key) -> bool:
+        """Supprime une clé ; renvoie False si elle est absente"""
+        update = [None] * SKIPLIST_MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.forward[i] is not None and node.forward[i].key < key:
+                node = node.forward[i]
+            update[i] = node
+
+        node = node.forward[0]
+        if node is None or node.key != key:
+            return False
+
+        for i in range(self.level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """Rang (1 = premier) d'une clé présente"""
+        traversed = 0
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.forward[i] is not None and node.forward[i].key <= key:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if node.key == key:
+                return traversed
+        return None
+
+    def _node_at(self, rank: int) -> Optional[_SkipNode]:
+        if rank < 1 or rank > self.length:
+            return None
+        traversed = 0
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.forward[i] is not None and traversed + node.span[i] <= rank:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if traversed == rank:
+                return node
+        return None
+
+    def range(self, start_rank: int, count: int) -> List:
+        """Renvoie jusqu'à `count` clés à partir du rang `start_rank`"""
+        keys = []
+        node = self._node_at(max(1, start_rank))
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.forward[0]
+        return keys
+
+class Leaderboard:
+    """Classement d'utilisateurs par score décroissant"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.scores: Dict[int, int] = {}
+        self._index = RankedSkipList()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.scores)
+
+    @staticmethod
+    def _key(user_id: int, score: int) -> Tuple[int, int]:
+        # Score décroissant, puis user_id croissant pour départager les ex aequo
+        return (-score, user_id)
+
+    def set_score(self, user_id: int, score: int) -> None:
+        """Fixe le score d'un utilisateur"""
+        with self._lock:
+            previous = self.scores.get(user_id)
+            if previous == score:
+                return
+            if previous is not None:
+                self._index.remove(self._key(user_id, previous))
+            self.scores[user_id] = score
+            self._index.insert(self._key(user_id, score))
+
+    def add_score(self, user_id: int, delta: int) -> None:
+        """Ajoute des points au score d'un utilisateur"""
+        with self._lock:
+            previous = self.scores.get(user_id)
+            if previous is not None:
+                self._index.remove(self._key(user_id, previous))
+            score = (previous or 0) + delta
+            self.scores[user_id] = score
+            self._index.insert(self._key(user_id, score))
+
+    def _entries(self, start_rank: int, count: int) -> List[Dict]:
+        return [
+            {'rank': start_rank + offset, 'user_id': user_id, 'points': -negative_score}
+            for offset, (negative_score, user_id) in enumerate(self._index.range(start_rank, count))
+        ]
+
+    def top(self, limit: int = 10) -> List[Dict]:
+        """Les `limit` premiers du classement"""
+        with self._lock:
+            return self._entries(1, limit)
+
+    def rank_of(self, user_id: int) -> Optional[Dict]:
+        """Rang et score d'un utilisateur"""
+        with self._lock:
+            score = self.scores.get(user_id)
+            if score is None:
+                return None
+            return {
+                'rank': self._index.rank(self._key(user_id, score)),
+                'user_id': user_id,
+                'points': score,
+                'total_ranked': len(self.scores)
+            }
+
+    def neighbors(self, user_id: int, radius: int = 2) -> List[Dict]:
+        """Les utilisateurs classés juste avant et juste après"""
+        with self._lock:
+            score = self.scores.get(user_id)
+            if score is None:
+                return []
+            rank = self._index.rank(self._key(user_id, score))
+            start_rank = max(1, rank - radius)
+            return self._entries(start_rank, rank + radius - start_rank + 1)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.scores = {}
+            self._index = RankedSkipList()
+
+class LeaderboardService:
+    """Regroupe les classements et les tient à jour"""
+
+    def __init__(self):
+        self.global_board = Leaderboard('global')
+        self.country_boards: Dict[str, Leaderboard] = {}
+        self.weekly_board = Leaderboard('weekly')
+        self.week_key = self._current_week_key()
+        self.user_countries: Dict[int, Optional[str]] = {}
+        self.is_snapshotting = False
+        self.is_reconciling = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_week_key(now: datetime = None) -> str:
+        iso = (now or datetime.now()).isocalendar()
+        return f"{iso[0]}-W{iso[1]:02d}"
+
+    @staticmethod
+    def _week_start(now: datetime = None) -> datetime:
+        now = now or datetime.now()
+        monday = now - timedelta(days=now.weekday())
+        return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def _country_board(self, country: str) -> Leaderboard:
+        with self._lock:
+            board = self.country_boards.get(country)
+            if board is None:
+                board = self.country_boards[country] = Leaderboard(f'country:{country}')
+            return board
+
+    def _roll_week(self) -> None:
+        week_key = self._current_week_key()
+        if week_key != self.week_key:
+            self.weekly_board.clear()
+            self.week_key = week_key
+
+    def _country_for(self, user_id: int) -> Optional[str]:
+        if user_id not in self.user_countries:
+            from src.models.user import User
+            row = db.session.query(User.country).filter(User.id == user_id).first()
+            self.user_countries[user_id] = row[0] if row else None
+        return self.user_countries[user_id]
+
+    def record_points(self, user_id: int, total_points: int, points_delta: int) -> None:
+        """
+        Reporte un gain de points sur tous les classements concernés, au commit
+        de la transaction en cours (rien n'est appliqué si elle est annulée)
+        """
+        # Le pays est lu maintenant : aucun SQL n'est possible dans le callback de commit
+        country = self._country_for(user_id)
+        run_after_commit(db.session(), lambda: self._apply_points(user_id, total_points, points_delta, country))
+
+    def _apply_points(self, user_id: int, total_points: int, points_delta: int,
+                      country: Optional[str]) -> None:
+        self._roll_week()
+        self.global_board.set_score(user_id, total_points)
+        if country:
+            self._country_board(country).set_score(user_id, total_points)
+        if points_delta:
+            self.weekly_board.add_score(user_id, points_delta)
+
+    def get_board(self, scope: str = 'global', country: str = None) -> Optional[Leaderboard]:
+        """Retourne le classement demandé (global, country ou weekly)"""
+        if scope == 'weekly':
+            self._roll_week()
+            return self.weekly_board
+        if scope == 'country':
+            return self.country_boards.get(country)
+        return self.global_board
+
+    def rebuild(self) -> int:
+        """Reconstruit tous les classements depuis la base en un seul passage"""
+        from src.models.rewards import RewardType, UserReward, UserStats
+        from src.models.user import User
+
+        global_board = Leaderboard('global')
+        country_boards: Dict[str, Leaderboard] = {}
+        weekly_board = Leaderboard('weekly')
+        user_countries: Dict[int, Optional[str]] = {}
+
+        rows = db.session.query(UserStats.user_id, UserStats.total_points, User.country)\
+                         .outerjoin(User, User.id == UserStats.user_id)\
+                         .execution_options(yield_per=REBUILD_YIELD_PER)
+        count = 0
+        for user_id, total_points, country in rows:
+            total_points = total_points or 0
+            global_board.set_score(user_id, total_points)
+            user_countries[user_id] = country
+            if country:
+                if country not in country_boards:
+                    country_boards[country] = Leaderboard(f'country:{country}')
+                country_boards[country].set_score(user_id, total_points)
+            count += 1
+
+        week_key = self._current_week_key()
+        weekly_rows = db.session.query(UserReward.user_id, db.func.sum(UserReward.points_earned))\
+                                .filter(UserReward.reward_type == RewardType.POINTS,
+                                        UserReward.created_at >= self._week_start())\
+                                .group_by(UserReward.user_id)\
+                                .execution_options(yield_per=REBUILD_YIELD_PER)
+        for user_id, points in weekly_rows:
+            weekly_board.set_score(user_id, int(points or 0))
+
+        with self._lock:
+            self.global_board = global_board
+            self.country_boards = country_boards
+            self.weekly_board = weekly_board
+            self.week_key = week_key
+            self.user_countries = user_countries
+
+        logger.info('Classements reconstruits pour %s utilisateurs', count)
+        return count
+
+    def save_snapshot(self, path: str) -> None:
+        """Écrit un instantané JSON des classements (écriture atomique)"""
+        snapshot = {
+            'taken_at': time.time(),
+            'week_key': self.week_key,
+            'global': self.global_board.scores.copy(),
+            'countries': {country: board.scores.copy() for country, board in self.country_boards.items()},
+            'weekly': self.weekly_board.scores.copy(),
+        }
+        # Fichier temporaire propre à cet écrivain, dans le même dossier pour que os.replace
+        # reste atomique : plusieurs workers peuvent écrire l'instantané en même temps
+        directory, filename = os.path.split(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, prefix=f'.{filename}.',
+                                         suffix='.tmp', delete=False) as handle:
+            tmp_path = handle.name
+            try:
+                json.dump(snapshot, handle)
+            except BaseException:
+                handle.close()
+                os.unlink(tmp_path)
+                raise
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path: str, max_age_seconds: int = DEFAULT_SNAPSHOT_MAX_AGE_SECONDS) -> bool:
+        """Recharge un instantané s'il existe et n'est pas trop ancien"""
+        try:
+            with open(path, encoding='utf-8') as handle:
+                snapshot = json.load(handle)
+        except (OSError, ValueError):
+            return False
+
+        if time.time() - snapshot.get('taken_at', 0) > max_age_seconds:
+            return False
+
+        global_board = Leaderboard('global')
+        for user_id, score in snapshot['global'].items():
+            global_board.set_score(int(user_id), score)
+
+        country_boards = {}
+        user_countries = {}
+        for country, scores in snapshot['countries'].items():
+            board = country_boards[country] = Leaderboard(f'country:{country}')
+            for user_id, score in scores.items():
+                board.set_score(int(user_id), score)
+                user_countries[int(user_id)] = country
+
+        weekly_board = Leaderboard('weekly')
+        if snapshot.get('week_key') == self._current_week_key():
+            for user_id, score in snapshot['weekly'].items():
+                weekly_board.set_score(int(user_id), score)
+
+        with self._lock:
+            self.global_board = global_board
+            self.country_boards = country_boards
+            self.weekly_board = weekly_board
+            self.week_key = self._current_week_key()
+            self.user_countries = user_countries
+        return True
+
+    def warm_up(self, snapshot_path: str = None,
+                max_age_seconds: int = DEFAULT_SNAPSHOT_MAX_AGE_SECONDS) -> None:
+        """Au démarrage : instantané récent si disponible, sinon reconstruction"""
+        if snapshot_path and self.load_snapshot(snapshot_path, max_age_seconds):
+            return
+        self.rebuild()
+
+    def start_snapshots(self, path: str, interval_seconds: int = DEFAULT_SNAPSHOT_INTERVAL_SECONDS):
+        """Démarre l'écriture périodique des instantanés"""
+        if not self.is_snapshotting:
+            self.is_snapshotting = True
+            threading.Thread(target=self._snapshot_loop, args=(path, interval_seconds), daemon=True).start()
+
+    def stop_snapshots(self):
+        """Arrête l'écriture périodique des instantanés"""
+        self.is_snapshotting = False
+
+    def _snapshot_loop(self, path: str, interval_seconds: int):
+        while self.is_snapshotting:
+            time.sleep(interval_seconds)
+            try:
+                self.save_snapshot(path)
+            except Exception as e:
+                logger.error('Erreur instantané classements: %s', e)
+
+    def start_reconcile(self, app, interval_seconds: int = DEFAULT_RECONCILE_INTERVAL_SECONDS):
+        """Démarre la reconstruction périodique (gains commités par les autres processus)"""
+        if not self.is_reconciling:
+            self.is_reconciling = True
+            threading.Thread(target=self._reconcile_loop, args=(app, interval_seconds), daemon=True).start()
+
+    def stop_reconcile(self):
+        """Arrête la reconstruction périodique"""
+        self.is_reconciling = False
+
+    def _reconcile_loop(self, app, interval_seconds: int):
+        with app.app_context():
+            while self.is_reconciling:
+                time.sleep(interval_seconds)
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    logger.error('Erreur réconciliation classements: %s', e)
+                finally:
+                    db.session.remove()
+
+# Instance globale des classements
+leaderboard_service = LeaderboardService()
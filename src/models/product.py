@@ -103,6 +103,25 @@ class Product(BaseModel):
         """Nombre d'avis"""
         return len(self.reviews)
     
+    @classmethod
+    def load_with_ratings(cls, product_ids):
+        """
+        Charge des produits avec leurs agrégats d'avis en une requête.
+        Renvoie {id: (produit, (note moyenne, nombre d'avis))}
+        """
+        from src.models.review import Review
+
+        if not product_ids:
+            return {}
+        rows = db.session.query(
+            cls,
+            db.func.coalesce(db.func.avg(Review.rating), 0),
+            db.func.count(Review.id)
+        ).outerjoin(Review, Review.product_id == cls.id)\
+         .filter(cls.id.in_(set(product_ids)))\
+         .group_by(cls.id).all()
+        return {product.id: (product, (float(average), count)) for product, average, count in rows}
+    
     def calculate_margin(self):
         """Calcule la marge bénéficiaire"""
         if self.cost_price:
@@ -168,8 +187,9 @@ class Product(BaseModel):
         )
         db.session.add(log)
     
-    def to_dict(self, include_seller=False):
-        """Convertit le produit en dictionnaire"""
+    def to_dict(self, include_seller=False, rating=None):
+        """Convertit le produit en dictionnaire (rating : (moyenne, nombre) préchargés, voir load_with_ratings)"""
+        average_rating, review_count = rating if rating is not None else (self.average_rating, self.review_count)
         data = {
             'id': self.id,
             'name': self.name,
@@ -201,8 +221,8 @@ class Product(BaseModel):
             'nutritional_info': self.nutritional_info,
             'storage_instructions': self.storage_instructions,
             'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None,
-            'average_rating': self.average_rating,
-            'review_count': self.review_count,
+            'average_rating': average_rating,
+            'review_count': review_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -0,0 +1,254 @@
+"""
+Reconstruction des UserStats à partir du registre user_rewards pour CFA
+Agrégats SQL par tranches d'utilisateurs, exécutées en parallèle
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.base import db
+from src.models.rewards import (
+    ActionType, GamificationEngine, RewardType, UserReward, UserStats, gamification_engine
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_COUNT = 8
+DEFAULT_WORKER_COUNT = 4
+DEFAULT_CHUNK_SIZE = 500
+MAX_CHUNK_ATTEMPTS = 5
+
+# Compteur UserStats -> action dont il compte les récompenses en points
+ACTION_COUNTERS = {
+    'total_purchases': ActionType.PURCHASE,
+    'total_reviews': ActionType.REVIEW,
+    'total_referrals': ActionType.REFERRAL,
+    'recipes_shared': ActionType.RECIPE_SHARE,
+    'local_products_bought': ActionType.LOCAL_SUPPORT,
+    'eco_products_bought': ActionType.ECO_CHOICE,
+}
+
+class ChunkConflict(Exception):
+    """Des UserStats du lot ont changé entre l'agrégat et l'écriture"""
+
+class UserStatsBackfill:
+    """Recalcule les UserStats depuis l'historique des récompenses"""
+
+    def __init__(self, app, engine: GamificationEngine = None,
+                 shard_count: int = DEFAULT_SHARD_COUNT,
+                 worker_count: int = DEFAULT_WORKER_COUNT,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 keep_existing_badges: bool = True,
+                 progress_callback: Callable[[Dict], None] = None):
+        self.app = app
+        self.engine = engine or gamification_engine
+        self.shard_count = max(1, shard_count)
+        self.worker_count = max(1, worker_count)
+        self.chunk_size = max(1, chunk_size)
+        self.keep_existing_badges = keep_existing_badges
+        self.progress_callback = progress_callback
+        self.progress = {'users_updated': 0, 'users_created': 0, 'chunks_done': 0, 'chunks_total': 0}
+        self._progress_lock = threading.Lock()
+
+    def run(self) -> Dict:
+        """Lance la reconstruction sur toutes les tranches et renvoie le bilan"""
+        started = time.time()
+        with self.app.app_context():
+            bounds = db.session.query(db.func.min(UserReward.user_id),
+                                      db.func.max(UserReward.user_id)).first()
+        if not bounds or bounds[0] is None:
+            return dict(self.progress, elapsed_seconds=0.0)
+
+        shards = self._split_range(bounds[0], bounds[1], self.shard_count)
+        self.progress['chunks_total'] = sum(
+            len(self._split_range(low, high, None, self.chunk_size)) for low, high in shards
+        )
+
+        with ThreadPoolExecutor(max_workers=self.worker_count) as executor:
+            futures = [executor.submit(self._run_shard, low, high) for low, high in shards]
+            for future in as_completed(futures):
+                future.result()
+
+        return dict(self.progress, elapsed_seconds=round(time.time() - started, 2))
+
+    @staticmethod
+    def _split_range(low: int, high: int, parts: Optional[int],
+                     width: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Découpe [low, high] en `parts` tranches ou en tranches de `width` ids"""
+        if width is None:
+            width = max(1, -(-(high - low + 1) // parts))
+        return [(start, min(start + width - 1, high)) for start in range(low, high + 1, width)]
+
+    def _run_shard(self, low: int, high: int) -> None:
+        """Traite une tranche par petits lots, un commit par lot"""
+        with self.app.app_context():
+            try:
+                for chunk_low, chunk_high in self._split_range(low, high, None, self.chunk_size):
+                    updated, created = self._backfill_chunk(chunk_low, chunk_high)
+                    self._report(updated, created)
+            finally:
+                db.session.remove()
+
+    def _report(self, updated: int, created: int) -> None:
+        with self._progress_lock:
+            self.progress['users_updated'] += updated
+            self.progress['users_created'] += created
+            self.progress['chunks_done'] += 1
+            snapshot = dict(self.progress)
+        logger.info('Backfill UserStats: %s/%s lots', snapshot['chunks_done'], snapshot['chunks_total'])
+        if self.progress_callback:
+            self.progress_callback(snapshot)
+
+    def _aggregate_query(self, low: int, high: int):
+        """Un GROUP BY par lot : totaux de points, dépenses et compteurs d'actions"""
+        is_points = UserReward.reward_type == RewardType.POINTS
+        # Les échanges antérieurs à points_spent sont déduits de la valeur obtenue
+        spent = db.case(
+            (UserReward.points_spent > 0, UserReward.points_spent),
+            (UserReward.reward_type == RewardType.DISCOUNT, UserReward.discount_percentage * 100),
+            (UserReward.reward_type == RewardType.CASHBACK, UserReward.cashback_amount * 1000),
+            else_=0
+        )
+
+        columns = [
+            UserReward.user_id,
+            db.func.sum(db.case((is_points, UserReward.points_earned), else_=0)).label('total_points'),
+            db.func.sum(spent).label('points_spent'),
+            db.func.max(db.case((db.and_(is_points, UserReward.action_type == ActionType.PURCHASE),
+                                 UserReward.created_at))).label('last_purchase'),
+            db.func.max(db.case((db.and_(is_points, UserReward.action_type == ActionType.DAILY_LOGIN),
+                                 UserReward.created_at))).label('last_login'),
+        ]
+        for counter, action in ACTION_COUNTERS.items():
+            columns.append(db.func.sum(
+                db.case((db.and_(is_points, UserReward.action_type == action), 1), else_=0)
+            ).label(counter))
+
+        return db.session.query(*columns)\
+                         .filter(UserReward.user_id.between(low, high))\
+                         .group_by(UserReward.user_id)
+
+    def _backfill_chunk(self, low: int, high: int) -> Tuple[int, int]:
+        """Recalcule et écrit un lot d'utilisateurs ; recommence si l'application l'a modifié entre-temps"""
+        for attempt in range(1, MAX_CHUNK_ATTEMPTS + 1):
+            try:
+                return self._write_chunk(low, high)
+            except (ChunkConflict, IntegrityError):
+                db.session.rollback()
+                if attempt == MAX_CHUNK_ATTEMPTS:
+                    raise
+                logger.info('Backfill UserStats: lot %s-%s modifié pendant le calcul, nouvel essai', low, high)
+
+    def _write_chunk(self, low: int, high: int) -> Tuple[int, int]:
+        """Une tentative sur un lot ; renvoie (mis à jour, créés)"""
+        # Versions lues avant l'agrégat : tout gain commité ensuite incrémente stats_version
+        # et fait échouer l'UPDATE conditionnel (un nouvel utilisateur, l'INSERT unique)
+        existing = {
+            row.user_id: row
+            for row in db.session.query(UserStats.id, UserStats.user_id, UserStats.stats_version,
+                                        UserStats.login_streak, UserStats.badges_earned)
+                                 .filter(UserStats.user_id.between(low, high))
+        }
+        aggregates = {row.user_id: row for row in self._aggregate_query(low, high)}
+        if not aggregates:
+            db.session.commit()
+            return 0, 0
+
+        updates, inserts = [], []
+        for user_id, row in aggregates.items():
+            current = existing.get(user_id)
+            values = self._compute_stats(row, current)
+            if current is not None:
+                values['b_id'] = current.id
+                values['b_read_version'] = current.stats_version
+                values['stats_version'] = (current.stats_version or 0) + 1
+                updates.append(values)
+            else:
+                values['user_id'] = user_id
+                values['stats_version'] = 1
+                inserts.append(values)
+
+        if updates:
+            self._update_if_unchanged(updates)
+        if inserts:
+            db.session.execute(insert(UserStats), inserts)
+        db.session.commit()
+        return len(updates), len(inserts)
+
+    @staticmethod
+    def _update_if_unchanged(updates: List[Dict]) -> None:
+        """UPDATE ... WHERE stats_version = version lue ; ChunkConflict si une ligne a bougé"""
+        table = UserStats.__table__
+        statement = update(table).where(
+            table.c.id == bindparam('b_id'),
+            table.c.stats_version == bindparam('b_read_version')
+        )
+        connection = db.session.connection()
+        if connection.dialect.supports_sane_multi_rowcount:
+            matched = connection.execute(statement, updates).rowcount
+        else:
+            matched = sum(connection.execute(statement, values).rowcount for values in updates)
+        if matched != len(updates):
+            raise ChunkConflict(f'{len(updates) - matched} UserStats modifiés pendant le calcul')
+
+    def _compute_stats(self, row, current) -> Dict:
+        """Applique les règles du moteur (niveau, badges) aux totaux agrégés"""
+        total_points = int(row.total_points or 0)
+        values = {
+            'total_points': total_points,
+            'experience_points': total_points,
+            'available_points': max(0, total_points - int(row.points_spent or 0)),
+            'current_level': self.engine._level_for_xp(total_points),
+            'last_purchase': row.last_purchase,
+            'last_login': row.last_login,
+        }
+        for counter in ACTION_COUNTERS:
+            values[counter] = int(getattr(row, counter) or 0)
+
+        # Les séries ne se déduisent pas du registre : on garde la valeur courante
+        login_streak = current.login_streak if current is not None else 0
+        badges = self.engine._qualifying_badges(SimpleNamespace(login_streak=login_streak or 0, **values))
+        if self.keep_existing_badges and current is not None:
+            badges = list(current.badges_earned or []) + [
+                badge for badge in badges if badge not in (current.badges_earned or [])
+            ]
+        values['badges_earned'] = badges
+        return values
+
+rewards_cli = AppGroup('rewards', help='Outils de maintenance de la gamification.')
+
+@rewards_cli.command('backfill-stats')
+@click.option('--shards', default=DEFAULT_SHARD_COUNT, show_default=True, help="Tranches d'user_id.")
+@click.option('--workers', default=DEFAULT_WORKER_COUNT, show_default=True, help='Tranches traitées en parallèle.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Utilisateurs par transaction.')
+@click.option('--reset-badges', is_flag=True, help='Ne garder que les badges dérivés des règles actuelles.')
+def backfill_stats_command(shards, workers, chunk_size, reset_badges):
+    """Reconstruit user_stats depuis user_rewards."""
+    from flask import current_app
+    from src.models.leaderboard import leaderboard_service
+
+    def echo_progress(progress):
+        click.echo(f"[{progress['chunks_done']}/{progress['chunks_total']}] "
+                   f"{progress['users_updated']} mis à jour, {progress['users_created']} créés")
+
+    backfill = UserStatsBackfill(
+        current_app._get_current_object(),
+        shard_count=shards,
+        worker_count=workers,
+        chunk_size=chunk_size,
+        keep_existing_badges=not reset_badges,
+        progress_callback=echo_progress
+    )
+    result = backfill.run()
+    leaderboard_service.rebuild()
+    click.echo(f"Terminé en {result['elapsed_seconds']}s : "
+               f"{result['users_updated']} mis à jour, {result['users_created']} créés")
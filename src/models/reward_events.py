@@ -0,0 +1,195 @@
+"""
+File d'événements de gamification traitée en arrière-plan pour CFA
+Sort l'attribution des récompenses du chemin critique des requêtes
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import JSON, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.base import BaseModel, db
+from src.models.rewards import ActionType, GamificationEngine, UserReward, gamification_engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKER_COUNT = 4
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+MAX_EVENT_ATTEMPTS = 5
+
+class GamificationEvent(BaseModel):
+    """Journal append-only des actions utilisateur à récompenser"""
+    __tablename__ = 'gamification_events'
+
+    # Clé fournie par l'appelant (ex: "order:42:purchase") pour rendre les retries sûrs
+    idempotency_key = db.Column(db.String(128), unique=True, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    action_type = db.Column(db.Enum(ActionType), nullable=False)
+    context = db.Column(JSON)
+
+    # Suivi du traitement
+    processed_at = db.Column(db.DateTime, index=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+
+    @staticmethod
+    def enqueue(user_id: int, action: ActionType, context: Dict = None,
+                idempotency_key: Optional[str] = None) -> 'GamificationEvent':
+        """Ajoute une action à la file ; un doublon de clé renvoie l'événement existant"""
+        event = GamificationEvent(
+            idempotency_key=idempotency_key or uuid.uuid4().hex,
+            user_id=user_id,
+            action_type=action,
+            context=context or {}
+        )
+        db.session.add(event)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return GamificationEvent.query.filter_by(idempotency_key=event.idempotency_key).first()
+        return event
+
+    def __repr__(self):
+        return f'<GamificationEvent {self.idempotency_key} {self.action_type.value}>'
+
+class GamificationWorkerPool:
+    """Pool de workers qui vident la file d'événements par lots"""
+
+    def __init__(self, app, engine: GamificationEngine = None,
+                 worker_count: int = DEFAULT_WORKER_COUNT,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL_SECONDS):
+        self.app = app
+        self.engine = engine or gamification_engine
+        self.worker_count = max(1, worker_count)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.is_processing = False
+        self._threads = []
+
+    def start(self):
+        """Démarre les workers"""
+        if self.is_processing:
+            return
+        self.is_processing = True
+        self._threads = [
+            threading.Thread(target=self._worker_loop, args=(shard,), daemon=True)
+            for shard in range(self.worker_count)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = None):
+        """Arrête les workers après leur lot en cours"""
+        self.is_processing = False
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker_loop(self, shard: int):
+        """Boucle d'un worker : un shard d'utilisateurs par worker"""
+        with self.app.app_context():
+            while self.is_processing:
+                try:
+                    processed = self.drain_once(shard)
+                except Exception as e:
+                    logger.exception('Erreur worker gamification (shard %s): %s', shard, e)
+                    processed = 0
+                finally:
+                    db.session.remove()
+
+                if processed < self.batch_size:
+                    time.sleep(self.poll_interval)
+
+    def drain_once(self, shard: int = 0) -> int:
+        """
+        Traite un lot d'événements en attente du shard donné.
+        Chaque utilisateur appartient à un seul shard, ce qui évite que deux
+        workers d'un même processus ne mettent à jour les mêmes UserStats en parallèle ;
+        entre processus, chaque événement est réclamé avant d'être appliqué.
+        """
+        # SKIP LOCKED (PostgreSQL) : les lignes déjà prises par un autre processus sont sautées
+        event_ids = [event_id for (event_id,) in db.session.query(GamificationEvent.id).filter(
+            GamificationEvent.processed_at.is_(None),
+            GamificationEvent.attempts < MAX_EVENT_ATTEMPTS,
+            GamificationEvent.user_id % self.worker_count == shard
+        ).order_by(GamificationEvent.id).limit(self.batch_size).with_for_update(skip_locked=True)]
+
+        if not event_ids:
+            return 0
+
+        try:
+            self._claim_and_process(event_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(event_ids) == 1:
+                self._record_failure(event_ids[0], e)
+                return 1
+            # Un seul événement fautif ne doit pas compter un échec à tout le lot
+            logger.warning('Lot gamification en échec (%s), reprise événement par événement', e)
+            for event_id in event_ids:
+                try:
+                    self._claim_and_process([event_id])
+                    db.session.commit()
+                except Exception as event_error:
+                    db.session.rollback()
+                    self._record_failure(event_id, event_error)
+
+        return len(event_ids)
+
+    def _claim_and_process(self, event_ids: List[int]) -> Dict[int, List[UserReward]]:
+        """
+        Réclame les événements par un UPDATE conditionnel puis applique ceux obtenus, sans commit.
+        Réclamation, récompenses et marquage partagent la même transaction : un événement
+        déjà réclamé par un autre processus est ignoré, un rollback le rend à la file.
+        """
+        processed_at = datetime.now()
+        claimed_ids = [
+            event_id for event_id in event_ids
+            if db.session.execute(
+                update(GamificationEvent)
+                .where(GamificationEvent.id == event_id, GamificationEvent.processed_at.is_(None))
+                .values(processed_at=processed_at)
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+        ]
+        if not claimed_ids:
+            return {}
+        events = GamificationEvent.query.filter(GamificationEvent.id.in_(claimed_ids))\
+                                        .order_by(GamificationEvent.id).all()
+        return self.process_events(events)
+
+    @staticmethod
+    def _record_failure(event_id: int, error: Exception) -> None:
+        GamificationEvent.query.filter(GamificationEvent.id == event_id).update({
+            GamificationEvent.attempts: GamificationEvent.attempts + 1,
+            GamificationEvent.last_error: str(error)[:1000]
+        }, synchronize_session=False)
+        db.session.commit()
+        logger.warning('Événement gamification %s en échec: %s', event_id, error)
+
+    def process_events(self, events: List[GamificationEvent]) -> Dict[int, List[UserReward]]:
+        """
+        Regroupe des événements déjà réclamés par utilisateur et les applique sans commit.
+        """
+        events_by_user = defaultdict(list)
+        for event in events:
+            events_by_user[event.user_id].append(event)
+
+        rewards_by_user = {}
+        for user_id, user_events in events_by_user.items():
+            rewards_by_user[user_id] = self.engine.process_user_actions(
+                user_id,
+                [(event.action_type, event.context) for event in user_events]
+            )
+
+        return rewards_by_user
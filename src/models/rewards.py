@@ -5,6 +5,8 @@ Encourage l'engagement utilisateur et le soutien aux producteurs locaux
 
 import json
 import math
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
@@ -12,6 +14,8 @@ from enum import Enum
 from src.models.base import BaseModel, db
 from sqlalchemy import JSON
 
+DASHBOARD_CACHE_MAX_ENTRIES = 10000
+
 class RewardType(Enum):
     POINTS = "points"
     BADGE = "badge"
@@ -31,6 +35,8 @@ class ActionType(Enum):
     SOCIAL_SHARE = "social_share"
     QUIZ_COMPLETE = "quiz_complete"
     STREAK_MAINTAIN = "streak_maintain"
+    EXPERIENCE = "experience"
+    ACHIEVEMENT = "achievement"
 
 @dataclass
 class RewardRule:
@@ -56,13 +62,21 @@ class UserReward(BaseModel):
     discount_percentage = db.Column(db.Float)
     cashback_amount = db.Column(db.Numeric(10, 2))
     experience_points = db.Column(db.Integer, default=0)
+    points_spent = db.Column(db.Integer, default=0)  # Points débités lors d'un échange
     
     # Métadonnées
     description = db.Column(db.Text)
-    metadata = db.Column(JSON)
+    # "metadata" est réservé par SQLAlchemy : l'attribut est renommé, pas la colonne
+    meta_data = db.Column('metadata', JSON)
     expires_at = db.Column(db.DateTime)
+    is_expired = db.Column(db.Boolean, default=False, nullable=False)
     is_claimed = db.Column(db.Boolean, default=False)
     claimed_at = db.Column(db.DateTime)
+    
+    # Sert le sweeper d'expiration (prochaines échéances non expirées)
+    __table_args__ = (
+        db.Index('ix_user_rewards_expiry', 'is_expired', 'expires_at'),
+    )
 
 class UserStats(BaseModel):
     """Statistiques utilisateur pour gamification"""
@@ -96,6 +110,56 @@ class UserStats(BaseModel):
     # Récompenses disponibles
     available_points = db.Column(db.Integer, default=0)
     pending_cashback = db.Column(db.Numeric(10, 2), default=0)
+    
+    # Incrémenté à chaque changement visible dans le tableau de bord
+    stats_version = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Chaque UPDATE ORM porte WHERE stats_version = version lue et l'incrémente :
+    # deux processus ne publient jamais deux contenus sous la même version
+    # (StaleDataError pour le perdant, qui recommence sur des stats à jour)
+    __mapper_args__ = {'version_id_col': stats_version}
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Les défauts de colonnes ne s'appliquent qu'à l'INSERT : on les pose
+        # dès la création pour pouvoir incrémenter les compteurs avant le flush
+        for column in self.__table__.columns:
+            if getattr(self, column.key) is None and column.default is not None:
+                default = column.default
+                setattr(self, column.key, default.arg(None) if default.is_callable else default.arg)
+
+class DashboardCache:
+    """Cache LRU borné des tableaux de bord sérialisés, indexé par version des stats"""
+    
+    def __init__(self, max_entries: int = DASHBOARD_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, user_id: int, version: int) -> Optional[str]:
+        """Retourne le JSON en cache s'il correspond à la version courante"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+    
+    def set(self, user_id: int, version: int, payload: str) -> None:
+        """Stocke le JSON d'un tableau de bord pour une version donnée"""
+        with self._lock:
+            self._entries[user_id] = (version, payload)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
 
 class GamificationEngine:
     """Moteur de gamification intelligent"""
@@ -105,6 +169,7 @@ class GamificationEngine:
         self.level_thresholds = self._initialize_level_system()
         self.badges = self._initialize_badges()
         self.achievements = self._initialize_achievements()
+        self.dashboard_cache = DashboardCache()
     
     def _initialize_reward_rules(self) -> Dict[ActionType, RewardRule]:
         """Initialise les règles de récompenses"""
@@ -292,51 +357,86 @@ class GamificationEngine:
         }
     
     def process_user_action(self, user_id: int, action: ActionType, 
-                          context: Dict = None) -> List[UserReward]:
-        """Traite une action utilisateur et attribue les récompenses"""
+                          context: Dict = None, idempotency_key: Optional[str] = None):
+        """
+        Enregistre une action utilisateur dans la file d'événements et rend la main :
+        les récompenses sont attribuées par lots par GamificationWorkerPool (voir reward_events)
+        """
+        from src.models.reward_events import GamificationEvent
+        return GamificationEvent.enqueue(user_id, action, context, idempotency_key)
+    
+    def process_user_actions(self, user_id: int, 
+                             actions: List[Tuple[ActionType, Optional[Dict]]]) -> List[UserReward]:
+        """
+        Traite un lot d'actions d'un même utilisateur sans commit :
+        une seule mise à jour de UserStats et un seul INSERT groupé des récompenses
+        """
         rewards = []
-        
-        # Vérifier si l'action est éligible
-        if not self._is_action_eligible(user_id, action, context):
-            return rewards
-        
-        # Obtenir la règle de récompense
-        rule = self.reward_rules.get(action)
-        if not rule:
-            return rewards
-        
-        # Calculer les points
-        points = self._calculate_points(user_id, rule, context)
-        
-        if points > 0:
-            # Créer la récompense
-            reward = UserReward(
-                user_id=user_id,
-                reward_type=RewardType.POINTS,
-                action_type=action,
-                points_earned=points,
-                description=f"Points gagnés pour {action.value}",
-                metadata=context or {}
-            )
-            
-            db.session.add(reward)
-            rewards.append(reward)
-            
-            # Mettre à jour les stats utilisateur
-            self._update_user_stats(user_id, action, points, context)
-            
-            # Vérifier les badges et achievements
-            new_badges = self._check_badges(user_id, action, context)
-            new_achievements = self._check_achievements(user_id, action, context)
-            
-            rewards.extend(new_badges)
-            rewards.extend(new_achievements)
-        
-        db.session.commit()
+        user_stats = UserStats.query.filter_by(user_id=user_id).first()
+        ledger = self._load_action_ledger(user_id, {action for action, _ in actions})
+        
+        with db.session.no_autoflush:
+            for action, context in actions:
+                # Vérifier si l'action est éligible
+                if not self._is_action_eligible(user_id, action, context, ledger=ledger):
+                    continue
+                
+                # Obtenir la règle de récompense
+                rule = self.reward_rules.get(action)
+                if not rule:
+                    continue
+                
+                # Calculer les points
+                points = self._calculate_points(user_id, rule, context, user_stats=user_stats)
+                if points <= 0:
+                    continue
+                
+                # Créer la récompense
+                rewards.append(UserReward(
+                    user_id=user_id,
+                    reward_type=RewardType.POINTS,
+                    action_type=action,
+                    points_earned=points,
+                    description=f"Points gagnés pour {action.value}",
+                    meta_data=context or {},
+                    created_at=datetime.now()
+                ))
+                ledger[action]['last_at'] = datetime.now()
+                ledger[action]['today_count'] += 1
+                
+                # Mettre à jour les stats utilisateur
+                user_stats = self._update_user_stats(user_id, action, points, context,
+                                                     user_stats=user_stats)
+                
+                # Vérifier les badges et achievements
+                rewards.extend(self._check_badges(user_id, action, context, user_stats=user_stats))
+                rewards.extend(self._check_achievements(user_id, action, context))
+        
+        db.session.add_all(rewards)
         return rewards
     
+    def _load_action_ledger(self, user_id: int, actions) -> Dict[ActionType, Dict]:
+        """Charge en une requête la dernière récompense et le compte du jour par action"""
+        ledger = {action: {'last_at': None, 'today_count': 0} for action in actions}
+        if not ledger:
+            return ledger
+        
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = db.session.query(
+            UserReward.action_type,
+            db.func.max(UserReward.created_at),
+            db.func.sum(db.case((UserReward.created_at >= today_start, 1), else_=0))
+        ).filter(
+            UserReward.user_id == user_id,
+            UserReward.action_type.in_(list(ledger))
+        ).group_by(UserReward.action_type).all()
+        
+        for action, last_at, today_count in rows:
+            ledger[action] = {'last_at': last_at, 'today_count': int(today_count or 0)}
+        return ledger
+    
     def _is_action_eligible(self, user_id: int, action: ActionType, 
-                          context: Dict = None) -> bool:
+                          context: Dict = None, ledger: Dict = None) -> bool:
         """Vérifie si l'action est éligible pour des récompenses"""
         rule = self.reward_rules.get(action)
         if not rule:
@@ -348,49 +448,40 @@ class GamificationEngine:
                 if context.get(condition) != required_value:
                     return False
         
+        if ledger is None:
+            ledger = self._load_action_ledger(user_id, {action})
+        history = ledger.get(action, {'last_at': None, 'today_count': 0})
+        
         # Vérifier le cooldown
-        if rule.cooldown_hours > 0:
-            last_reward = UserReward.query.filter_by(
-                user_id=user_id,
-                action_type=action
-            ).order_by(UserReward.created_at.desc()).first()
-            
-            if last_reward:
-                time_diff = datetime.now() - last_reward.created_at
-                if time_diff.total_seconds() < rule.cooldown_hours * 3600:
-                    return False
+        if rule.cooldown_hours > 0 and history['last_at']:
+            time_diff = datetime.now() - history['last_at']
+            if time_diff.total_seconds() < rule.cooldown_hours * 3600:
+                return False
         
         # Vérifier la limite quotidienne
-        if rule.max_per_day:
-            today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            today_count = UserReward.query.filter(
-                UserReward.user_id == user_id,
-                UserReward.action_type == action,
-                UserReward.created_at >= today_start
-            ).count()
-            
-            if today_count >= rule.max_per_day:
-                return False
+        if rule.max_per_day and history['today_count'] >= rule.max_per_day:
+            return False
         
         return True
     
     def _calculate_points(self, user_id: int, rule: RewardRule, 
-                         context: Dict = None) -> int:
+                         context: Dict = None, user_stats: UserStats = None) -> int:
         """Calcule les points à attribuer"""
         base_points = rule.points
         
         # Appliquer le multiplicateur
         points = int(base_points * rule.multiplier)
         
+        if user_stats is None:
+            user_stats = UserStats.query.filter_by(user_id=user_id).first()
+        
         # Bonus pour les streaks
         if rule.action == ActionType.STREAK_MAINTAIN:
-            user_stats = UserStats.query.filter_by(user_id=user_id).first()
             if user_stats:
                 streak_bonus = min(user_stats.login_streak * 2, 50)  # Max 50 points bonus
                 points = streak_bonus
         
         # Bonus de niveau utilisateur
-        user_stats = UserStats.query.filter_by(user_id=user_id).first()
         if user_stats and user_stats.current_level > 1:
             level_multiplier = 1 + (user_stats.current_level - 1) * 0.05  # 5% par niveau
             points = int(points * level_multiplier)
@@ -406,14 +497,16 @@ class GamificationEngine:
         return points
     
     def _update_user_stats(self, user_id: int, action: ActionType, 
-                          points: int, context: Dict = None):
+                          points: int, context: Dict = None,
+                          user_stats: UserStats = None) -> UserStats:
         """Met à jour les statistiques utilisateur"""
-        user_stats = UserStats.query.filter_by(user_id=user_id).first()
+        if user_stats is None:
+            user_stats = UserStats.query.filter_by(user_id=user_id).first()
         if not user_stats:
             user_stats = UserStats(user_id=user_id)
             db.session.add(user_stats)
         
-        # Ajouter les points
+        # Ajouter les points (stats_version est incrémenté au flush, voir UserStats)
         user_stats.total_points += points
         user_stats.available_points += points
         user_stats.experience_points += points
@@ -461,6 +554,19 @@ class GamificationEngine:
         
         # Vérifier le changement de niveau
         self._check_level_up(user_stats)
+        
+        # Reporter le gain sur les classements
+        from src.models.leaderboard import leaderboard_service
+        leaderboard_service.record_points(user_id, user_stats.total_points, points)
+        return user_stats
+    
+    def _level_for_xp(self, experience_points: int) -> int:
+        """Niveau correspondant à un total d'expérience"""
+        new_level = 1
+        for level, data in self.level_thresholds.items():
+            if experience_points >= data['xp_required'] and level > new_level:
+                new_level = level
+        return new_level
     
     def _check_level_up(self, user_stats: UserStats):
         """Vérifie et applique les montées de niveau"""
@@ -468,10 +574,7 @@ class GamificationEngine:
         current_xp = user_stats.experience_points
         
         # Trouver le niveau approprié
-        new_level = current_level
-        for level, data in self.level_thresholds.items():
-            if current_xp >= data['xp_required'] and level > new_level:
-                new_level = level
+        new_level = max(current_level, self._level_for_xp(current_xp))
         
         if new_level > current_level:
             user_stats.current_level = new_level
@@ -482,7 +585,7 @@ class GamificationEngine:
                 reward_type=RewardType.ACHIEVEMENT,
                 action_type=ActionType.EXPERIENCE,
                 description=f"Niveau {new_level} atteint !",
-                metadata={
+                meta_data={
                     'level': new_level,
                     'title': self.level_thresholds[new_level]['title'],
                     'benefits': self.level_thresholds[new_level]['benefits']
@@ -491,56 +594,39 @@ class GamificationEngine:
             db.session.add(level_reward)
     
     def _check_badges(self, user_id: int, action: ActionType, 
-                     context: Dict = None) -> List[UserReward]:
+                     context: Dict = None, user_stats: UserStats = None) -> List[UserReward]:
         """Vérifie et attribue les badges"""
         badges = []
-        user_stats = UserStats.query.filter_by(user_id=user_id).first()
+        if user_stats is None:
+            user_stats = UserStats.query.filter_by(user_id=user_id).first()
         
         if not user_stats:
             return badges
         
-        earned_badges = user_stats.badges_earned or []
-        
-        # Badge premier achat
-        if action == ActionType.PURCHASE and 'first_purchase' not in earned_badges:
-            badges.append(self._create_badge_reward(user_id, 'first_purchase'))
-            earned_badges.append('first_purchase')
-        
-        # Badge guerrier écologique
-        if (user_stats.eco_products_bought >= 10 and 
-            'eco_warrior' not in earned_badges):
-            badges.append(self._create_badge_reward(user_id, 'eco_warrior'))
-            earned_badges.append('eco_warrior')
-        
-        # Badge héros local
-        if (user_stats.local_products_bought >= 20 and 
-            'local_hero' not in earned_badges):
-            badges.append(self._create_badge_reward(user_id, 'local_hero'))
-            earned_badges.append('local_hero')
-        
-        # Badge maître des recettes
-        if (user_stats.recipes_shared >= 50 and 
-            'recipe_master' not in earned_badges):
-            badges.append(self._create_badge_reward(user_id, 'recipe_master'))
-            earned_badges.append('recipe_master')
-        
-        # Badge légende des séries
-        if (user_stats.login_streak >= 30 and 
-            'streak_legend' not in earned_badges):
-            badges.append(self._create_badge_reward(user_id, 'streak_legend'))
-            earned_badges.append('streak_legend')
-        
-        # Badge ambassadeur
-        if (user_stats.total_referrals >= 100 and 
-            'ambassador' not in earned_badges):
-            badges.append(self._create_badge_reward(user_id, 'ambassador'))
-            earned_badges.append('ambassador')
+        earned_badges = list(user_stats.badges_earned or [])
+        
+        for badge_key in self._qualifying_badges(user_stats):
+            if badge_key not in earned_badges:
+                badges.append(self._create_badge_reward(user_id, badge_key))
+                earned_badges.append(badge_key)
         
         # Mettre à jour la liste des badges
         user_stats.badges_earned = earned_badges
         
         return badges
     
+    def _qualifying_badges(self, user_stats) -> List[str]:
+        """Badges auxquels les compteurs de l'utilisateur donnent droit"""
+        criteria = [
+            ('first_purchase', user_stats.total_purchases >= 1),     # Premier achat
+            ('eco_warrior', user_stats.eco_products_bought >= 10),   # Guerrier écologique
+            ('local_hero', user_stats.local_products_bought >= 20),  # Héros local
+            ('recipe_master', user_stats.recipes_shared >= 50),      # Maître des recettes
+            ('streak_legend', user_stats.login_streak >= 30),        # Légende des séries
+            ('ambassador', user_stats.total_referrals >= 100),       # Ambassadeur
+        ]
+        return [badge_key for badge_key, qualifies in criteria if qualifies]
+    
     def _create_badge_reward(self, user_id: int, badge_key: str) -> UserReward:
         """Crée une récompense de badge"""
         badge_info = self.badges[badge_key]
@@ -551,7 +637,7 @@ class GamificationEngine:
             action_type=ActionType.ACHIEVEMENT,
             badge_name=badge_key,
             description=f"Badge obtenu: {badge_info['name']}",
-            metadata=badge_info
+            meta_data=badge_info
         )
     
     def _check_achievements(self, user_id: int, action: ActionType, 
@@ -563,11 +649,31 @@ class GamificationEngine:
     
     def get_user_dashboard(self, user_id: int) -> Dict:
         """Retourne le tableau de bord gamification de l'utilisateur"""
-        user_stats = UserStats.query.filter_by(user_id=user_id).first()
-        
-        if not user_stats:
+        return json.loads(self.get_user_dashboard_json(user_id))
+    
+    def get_user_dashboard_json(self, user_id: int) -> str:
+        """
+        Retourne le tableau de bord déjà sérialisé.
+        Seule la version des stats est lue tant qu'elle n'a pas changé :
+        ni hydratation ORM ni requête sur les récompenses récentes.
+        """
+        row = db.session.query(UserStats.stats_version).filter(UserStats.user_id == user_id).first()
+        if row is None:
             return self._create_default_dashboard(user_id)
         
+        cached = self.dashboard_cache.get(user_id, row[0] or 0)
+        if cached is not None:
+            return cached
+        
+        user_stats = UserStats.query.filter_by(user_id=user_id).first()
+        payload = json.dumps(self._build_user_dashboard(user_stats))
+        self.dashboard_cache.set(user_id, user_stats.stats_version or 0, payload)
+        return payload
+    
+    def _build_user_dashboard(self, user_stats: UserStats) -> Dict:
+        """Construit le tableau de bord à partir des stats"""
+        user_id = user_stats.user_id
+        
         # Calculer le progrès vers le niveau suivant
         current_level = user_stats.current_level
         next_level = current_level + 1
@@ -622,14 +728,14 @@ class GamificationEngine:
             'recent_rewards': self._get_recent_rewards(user_id, limit=5)
         }
     
-    def _create_default_dashboard(self, user_id: int) -> Dict:
+    def _create_default_dashboard(self, user_id: int) -> str:
         """Crée un tableau de bord par défaut pour un nouvel utilisateur"""
         # Créer les stats par défaut
         user_stats = UserStats(user_id=user_id)
         db.session.add(user_stats)
         db.session.commit()
         
-        return self.get_user_dashboard(user_id)
+        return self.get_user_dashboard_json(user_id)
     
     def _get_recent_rewards(self, user_id: int, limit: int = 5) -> List[Dict]:
         """Récupère les récompenses récentes"""
@@ -651,9 +757,7 @@ class GamificationEngine:
     def redeem_points(self, user_id: int, points_to_redeem: int, 
                      reward_type: str) -> Optional[UserReward]:
         """Échange des points contre des récompenses"""
-        user_stats = UserStats.query.filter_by(user_id=user_id).first()
-        
-        if not user_stats or user_stats.available_points < points_to_redeem:
+        if points_to_redeem <= 0:
             return None
         
         # Calculer la valeur de la récompense
@@ -666,6 +770,7 @@ class GamificationEngine:
                 reward_type=RewardType.DISCOUNT,
                 action_type=ActionType.PURCHASE,
                 discount_percentage=discount_percentage,
+                points_spent=points_to_redeem,
                 description=f"Réduction de {discount_percentage}% échangée",
                 expires_at=datetime.now() + timedelta(days=30)
             )
@@ -679,18 +784,33 @@ class GamificationEngine:
                 reward_type=RewardType.CASHBACK,
                 action_type=ActionType.PURCHASE,
                 cashback_amount=cashback_amount,
+                points_spent=points_to_redeem,
                 description=f"Cashback de {cashback_amount}€ échangé"
             )
         
         else:
             return None
         
-        # Déduire les points
-        user_stats.available_points -= points_to_redeem
+        # Déduire les points : vérification du solde et débit dans un seul UPDATE
+        # conditionnel, sans verrou ni risque de double dépense entre workers
+        debited = UserStats.query.filter(
+            UserStats.user_id == user_id,
+            UserStats.available_points >= points_to_redeem
+        ).update({
+            UserStats.available_points: UserStats.available_points - points_to_redeem,
+            UserStats.stats_version: UserStats.stats_version + 1
+        }, synchronize_session='fetch')
+        
+        if not debited:
+            return None
         
         db.session.add(reward)
         db.session.commit()
         
+        # Prévenir le sweeper de la nouvelle échéance
+        from src.models.expiry import expiry_sweeper
+        expiry_sweeper.schedule('reward', reward.id, reward.expires_at)
+        
         return reward
 
 # Instance globale du moteur de gamification
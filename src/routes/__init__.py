@@ -1,4 +1,7 @@
 """Routes package for CFA API."""
 from .user import user_bp
+from .recipe import recipe_bp
+from .search import search_bp
+from .i18n import i18n_bp
 
-__all__ = ['user_bp']
\ No newline at end of file
+__all__ = ['user_bp', 'recipe_bp', 'search_bp', 'i18n_bp']
\ No newline at end of file
@@ -0,0 +1,63 @@
+"""Translation bundle routes for CFA API."""
+import threading
+
+from flask import Blueprint, Response, jsonify, request, url_for
+
+from i18n import DEFAULT_LANGUAGE, i18n
+from .user import error_response
+
+i18n_bp = Blueprint('i18n', __name__)
+
+HTTP_NOT_FOUND = 404
+IMMUTABLE_MAX_AGE_SECONDS = 31536000
+
+_bundles = None
+_bundles_lock = threading.Lock()
+
+
+def get_bundles():
+    """Build the per-language bundles once per process."""
+    global _bundles
+    if _bundles is None:
+        with _bundles_lock:
+            if _bundles is None:
+                _bundles = i18n.build_bundles()
+    return _bundles
+
+
+@i18n_bp.route('/i18n/manifest.json', methods=['GET'])
+def bundle_manifest():
+    """Map each language to its content-hashed bundle URL (revalidated on every load)."""
+    manifest = {
+        'default': DEFAULT_LANGUAGE,
+        'bundles': {
+            language: url_for('i18n.translation_bundle', language=language, content_hash=bundle.content_hash)
+            for language, bundle in get_bundles().items()
+        }
+    }
+    response = jsonify(manifest)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@i18n_bp.route('/i18n/<language>.<content_hash>.json', methods=['GET'])
+def translation_bundle(language, content_hash):
+    """Serve one language's bundle, precompressed, cacheable forever under its hash."""
+    bundle = get_bundles().get(language)
+    if bundle is None or bundle.content_hash != content_hash:
+        return error_response('Unknown translation bundle', HTTP_NOT_FOUND)
+
+    encoding = next(
+        (name for name in ('br', 'gzip') if name in bundle.encodings and request.accept_encodings[name]),
+        'identity'
+    )
+    response = Response(bundle.encodings[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(f'{bundle.content_hash}-{encoding}')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response
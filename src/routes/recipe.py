@@ -0,0 +1,17 @@
+"""Recipe routes for CFA API."""
+from flask import Blueprint, request
+
+from recipe_feeds import FEEDS, recipe_feed_cache
+from .user import error_response
+
+recipe_bp = Blueprint('recipe', __name__)
+
+HTTP_NOT_FOUND = 404
+
+
+@recipe_bp.route('/recipes/feeds/<feed>', methods=['GET'])
+def recipe_feed(feed):
+    """Serve a precomputed featured/popular feed, honouring If-None-Match."""
+    if feed not in FEEDS:
+        return error_response('Unknown recipe feed', HTTP_NOT_FOUND)
+    return recipe_feed_cache.response(feed, request.args.get('lang', 'fr'))
@@ -0,0 +1,22 @@
+"""Search routes for CFA API."""
+from flask import Blueprint, jsonify, request
+
+from autocomplete import DEFAULT_LIMIT, autocomplete_index
+
+search_bp = Blueprint('search', __name__)
+
+
+@search_bp.route('/search/autocomplete', methods=['GET'])
+def autocomplete():
+    """Suggest product names and recipe titles for the search box."""
+    query = request.args.get('q', '')
+    language = request.args.get('lang', 'fr')
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+
+    suggestions = autocomplete_index.suggest(query, language, limit)
+    if suggestions is None:
+        # Not built at startup (e.g. BACKGROUND_SERVICES=false): concurrent requests share one build
+        autocomplete_index.ensure_ready()
+        suggestions = autocomplete_index.suggest(query, language, limit)
+
+    return jsonify({'query': query, 'suggestions': suggestions})
@@ -0,0 +1,48 @@
+"""
+Fixtures communes des tests CFA : application sur une base SQLite temporaire
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Le paquet src d'abord : les modules racine (recipe, ...) en dépendent circulairement
+import src  # noqa: E402,F401
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Application sans services d'arrière-plan, une base neuve par test"""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('BACKGROUND_SERVICES', 'false')
+    from src.models import db
+
+    app = src.create_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def count_queries(app):
+    """Compte les requêtes SQL émises dans un bloc `with count_queries() as queries:`"""
+    from src.models import db
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    return counter
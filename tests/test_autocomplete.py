@@ -0,0 +1,44 @@
+"""
+Tolérance aux fautes de l'autocomplétion
+"""
+
+import pytest
+
+import autocomplete
+from autocomplete import AutocompleteIndex, _LanguageVocabulary, _normalize
+
+@pytest.fixture
+def vocabulary():
+    vocabulary = _LanguageVocabulary()
+    for entry_id, text in enumerate(['Mangue', 'Manioc', 'Poulet coco', 'Poulet curry']):
+        vocabulary.add(('recipe', entry_id), text, popularity=0)
+    return vocabulary
+
+@pytest.mark.parametrize('query, expected', [
+    ('mnague', [('recipe', 0)]),
+    ('poulte col', [('recipe', 2)]),
+    ('poulet cury', [('recipe', 3)]),
+])
+def test_adjacent_transposition_counts_as_one_edit(vocabulary, query, expected):
+    assert vocabulary.suggest(_normalize(query), 8) == expected
+
+def test_short_words_must_match_exactly(vocabulary):
+    assert vocabulary.suggest('ma', 8) == [('recipe', 0), ('recipe', 1)]
+    assert vocabulary.suggest('am', 8) == []
+
+def test_short_query_memo_is_bounded(vocabulary, monkeypatch):
+    monkeypatch.setattr(autocomplete, 'MEMO_MAX_ENTRIES', 2)
+    index = AutocompleteIndex()
+    index.languages['fr'] = vocabulary
+    index.is_ready = True
+
+    first = index.suggest('ma')
+    assert index.suggest('ma') is first
+    index.suggest('po')
+    index.suggest('ma')
+    index.suggest('m')
+    assert list(index._memo) == [('fr', 'ma', 8), ('fr', 'm', 8)]
+    # Les requêtes plus longues ne sont pas mémorisées
+    assert index.suggest('poulet') == [{'text': 'Poulet coco', 'type': 'recipe', 'id': 2},
+                                       {'text': 'Poulet curry', 'type': 'recipe', 'id': 3}]
+    assert len(index._memo) == 2
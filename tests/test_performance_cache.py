@@ -0,0 +1,218 @@
+"""
+Caches en mémoire de performance.py
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from performance import (
+    SHARED_CACHE_PATH_ENV, IntelligentCache, PerformanceOptimizer, ShardedIntelligentCache,
+    SQLiteSharedCache, cached
+)
+
+def _mixed_size_values(count, seed=7):
+    """Petites valeurs en majorité, quelques grosses (jusqu'à 20 Ko)"""
+    rng = random.Random(seed)
+    for index in range(count):
+        size = rng.choice((10, 100, 1_000, 20_000)) if index % 10 == 0 else rng.randint(1, 500)
+        yield f'key-{rng.randrange(count // 2)}', 'x' * size
+
+def test_byte_budget_holds_under_mixed_size_workload():
+    cache = IntelligentCache(max_size=10_000, max_bytes=50_000)
+
+    for key, value in _mixed_size_values(5_000):
+        cache.set(key, value)
+        assert cache.total_bytes <= cache.max_bytes
+
+    assert cache.eviction_count > 0
+    assert cache.total_bytes == sum(entry.size for entry in cache.cache.values())
+
+def test_value_larger_than_budget_is_not_cached():
+    cache = IntelligentCache(max_bytes=1_000)
+    cache.set('small', 'x')
+
+    cache.set('huge', 'x' * 5_000)
+
+    assert cache.get('huge') is None
+    assert cache.get('small') == 'x'
+    assert cache.total_bytes <= cache.max_bytes
+
+def test_sharded_shrink_keeps_exactly_target_size():
+    cache = ShardedIntelligentCache(max_size=1_000, shards=7)
+    for index in range(500):
+        cache.set(f'key-{index}', index)
+
+    for target_size in (499, 333, 101, 10, 1, 0):
+        cache.shrink(target_size)
+        assert len(cache) == target_size
+
+def test_sharded_budgets_add_up_to_totals():
+    cache = ShardedIntelligentCache(max_size=100, max_bytes=1_000_003, shards=16)
+
+    assert sum(shard.max_size for shard in cache._shards) == 100
+    assert sum(shard.max_bytes for shard in cache._shards) == 1_000_003
+
+def test_concurrent_callers_share_one_computation():
+    calls = []
+    release = threading.Event()
+
+    @cached(ttl=60)
+    def slow(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(slow, 21) for _ in range(8)]
+        time.sleep(0.2)
+        release.set()
+        results = [future.result(5) for future in futures]
+
+    assert results == [42] * 8
+    assert calls == [21]
+
+def test_caller_arriving_after_a_fill_does_not_recompute(monkeypatch):
+    calls = []
+
+    @cached(ttl=60)
+    def double(value):
+        calls.append(value)
+        return value * 2
+
+    assert double(4) == 8
+    # Défaut vu juste avant que le vol précédent ne remplisse le cache
+    real_get = double.cache.get
+    lookups = []
+
+    def get_missing_first(key):
+        lookups.append(key)
+        return None if len(lookups) == 1 else real_get(key)
+
+    monkeypatch.setattr(double.cache, 'get', get_missing_first)
+
+    assert double(4) == 8
+    assert calls == [4]
+
+def test_none_is_cached_unless_disabled():
+    calls = []
+
+    @cached(ttl=60)
+    def missing(key):
+        calls.append(key)
+        return None
+
+    @cached(ttl=60, cache_none=False)
+    def missing_uncached(key):
+        calls.append(key)
+        return None
+
+    assert missing('a') is None and missing('a') is None
+    assert missing_uncached('b') is None and missing_uncached('b') is None
+    assert calls == ['a', 'b', 'b']
+
+def test_stale_value_is_served_while_refreshing_in_background():
+    calls = []
+
+    @cached(ttl=0, stale_ttl=60)
+    def current():
+        calls.append(None)
+        return 'old' if len(calls) == 1 else 'new'
+
+    assert current() == 'old'
+    time.sleep(0.01)
+    assert current() == 'old'
+
+    deadline = time.monotonic() + 5
+    while current() != 'new' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert current() == 'new'
+
+def test_recursive_call_on_same_key_raises_instead_of_deadlocking():
+    @cached(ttl=60)
+    def recursive(value):
+        return recursive(value)
+
+    with pytest.raises(RuntimeError):
+        recursive(1)
+
+def test_sampled_eviction_keeps_size_bounded_and_hot_keys_cached(monkeypatch):
+    monkeypatch.setattr('performance.random', random.Random(11))
+    cache = IntelligentCache(max_size=100)
+    hot_keys = [f'hot-{index}' for index in range(5)]
+    for key in hot_keys:
+        cache.set(key, key)
+
+    for index in range(2_000):
+        cache.set(f'cold-{index}', index)
+        assert len(cache) <= cache.max_size
+        # Les clés chaudes sont relues en continu : fréquence élevée, accès récent
+        for key in hot_keys:
+            assert cache.get(key) == key
+
+    assert len(cache) == cache.max_size
+    assert cache.eviction_count == 2_000 + len(hot_keys) - cache.max_size
+
+def test_sampled_eviction_prefers_stale_and_expired_entries(monkeypatch):
+    monkeypatch.setattr('performance.random', random.Random(3))
+    clock = [1_000.0]
+    monkeypatch.setattr('performance.time', SimpleNamespace(monotonic=lambda: clock[0], time=time.time))
+    # Échantillon couvrant tout le cache : la victime est toujours le plus faible score
+    cache = IntelligentCache(max_size=3, ttl_seconds=600, sample_size=50)
+    cache.set('expired', 0)
+    clock[0] += 300
+    cache.set('old', 1)
+    cache.set('recent', 2)
+    clock[0] += 301
+    cache.get('recent')
+
+    cache.set('new-1', 3)
+    assert 'expired' not in cache.cache
+    cache.set('new-2', 4)
+    assert set(cache.cache) == {'recent', 'new-1', 'new-2'}
+
+def test_l2_hit_is_promoted_to_the_local_cache(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    # Deux workers : chacun son L1, un fichier L2 commun
+    writer = IntelligentCache(l2=SQLiteSharedCache(path))
+    reader = IntelligentCache(l2=SQLiteSharedCache(path))
+    writer.set('recipe:1', {'title': 'Poulet coco'})
+
+    assert reader.get('recipe:1') == {'title': 'Poulet coco'}
+    assert reader.l2_hit_count == 1 and 'recipe:1' in reader.cache
+    assert reader.get('recipe:1') == {'title': 'Poulet coco'}
+    assert reader.l2_hit_count == 1 and reader.hit_count == 2
+
+def test_l2_entries_expire_with_their_ttl(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    writer = IntelligentCache(ttl_seconds=0.05, l2=SQLiteSharedCache(path))
+    reader = IntelligentCache(ttl_seconds=0.05, l2=SQLiteSharedCache(path))
+    writer.set('recipe:1', 'Poulet coco')
+    time.sleep(0.1)
+
+    assert reader.get('recipe:1') is None
+    assert reader.miss_count == 1 and reader.l2_hit_count == 0
+    assert reader.l2.purge_expired() == 1
+
+@pytest.mark.parametrize('unusable_path', ['missing-dir/shared.db', '.'])
+def test_unusable_shared_cache_path_falls_back_to_local_cache(tmp_path, unusable_path):
+    l2 = SQLiteSharedCache(str(tmp_path / unusable_path))
+    cache = IntelligentCache(l2=l2)
+
+    cache.set('recipe:1', 'Poulet coco')
+    assert cache.get('recipe:1') == 'Poulet coco'
+    assert cache.get('recipe:2') is None
+    assert l2.error_count == 2
+
+def test_unset_shared_cache_path_means_local_cache_only(monkeypatch):
+    monkeypatch.delenv(SHARED_CACHE_PATH_ENV, raising=False)
+    optimizer = PerformanceOptimizer(os.environ.get(SHARED_CACHE_PATH_ENV))
+
+    assert optimizer.cache.l2 is None and optimizer.query_optimizer.query_cache.l2 is None
+    optimizer.cache.set('recipe:1', 'Poulet coco')
+    assert optimizer.cache.get('recipe:1') == 'Poulet coco'
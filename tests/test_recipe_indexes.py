@@ -0,0 +1,79 @@
+"""
+Rattrapage des index de recettes en mémoire (écritures faites par un autre processus)
+"""
+
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from recipe import Recipe
+from recipe_bitmaps import RecipeBitmapIndex
+from recipe_cjk import CJKNgramIndex
+from src.models import db
+
+pytestmark = pytest.mark.usefixtures('app')
+
+def _add_recipe(**fields):
+    recipe = Recipe(is_published=True, ingredients=[], instructions=[], **fields)
+    db.session.add(recipe)
+    db.session.commit()
+    return recipe.id
+
+def test_refresh_picks_up_commits_stamped_before_the_watermark():
+    # Index d'un processus qui ne reçoit pas les écritures de celui-ci
+    index = CJKNgramIndex()
+    _add_recipe(title='Bibimbap', title_ko='비빔밥')
+    index.rebuild()
+
+    # Transaction longue d'un autre processus : updated_at antérieur au dernier passage
+    late_id = _add_recipe(title='Kimchi', title_ko='김치')
+    db.session.execute(text('UPDATE recipes SET updated_at = :stamp WHERE id = :id'),
+                       {'stamp': index.watermark - timedelta(seconds=30), 'id': late_id})
+    db.session.commit()
+
+    index.refresh()
+    assert index.lookup('김치', 'ko') == [late_id]
+
+def test_periodic_full_rebuild_drops_recipes_deleted_elsewhere():
+    index = CJKNgramIndex()
+    recipe_id = _add_recipe(title='Mapo tofu', title_zh='麻婆豆腐')
+    index.rebuild()
+
+    db.session.execute(text('DELETE FROM recipes WHERE id = :id'), {'id': recipe_id})
+    db.session.commit()
+    index.refresh()
+    assert index.lookup('豆腐', 'zh') == [recipe_id]
+
+    index.rebuilt_at -= index.full_rebuild_interval_seconds
+    index.refresh()
+    assert index.lookup('豆腐', 'zh') == []
+
+def test_lookup_gives_up_past_max_candidates():
+    index = CJKNgramIndex(max_candidates=2)
+    for _ in range(3):
+        _add_recipe(title='Tteokbokki', title_ko='떡볶이')
+    index.rebuild()
+    assert index.lookup('떡볶이', 'ko') is None
+
+    index.max_candidates = 3
+    assert len(index.lookup('떡볶이', 'ko')) == 3
+
+def test_bitmap_refresh_catches_late_commits_and_remote_deletes():
+    index = RecipeBitmapIndex()
+    kept_id = _add_recipe(title='Carri poulet', cuisine_type='creole')
+    deleted_id = _add_recipe(title='Rougail', cuisine_type='creole')
+    index.rebuild()
+
+    late_id = _add_recipe(title='Cari thon', cuisine_type='creole')
+    db.session.execute(text('UPDATE recipes SET updated_at = :stamp WHERE id = :id'),
+                       {'stamp': index.watermark - timedelta(seconds=30), 'id': late_id})
+    db.session.execute(text('DELETE FROM recipes WHERE id = :id'), {'id': deleted_id})
+    db.session.commit()
+
+    index.refresh()
+    assert index.match({'cuisine_type': 'creole'}) == [kept_id, deleted_id, late_id]
+
+    index.rebuilt_at -= index.full_rebuild_interval_seconds
+    index.refresh()
+    assert index.match({'cuisine_type': 'creole'}) == [kept_id, late_id]
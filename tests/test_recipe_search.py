@@ -0,0 +1,59 @@
+"""
+Index de recherche dérivés des recettes sur une base existante
+"""
+
+import pytest
+from sqlalchemy import text
+
+from recipe import Recipe, RecipeSearch
+from recipe_fts import recipe_fulltext_index
+from recipe_products import recipe_product_index, recipe_products
+from src.models import db
+
+pytestmark = pytest.mark.usefixtures('app')
+
+def _seed_recipes():
+    db.session.add_all([
+        Recipe(title='Poulet coco', is_published=True, ingredients=['poulet', 'lait de coco'], instructions=[],
+               featured_products=[7]),
+        Recipe(title='Rougail saucisse', is_published=True, ingredients=['saucisse'], instructions=[],
+               featured_products=[7, 9]),
+    ])
+    db.session.commit()
+
+def _forget_fulltext_index():
+    """Base antérieure à l'index : table présente mais vide"""
+    db.session.execute(text('DELETE FROM recipes_fts'))
+    db.session.commit()
+    recipe_fulltext_index._populated.clear()
+
+def test_ranked_search_falls_back_to_like_until_index_is_built():
+    _seed_recipes()
+    _forget_fulltext_index()
+
+    results = RecipeSearch.search_recipes_ranked('poulet')
+    assert [(result['recipe']['title'], result['score']) for result in results] == [('Poulet coco', None)]
+
+    assert recipe_fulltext_index.ensure_built() == 2
+    results = RecipeSearch.search_recipes_ranked('poulet')
+    assert [result['recipe']['title'] for result in results] == ['Poulet coco']
+    assert results[0]['score'] is not None
+
+def test_ensure_built_leaves_a_populated_index_alone():
+    _seed_recipes()
+
+    assert recipe_fulltext_index.ensure_built() == 0
+
+
+def test_product_index_is_backfilled_for_existing_recipes():
+    _seed_recipes()
+    db.session.execute(recipe_products.delete())
+    db.session.commit()
+    assert RecipeSearch.get_recipes_for_product(product_id=7) == []
+
+    assert recipe_product_index.ensure_built() == 2
+    assert recipe_product_index.ensure_built() == 0
+    assert {recipe.title for recipe in RecipeSearch.get_recipes_for_product(product_id=7)} == {
+        'Poulet coco', 'Rougail saucisse'
+    }
+    assert [recipe.title for recipe in RecipeSearch.get_recipes_for_product(product_id=9)] == ['Rougail saucisse']
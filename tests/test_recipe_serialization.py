@@ -0,0 +1,67 @@
+"""
+Sérialisation des listes de recettes : nombre de requêtes indépendant de la taille de la page
+"""
+
+from decimal import Decimal
+
+from recipe import Recipe
+from src.models import db
+from src.models.base import ProductCategory
+from src.models.product import Product
+from src.models.review import Review
+from src.models.user import User
+
+PAGE_SIZE = 20
+PRODUCTS_PER_RECIPE = 3
+
+def _seed_page():
+    seller = User('vendeur@example.com', 'mot-de-passe')
+    db.session.add(seller)
+    db.session.flush()
+
+    category = next(iter(ProductCategory))
+    products = [
+        Product(name=f'Produit {index}', category=category, seller_id=seller.id,
+                base_price=Decimal('5.00'), current_price=Decimal('5.00'))
+        for index in range(PAGE_SIZE * PRODUCTS_PER_RECIPE)
+    ]
+    db.session.add_all(products)
+    db.session.flush()
+    db.session.add_all(
+        Review(product_id=product.id, user_id=seller.id, rating=rating)
+        for product in products for rating in (3, 5)
+    )
+
+    for index in range(PAGE_SIZE):
+        featured = products[index * PRODUCTS_PER_RECIPE:(index + 1) * PRODUCTS_PER_RECIPE]
+        db.session.add(Recipe(
+            title=f'Recette {index}', title_en=f'Recipe {index}',
+            ingredients=['riz'], instructions=['cuire'], is_published=True,
+            featured_products=[product.id for product in featured]
+        ))
+    db.session.commit()
+    db.session.expunge_all()
+
+def test_recipe_page_with_products_uses_one_product_query(count_queries):
+    _seed_page()
+    recipes = Recipe.query.options(*Recipe.language_load_options('fr')).limit(PAGE_SIZE).all()
+
+    with count_queries() as queries:
+        serialized = Recipe.to_dict_list(recipes, 'fr', include_products=True)
+
+    assert len(queries) == 1
+    assert len(serialized) == PAGE_SIZE
+    for recipe in serialized:
+        assert len(recipe['featured_products']) == PRODUCTS_PER_RECIPE
+        assert all(product['average_rating'] == 4.0 for product in recipe['featured_products'])
+        assert all(product['review_count'] == 2 for product in recipe['featured_products'])
+
+def test_recipe_page_loads_deferred_language_in_one_query(count_queries):
+    _seed_page()
+    recipes = Recipe.query.limit(PAGE_SIZE).all()
+
+    with count_queries() as queries:
+        serialized = Recipe.to_dict_list(recipes, 'en')
+
+    assert len(queries) == 1
+    assert [recipe['title'] for recipe in serialized] == [f'Recipe {index}' for index in range(PAGE_SIZE)]
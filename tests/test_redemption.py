@@ -0,0 +1,75 @@
+"""
+Échanges de points et utilisations de coupons concurrents (UPDATE conditionnels)
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from src.models import db
+from src.models.base import DiscountType
+from src.models.coupon import Coupon
+from src.models.rewards import UserReward, UserStats, gamification_engine
+from src.models.user import User
+
+THREADS = 8
+ATTEMPTS_PER_THREAD = 5
+
+def _run_concurrently(app, attempt):
+    """Lance THREADS x ATTEMPTS_PER_THREAD appels, chaque thread avec sa propre session"""
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        with app.app_context():
+            start.wait()
+            try:
+                return [attempt() for _ in range(ATTEMPTS_PER_THREAD)]
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        futures = [executor.submit(worker) for _ in range(THREADS)]
+        return [outcome for future in futures for outcome in future.result(30)]
+
+def test_concurrent_redemptions_never_overdraw(app):
+    user = User('client@example.com', 'mot-de-passe')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(UserStats(user_id=user.id, available_points=1_000, total_points=1_000))
+    db.session.commit()
+    user_id = user.id
+
+    def redeem():
+        return gamification_engine.redeem_points(user_id, 300, 'discount') is not None
+
+    outcomes = _run_concurrently(app, redeem)
+
+    db.session.expire_all()
+    assert outcomes.count(True) == 3
+    assert UserStats.query.filter_by(user_id=user_id).one().available_points == 100
+    assert UserReward.query.filter_by(user_id=user_id).count() == 3
+
+def test_concurrent_coupon_use_never_exceeds_usage_limit(app):
+    coupon = Coupon(code='BIENVENUE', discount_type=DiscountType.PERCENTAGE, discount_value=Decimal('10'),
+                    usage_limit=7, used_count=0, is_active=True,
+                    valid_from=datetime.utcnow() - timedelta(days=1),
+                    valid_until=datetime.utcnow() + timedelta(days=1))
+    db.session.add(coupon)
+    db.session.commit()
+    coupon_id = coupon.id
+
+    def use():
+        try:
+            db.session.get(Coupon, coupon_id).use_coupon()
+            db.session.commit()
+            return True
+        except ValueError:
+            db.session.rollback()
+            return False
+
+    outcomes = _run_concurrently(app, use)
+
+    db.session.expire_all()
+    assert outcomes.count(True) == 7
+    assert db.session.get(Coupon, coupon_id).used_count == 7
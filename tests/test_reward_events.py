@@ -0,0 +1,61 @@
+"""
+File d'événements de gamification : idempotence et réclamation des événements
+"""
+
+import pytest
+
+from src.models import db
+from src.models.reward_events import GamificationEvent, GamificationWorkerPool
+from src.models.rewards import ActionType, RewardType, UserReward, gamification_engine
+from src.models.user import User
+
+pytestmark = pytest.mark.usefixtures('app')
+
+PURCHASE_CONTEXT = {'min_amount': 20, 'amount': 25}
+
+def _create_user():
+    user = User('client@example.com', 'mot-de-passe')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def _points_rewards(user_id):
+    return UserReward.query.filter_by(user_id=user_id, reward_type=RewardType.POINTS).count()
+
+def test_action_is_queued_not_processed_inline():
+    user_id = _create_user()
+
+    event = gamification_engine.process_user_action(user_id, ActionType.PURCHASE, PURCHASE_CONTEXT,
+                                                    idempotency_key='order:1:purchase')
+    duplicate = gamification_engine.process_user_action(user_id, ActionType.PURCHASE, PURCHASE_CONTEXT,
+                                                        idempotency_key='order:1:purchase')
+
+    assert duplicate.id == event.id
+    assert event.processed_at is None
+    assert _points_rewards(user_id) == 0
+
+def test_drain_once_is_idempotent(app):
+    user_id = _create_user()
+    for order_id in range(3):
+        GamificationEvent.enqueue(user_id, ActionType.PURCHASE, PURCHASE_CONTEXT, f'order:{order_id}:purchase')
+    pool = GamificationWorkerPool(app, worker_count=1)
+
+    assert pool.drain_once() == 3
+    assert pool.drain_once() == 0
+    assert _points_rewards(user_id) == 3
+    assert GamificationEvent.query.filter(GamificationEvent.processed_at.is_(None)).count() == 0
+
+def test_event_claimed_by_another_worker_is_not_processed_twice(app):
+    user_id = _create_user()
+    GamificationEvent.enqueue(user_id, ActionType.PURCHASE, PURCHASE_CONTEXT, 'order:1:purchase')
+    event_ids = [event_id for (event_id,) in db.session.query(GamificationEvent.id)]
+    first, second = GamificationWorkerPool(app, worker_count=1), GamificationWorkerPool(app, worker_count=1)
+
+    # Les deux workers ont lu le même événement en attente ; le premier le réclame et valide
+    assert user_id in first._claim_and_process(event_ids)
+    db.session.commit()
+    # La réclamation conditionnelle du second ne touche aucune ligne
+    assert second._claim_and_process(event_ids) == {}
+    db.session.commit()
+
+    assert _points_rewards(user_id) == 1
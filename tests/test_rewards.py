@@ -0,0 +1,44 @@
+"""
+Versions des UserStats et échanges de points concurrents
+"""
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from src.models import db
+from src.models.rewards import ActionType, UserStats, gamification_engine
+from src.models.user import User
+
+pytestmark = pytest.mark.usefixtures('app')
+
+def _create_user(email='client@example.com', available_points=0):
+    user = User(email, 'mot-de-passe')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(UserStats(user_id=user.id, available_points=available_points,
+                             total_points=available_points, experience_points=available_points))
+    db.session.commit()
+    return user.id
+
+def test_each_stats_change_gets_a_new_version():
+    user_id = _create_user()
+    version = UserStats.query.filter_by(user_id=user_id).one().stats_version
+
+    gamification_engine.process_user_actions(user_id, [(ActionType.REVIEW, {})])
+    db.session.commit()
+
+    assert UserStats.query.filter_by(user_id=user_id).one().stats_version == version + 1
+
+def test_concurrent_stats_update_is_rejected():
+    user_id = _create_user()
+    stats = UserStats.query.filter_by(user_id=user_id).one()
+    stats.total_points += 10
+
+    # Un autre processus publie une nouvelle version entre la lecture et l'écriture
+    with db.engine.begin() as connection:
+        connection.execute(UserStats.__table__.update()
+                           .where(UserStats.__table__.c.user_id == user_id)
+                           .values(stats_version=UserStats.__table__.c.stats_version + 1))
+
+    with pytest.raises(StaleDataError):
+        db.session.commit()